@@ -0,0 +1,126 @@
+"""
+Time the item cache against the shipped cache/item.db: how long it takes to open, to
+get every item once (like the first pull after opening does), and to write new items.
+
+    python scripts/benchmark_cache.py [--item-db cache/item.db]
+
+The "per-row" numbers are the old way, with one SELECT per item and one transaction
+per inserted item. The database is copied to a temporary directory first, so the
+shipped one isn't touched.
+"""
+
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import click
+from fixtures import ITEM_DB_PATH, cached_item_ids
+
+from wowauction.cache import Cache
+from wowauction.item import Item
+
+
+def timed(name: str, fn: Callable[[], object]) -> None:
+    start = time.perf_counter()
+    fn()
+    print(f"{name:>28}: {(time.perf_counter() - start) * 1000:,.1f}ms")
+
+
+def per_row_get(path: Path, ids: list[int]) -> None:
+    con = sqlite3.Connection(path)
+    con.row_factory = sqlite3.Row
+    for id_ in ids:
+        with con:
+            con.execute(
+                "SELECT * FROM item WHERE item.id = :id", {"id": id_}
+            ).fetchone()
+    con.close()
+
+
+def per_row_insert(path: Path, items: list[Item]) -> None:
+    con = sqlite3.Connection(path)
+    for item in items:
+        with con:
+            con.execute(
+                "INSERT INTO item "
+                "(id, name, quality, rank, major, minor, patch, build) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    item.id_,
+                    item.name,
+                    item.quality,
+                    item.rank,
+                    item.major,
+                    item.minor,
+                    item.patch,
+                    item.build,
+                ),
+            )
+    con.close()
+
+
+def preloaded_get(path: Path, ids: list[int]) -> None:
+    with Cache.open(path) as cache:
+        cache.get_many(ids)
+
+
+def batched_insert(path: Path, items: list[Item]) -> None:
+    with Cache.open(path) as cache:
+        for item in items:
+            cache.insert(item)
+
+
+def new_items(first_id: int, count: int) -> list[Item]:
+    return [
+        Item(
+            id_=first_id + offset,
+            name=f"Benchmark Item {offset}",
+            quality=1,
+            rank=None,
+            major=10,
+            minor=0,
+            patch=2,
+            build=46157,
+        )
+        for offset in range(count)
+    ]
+
+
+@click.command()
+@click.option(
+    "--item-db",
+    default=ITEM_DB_PATH,
+    type=click.Path(exists=True, path_type=Path),
+    show_default=True,
+)
+@click.option("--insert-count", default=500, type=int, show_default=True)
+def main(item_db: Path, insert_count: int) -> None:
+    ids = cached_item_ids(item_db)
+    print(f"{len(ids):,} items in {item_db}")
+    first_new_id = max(ids) + 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        per_row_path = Path(tmp_dir) / "per_row.db"
+        preloaded_path = Path(tmp_dir) / "preloaded.db"
+        shutil.copy(item_db, per_row_path)
+        shutil.copy(item_db, preloaded_path)
+
+        timed("per-row get of every item", lambda: per_row_get(per_row_path, ids))
+        timed("open and get every item", lambda: preloaded_get(preloaded_path, ids))
+        timed(
+            f"per-row insert of {insert_count:,}",
+            lambda: per_row_insert(per_row_path, new_items(first_new_id, insert_count)),
+        )
+        timed(
+            f"batched insert of {insert_count:,}",
+            lambda: batched_insert(
+                preloaded_path, new_items(first_new_id, insert_count)
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare the peak memory of parsing a commodities payload all at once (the old
+`response.json()` way) against the streaming parser in `wowauction.jsonstream`.
+
+    python scripts/benchmark_parse_memory.py [--payload recorded.json]
+
+Without `--payload`, a synthetic payload is generated (see fixtures.py). The payload is
+read from disk in chunks like it would arrive over the network, so that the body itself
+isn't counted for the streaming parser.
+"""
+
+import json
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
+import click
+from fixtures import load_or_generate
+
+from wowauction.jsonstream import iter_array
+
+CHUNK_SIZE = 64 * 1024
+
+
+def read_chunks(path: Path) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+def parse_whole(path: Path) -> int:
+    body = b"".join(read_chunks(path))
+    count = 0
+    for _ in json.loads(body)["auctions"]:
+        count += 1
+    return count
+
+
+def parse_streaming(path: Path) -> int:
+    count = 0
+    for _ in iter_array(read_chunks(path), "auctions"):
+        count += 1
+    return count
+
+
+def measure(name: str, parse: Callable[[Path], int], path: Path) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = parse(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>10}: {count:,} auctions in {elapsed:.2f}s, "
+        f"peak {peak / 1024 / 1024:,.1f} MiB"
+    )
+
+
+@click.command()
+@click.option("--payload", type=click.Path(exists=True, path_type=Path))
+@click.option("--auction-count", default=300_000, type=int, show_default=True)
+def main(payload: Path | None, auction_count: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = payload
+        if path is None:
+            path = Path(tmp_dir) / "commodities.json"
+            path.write_bytes(load_or_generate(None, auction_count))
+        print(f"payload: {path.stat().st_size / 1024 / 1024:,.1f} MiB")
+
+        measure("whole", parse_whole, path)
+        measure("streaming", parse_streaming, path)
+
+
+if __name__ == "__main__":
+    main()
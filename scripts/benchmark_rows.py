@@ -0,0 +1,123 @@
+"""
+Time how fast `VMAgentAPI.export_item_summaries` renders CSV rows, against the
+per-row rule path it replaced, on the summaries of a synthetic commodities snapshot.
+
+    python scripts/benchmark_rows.py [--auction-count 300000] [--repeat 5]
+
+The reference path builds a list of `_CSVRule`s for every row and runs each one
+through `csv.writer`, like every row used to be. Both paths are checked to produce the
+same rows before they're timed. The best of `--repeat` runs is reported, so the new
+path is timed with its labels already rendered, as they are after the first pull.
+"""
+
+import shutil
+import tempfile
+import time
+from collections.abc import Callable, Mapping
+from pathlib import Path
+
+import click
+from fixtures import ITEM_DB_PATH, synthetic_commodities_payload
+
+from wowauction.cache import Cache
+from wowauction.item import Item
+from wowauction.jsonstream import iter_array
+from wowauction.snapshot import AuctionSnapshotBuilder
+from wowauction.summary import ItemSummaries, summarize
+from wowauction.vmagent import ExportBatch, VMAgentAPI, _CSVRule
+
+
+def reference_rows(
+    batch: ExportBatch, items: Mapping[int, Item], summaries: ItemSummaries
+) -> None:
+    for item_id, quantiles, min_gold, sum_gold, count in zip(
+        summaries.item_id.tolist(),
+        summaries.quantiles_gold.tolist(),
+        summaries.min_gold.tolist(),
+        summaries.sum_gold.tolist(),
+        summaries.count.tolist(),
+    ):
+        item = items[item_id]
+        item_rules = [
+            _CSVRule("label", "region", summaries.region),
+            _CSVRule("label", "id", item.id_),
+            _CSVRule("label", "name", item.name),
+            _CSVRule("label", "quality", item.quality),
+            _CSVRule("label", "rank", item.rank),
+            _CSVRule("label", "major", item.major),
+            _CSVRule("label", "minor", item.minor),
+            _CSVRule("label", "patch", item.patch),
+            _CSVRule("label", "build", item.build),
+        ]
+        for phi, quantile in zip(summaries.phis, quantiles):
+            batch.add(
+                [
+                    *item_rules,
+                    _CSVRule("label", "quantile", phi),
+                    _CSVRule("metric", "auction_price_gold", quantile),
+                    _CSVRule("time", "unix_s", int(summaries.timestamp)),
+                ]
+            )
+        batch.add(
+            [
+                *item_rules,
+                _CSVRule("metric", "auction_price_gold_sum", sum_gold),
+                _CSVRule("metric", "auction_price_gold_count", count),
+                _CSVRule("time", "unix_s", int(summaries.timestamp)),
+            ]
+        )
+        batch.add(
+            [
+                *item_rules,
+                _CSVRule("metric", "auction_price_gold_min", min_gold),
+                _CSVRule("time", "unix_s", int(summaries.timestamp)),
+            ]
+        )
+
+
+def rows_per_second(
+    render: Callable[[ExportBatch], None], repeat: int
+) -> tuple[float, ExportBatch]:
+    best_seconds = float("inf")
+    for _ in range(repeat):
+        batch = ExportBatch()
+        start = time.perf_counter()
+        render(batch)
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+    return batch.row_count / best_seconds, batch
+
+
+@click.command()
+@click.option("--auction-count", default=300_000, type=int, show_default=True)
+@click.option("--repeat", default=5, type=int, show_default=True)
+def main(auction_count: int, repeat: int) -> None:
+    payload = synthetic_commodities_payload(auction_count=auction_count)
+    builder = AuctionSnapshotBuilder()
+    for obj in iter_array([payload], "auctions"):
+        builder.add(obj)
+    summaries = summarize(builder.build(timestamp=time.time(), region="us"))
+
+    # opening the cache can migrate it, so open a copy of the shipped one
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        item_db_path = Path(tmp_dir) / "item.db"
+        shutil.copy(ITEM_DB_PATH, item_db_path)
+        with Cache.open(item_db_path) as cache:
+            items = cache.get_many(summaries.item_id.tolist())
+
+    vmagent_api = VMAgentAPI(host="localhost", port=8429)
+    reference_speed, reference_batch = rows_per_second(
+        lambda batch: reference_rows(batch, items, summaries), repeat
+    )
+    speed, batch = rows_per_second(
+        lambda batch: vmagent_api.export_item_summaries(batch, items, summaries),
+        repeat,
+    )
+    assert reference_batch.rows_for_format == batch.rows_for_format
+
+    print(f"{batch.row_count:,} rows for {len(summaries):,} items")
+    print(f"{'per-row rules':>20}: {reference_speed:,.0f} rows/s")
+    print(f"{'pre-rendered labels':>20}: {speed:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
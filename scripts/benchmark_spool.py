@@ -0,0 +1,151 @@
+"""
+Time the export of some pulls to a struggling stand-in for vmagent (see vmsink.py),
+posted directly against appended to a spool (see wowauction.spool) and drained in the
+background, and check that the spool gets every row through.
+
+    python scripts/benchmark_spool.py [--pulls 5] [--rows 40000]
+        [--delay-seconds 0.05] [--failure-rate 0.3]
+
+The rows are synthetic, split into import requests like a pull's. The direct export
+gives up at the first failed request, like a pull does. The spooled one is also
+checked after a torn write: a record cut off halfway (like a crash mid-append leaves)
+is dropped when the spool is opened again, and everything before it still drains.
+"""
+
+from __future__ import annotations
+
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import cast
+
+import anyio
+import click
+import httpx
+from vmsink import VMSink
+
+from wowauction.spool import ExportSpool, drain
+from wowauction.vmagent import ExportBatch, ImportRequest, VMAgentAPI
+
+
+def synthetic_requests(vmagent_api: VMAgentAPI, row_count: int) -> list[ImportRequest]:
+    batch = ExportBatch()
+    for id_ in range(row_count):
+        batch.add_metrics(
+            {"region": "us", "id": id_},
+            {"auction_price_gold_min": round(random.uniform(0.01, 1000), 2)},
+        )
+    return list(vmagent_api.requests(batch))
+
+
+async def export_directly(
+    vmagent_api: VMAgentAPI, pulls: list[list[ImportRequest]]
+) -> tuple[list[float], int]:
+    seconds = []
+    failed_pull_count = 0
+    for requests in pulls:
+        start = time.perf_counter()
+        try:
+            async with anyio.create_task_group() as task_group:
+                for request in requests:
+                    task_group.start_soon(vmagent_api.post, request)
+        except* httpx.HTTPError:
+            failed_pull_count += 1
+        seconds.append(time.perf_counter() - start)
+    return seconds, failed_pull_count
+
+
+async def export_spooled(
+    vmagent_api: VMAgentAPI, pulls: list[list[ImportRequest]]
+) -> tuple[list[float], float, float]:
+    assert vmagent_api.spool is not None
+    spool = vmagent_api.spool
+    seconds = []
+    max_lag_seconds = 0.0
+    start_all = time.perf_counter()
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(drain, spool, vmagent_api, 100_000, 8 * 1024 * 1024, 1.0)
+        for requests in pulls:
+            start = time.perf_counter()
+            async with anyio.create_task_group() as export_group:
+                for request in requests:
+                    export_group.start_soon(vmagent_api.post, request)
+            seconds.append(time.perf_counter() - start)
+        while spool.pending_bytes:
+            max_lag_seconds = max(max_lag_seconds, spool.lag_seconds)
+            await anyio.sleep(0.05)
+        task_group.cancel_scope.cancel()
+    return seconds, time.perf_counter() - start_all, max_lag_seconds
+
+
+async def run(
+    pulls: int, rows: int, delay_seconds: float, failure_rate: float, directory: Path
+) -> None:
+    sink = VMSink(delay_seconds=delay_seconds, failure_rate=failure_rate)
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(sink.serve))
+        vmagent_api = VMAgentAPI(host="127.0.0.1", port=port)
+        requests = [synthetic_requests(vmagent_api, rows) for _ in range(pulls)]
+        total_rows = sum(request.row_count for r in requests for request in r)
+        print(
+            f"{pulls} pulls of {len(requests[0]):,} requests, {total_rows:,} rows, to "
+            f"a sink that takes {delay_seconds * 1000:,.0f}ms and fails "
+            f"{failure_rate:.0%} of requests"
+        )
+
+        seconds, failed_pull_count = await export_directly(vmagent_api, requests)
+        print(
+            f"  direct: median {sorted(seconds)[len(seconds) // 2] * 1000:,.1f}ms a "
+            f"pull, {failed_pull_count} of {pulls} pulls failed, "
+            f"{sink.counts.row_count:,} of {total_rows:,} rows got through"
+        )
+
+        sink.counts.row_count = 0
+        with ExportSpool.open(directory / "spool") as spool:
+            spooled_api = VMAgentAPI(host="127.0.0.1", port=port, spool=spool)
+            seconds, drain_seconds, max_lag = await export_spooled(
+                spooled_api, requests
+            )
+        print(
+            f" spooled: median {sorted(seconds)[len(seconds) // 2] * 1000:,.1f}ms a "
+            f"pull, drained in {drain_seconds:,.2f}s with a lag of at most "
+            f"{max_lag:,.2f}s, {sink.counts.row_count:,} of {total_rows:,} rows got "
+            f"through"
+        )
+        assert sink.counts.row_count == total_rows
+
+        # a torn write at the end of the last segment
+        sink.counts.row_count = 0
+        with ExportSpool.open(directory / "torn") as spool:
+            spool.write(requests[0])
+            segment = max((directory / "torn").glob("*.seg"))
+        with segment.open("ab") as f:
+            f.write(segment.read_bytes()[:100])
+        with ExportSpool.open(directory / "torn") as spool:
+            spooled_api = VMAgentAPI(host="127.0.0.1", port=port, spool=spool)
+            await export_spooled(spooled_api, [])
+        first_pull_rows = sum(request.row_count for request in requests[0])
+        print(
+            f"    torn: {sink.counts.row_count:,} of {first_pull_rows:,} rows got "
+            "through after a torn write"
+        )
+        assert sink.counts.row_count == first_pull_rows
+
+        task_group.cancel_scope.cancel()
+
+
+@click.command()
+@click.option("--pulls", default=5, type=click.IntRange(min=1), show_default=True)
+@click.option("--rows", default=40_000, type=click.IntRange(min=1), show_default=True)
+@click.option("--delay-seconds", default=0.05, type=float, show_default=True)
+@click.option(
+    "--failure-rate", default=0.3, type=click.FloatRange(0, 0.99), show_default=True
+)
+def main(pulls: int, rows: int, delay_seconds: float, failure_rate: float) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        anyio.run(run, pulls, rows, delay_seconds, failure_rate, Path(directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Time every stage of a pull on a fixture, without touching Blizzard, Wowhead or a real
+vmagent, and write the results as JSON so that runs can be compared.
+
+    python scripts/benchmark_suite.py [--payload recorded.json] [--json results.json]
+    python scripts/benchmark_suite.py --compare baseline.json [--max-regression 0.25]
+
+The scenarios are:
+
+- parse: the commodities payload, streamed into a snapshot
+- enrich: the cached items of the snapshot, and the auctions of the matching ones
+- group: the snapshot split into one snapshot per item
+- summary: `summarize` of the matching auctions
+- depth: `depth` of the matching auctions
+- render: the summary, depth and market rows, split into import requests
+- export: the import requests, posted to a local stand-in for vmagent (see vmsink.py)
+- scrape: a gzipped GET of /metrics, with the rows of the render scenario on the page
+- pull: `run_pull` from the payload to the stand-in, like `inner_loop` does each period
+- pull-inline: the same, but parsing and summarizing on the event loop instead of in
+  worker processes
+
+The pulls also report the longest the event loop went without running a waiting task.
+
+The payload is synthetic unless `--payload` is given (see fixtures.py), and items come
+from a copy of the shipped cache/item.db, so there are no Wowhead lookups. By default
+the synthetic payload has every cached item in it, so that some of them match the
+filter of `matching_items`. Each scenario runs once to warm up, then `--rounds` more
+times.
+
+With `--compare`, the median of each scenario is checked against the one in an
+earlier results file, and the script exits with status 1 if any of them got slower by
+more than `--max-regression` (a fraction).
+"""
+
+from __future__ import annotations
+
+import functools
+import io
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Any, cast
+
+import anyio
+import click
+import httpx
+import numpy as np
+from attrs import define, evolve, frozen
+from fixtures import ITEM_DB_PATH, FixtureBlizzardAPI, load_or_generate
+from vmsink import VMSink
+
+from wowauction.cache import Cache
+from wowauction.depth import depth
+from wowauction.exposition import MetricsPage, render_lines
+from wowauction.jsonstream import iter_array
+from wowauction.market import MarketTracker
+from wowauction.pipeline import PullOptions, matching_items, run_pull
+from wowauction.snapshot import AuctionSnapshotBuilder
+from wowauction.summary import summarize
+from wowauction.vmagent import ExportBatch, ImportRequest, VMAgentAPI
+
+# the payload is fed to the parser in pieces of this size, like it arrives over the
+# network
+CHUNK_SIZE = 64 * 1024
+
+
+def payload_chunks(payload: bytes) -> list[bytes]:
+    return [
+        payload[start : start + CHUNK_SIZE]
+        for start in range(0, len(payload), CHUNK_SIZE)
+    ]
+
+
+@define
+class LoopStall:
+    """The longest the event loop was blocked while `watch` ran."""
+
+    interval_seconds: float = 0.001
+    max_seconds: float = 0.0
+
+    async def watch(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await anyio.sleep(self.interval_seconds)
+            late = time.perf_counter() - start - self.interval_seconds
+            self.max_seconds = max(self.max_seconds, late)
+
+
+@frozen
+class ScenarioResult:
+    name: str
+    seconds: list[float]
+    extra_info: dict[str, Any]
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "stats": {
+                "min": min(self.seconds),
+                "max": max(self.seconds),
+                "mean": statistics.fmean(self.seconds),
+                "median": statistics.median(self.seconds),
+                "rounds": len(self.seconds),
+            },
+            "extra_info": self.extra_info,
+        }
+
+
+async def measure(
+    name: str,
+    scenario: Callable[[], Awaitable[dict[str, Any]]],
+    rounds: int,
+) -> ScenarioResult:
+    # a pull prints its progress, which shouldn't be timed
+    with redirect_stdout(io.StringIO()):
+        await scenario()
+    seconds = []
+    for _ in range(rounds):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            extra_info = await scenario()
+            seconds.append(time.perf_counter() - start)
+    result = ScenarioResult(name=name, seconds=seconds, extra_info=extra_info)
+    print(
+        f"{name:>8}: median {statistics.median(seconds) * 1000:,.1f}ms, "
+        f"min {min(seconds) * 1000:,.1f}ms over {rounds} rounds"
+    )
+    return result
+
+
+async def run_suite(
+    payload: bytes, cache: Cache, rounds: int, scenarios: tuple[str, ...]
+) -> list[ScenarioResult]:
+    timestamp = time.time()
+    sink = VMSink()
+    page = MetricsPage()
+    async with anyio.create_task_group() as task_group, httpx.AsyncClient() as client:
+        port = cast(int, await task_group.start(sink.serve))
+        page_port = await task_group.start(page.serve, "127.0.0.1")
+        vmagent_api = VMAgentAPI(host="127.0.0.1", port=port)
+        options = PullOptions()
+
+        # the scenarios run on the outputs of the ones before them, worked out once
+        builder = AuctionSnapshotBuilder()
+        for obj in iter_array(payload_chunks(payload), "auctions"):
+            builder.add(obj)
+        snapshot = builder.build(timestamp=timestamp, region="us")
+        items = matching_items(cache.get_many(snapshot.item_ids()))
+        matching = snapshot.for_items(items)
+        requests: list[ImportRequest] = []
+        rendered: list[ExportBatch] = []
+
+        async def parse() -> dict[str, Any]:
+            builder = AuctionSnapshotBuilder()
+            for obj in iter_array(payload_chunks(payload), "auctions"):
+                builder.add(obj)
+            return {"auction_count": len(builder), "payload_bytes": len(payload)}
+
+        async def enrich() -> dict[str, Any]:
+            items = matching_items(cache.get_many(snapshot.item_ids()))
+            matching = snapshot.for_items(items)
+            return {"item_count": len(items), "auction_count": len(matching)}
+
+        async def group() -> dict[str, Any]:
+            group_count = sum(1 for _ in snapshot.group_by_item())
+            return {"group_count": group_count}
+
+        async def summary() -> dict[str, Any]:
+            return {"item_count": len(summarize(matching))}
+
+        async def depth_() -> dict[str, Any]:
+            return {"item_count": len(depth(matching, options.depth_edges))}
+
+        async def render() -> dict[str, Any]:
+            batch = ExportBatch()
+            summaries = summarize(matching)
+            vmagent_api.export_item_summaries(batch, items, summaries)
+            vmagent_api.export_item_depths(
+                batch, items, depth(matching, options.depth_edges)
+            )
+            vmagent_api.export_item_market(
+                batch, items, MarketTracker().update(summaries)
+            )
+            requests[:] = vmagent_api.requests(batch)
+            rendered[:] = [batch]
+            return {"row_count": batch.row_count, "request_count": len(requests)}
+
+        async def export() -> dict[str, Any]:
+            before = sink.counts.as_dict()
+            async with anyio.create_task_group() as export_group:
+                for request in requests:
+                    export_group.start_soon(vmagent_api.post, request)
+            return {
+                name: count - before[name]
+                for name, count in sink.counts.as_dict().items()
+            }
+
+        async def scrape() -> dict[str, Any]:
+            response = await client.get(
+                f"http://127.0.0.1:{page_port}/metrics",
+                headers={"Accept-Encoding": "gzip"},
+            )
+            return {
+                "line_count": response.text.count("\n"),
+                "byte_count": int(response.headers["Content-Length"]),
+            }
+
+        async def pull(options: PullOptions = options) -> dict[str, Any]:
+            blizzard_api = FixtureBlizzardAPI(payload=payload, timestamp=timestamp)
+            async with anyio.create_task_group() as watch_group:
+                stall = LoopStall()
+                watch_group.start_soon(stall.watch)
+                report = await run_pull(
+                    blizzard_api, vmagent_api, cache, options, market=MarketTracker()
+                )
+                watch_group.cancel_scope.cancel()
+            assert report is not None
+            return {
+                "max_loop_stall_seconds": stall.max_seconds,
+                "auction_count": report.auction_count,
+                "filtered_auction_count": report.filtered_auction_count,
+                "row_count": report.row_count,
+                "request_count": report.request_count,
+                "auctions_per_second": (
+                    report.auction_count + report.filtered_auction_count
+                )
+                / report.timings.total_seconds,
+                "stage_seconds": dict(report.timings.busy_seconds),
+            }
+
+        all_scenarios: dict[str, Callable[[], Awaitable[dict[str, Any]]]] = {
+            "parse": parse,
+            "enrich": enrich,
+            "group": group,
+            "summary": summary,
+            "depth": depth_,
+            "render": render,
+            "export": export,
+            "scrape": scrape,
+            "pull": pull,
+            "pull-inline": functools.partial(
+                pull, evolve(options, worker_processes=False)
+            ),
+        }
+        # the export posts, and the scrape gets, what the last render made
+        if not rendered and {"export", "scrape"} & set(scenarios):
+            await render()
+        if "scrape" in scenarios:
+            await page.replace("us", render_lines(rendered[0].rows_for_format))
+
+        results = [
+            await measure(name, all_scenarios[name], rounds)
+            for name in all_scenarios
+            if name in scenarios
+        ]
+        task_group.cancel_scope.cancel()
+    return results
+
+
+def compare(
+    results: list[ScenarioResult], baseline: dict[str, Any], max_regression: float
+) -> bool:
+    """
+    Print how the median of each scenario changed since `baseline`, and return whether
+    all of them are within `max_regression` of it.
+    """
+    baseline_medians = {
+        benchmark["name"]: benchmark["stats"]["median"]
+        for benchmark in baseline["benchmarks"]
+    }
+    ok = True
+    for result in results:
+        if result.name not in baseline_medians:
+            continue
+        change = statistics.median(result.seconds) / baseline_medians[result.name] - 1
+        regressed = change > max_regression
+        ok = ok and not regressed
+        print(
+            f"{result.name:>8}: {change:+.1%} vs baseline"
+            + (" (REGRESSION)" if regressed else "")
+        )
+    return ok
+
+
+@click.command()
+@click.option("--payload", type=click.Path(exists=True, path_type=Path))
+@click.option("--auction-count", default=300_000, type=int, show_default=True)
+@click.option(
+    "--item-count",
+    default=10_000,
+    type=int,
+    help="The number of cached items in the synthetic payload",
+    show_default=True,
+)
+@click.option("--item-db", default=ITEM_DB_PATH, type=click.Path(path_type=Path))
+@click.option("--rounds", default=5, type=click.IntRange(min=1), show_default=True)
+@click.option(
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    type=click.Choice(
+        [
+            "parse",
+            "enrich",
+            "group",
+            "summary",
+            "depth",
+            "render",
+            "export",
+            "scrape",
+            "pull",
+            "pull-inline",
+        ]
+    ),
+    help="A scenario to run. Give this more than once for several. Defaults to all",
+)
+@click.option("--json", "json_path", type=click.Path(path_type=Path))
+@click.option("--compare", "baseline_path", type=click.Path(path_type=Path))
+@click.option("--max-regression", default=0.25, type=float, show_default=True)
+def main(
+    payload: Path | None,
+    auction_count: int,
+    item_count: int,
+    item_db: Path,
+    rounds: int,
+    scenarios: tuple[str, ...],
+    json_path: Path | None,
+    baseline_path: Path | None,
+    max_regression: float,
+) -> None:
+    payload_bytes = load_or_generate(payload, auction_count, item_count)
+    scenarios = scenarios or (
+        "parse",
+        "enrich",
+        "group",
+        "summary",
+        "depth",
+        "render",
+        "export",
+        "scrape",
+        "pull",
+        "pull-inline",
+    )
+
+    # opening the cache can migrate it, so open a copy of the shipped one
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        item_db_path = Path(tmp_dir) / "item.db"
+        shutil.copy(item_db, item_db_path)
+        with Cache.open(item_db_path) as cache:
+            results = anyio.run(run_suite, payload_bytes, cache, rounds, scenarios)
+
+    output = {
+        "machine_info": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "datetime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "payload_bytes": len(payload_bytes),
+        "benchmarks": [result.as_dict() for result in results],
+    }
+    if json_path is not None:
+        json_path.write_text(json.dumps(output, indent=2))
+        print(f"wrote results to {json_path}")
+
+    if baseline_path is not None:
+        baseline = json.loads(baseline_path.read_text())
+        if not compare(results, baseline, max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Time the vectorized `wowauction.summary.summarize` against the per-item loop it
+replaced, on a snapshot of 300k auctions across 5k items.
+
+    python scripts/benchmark_summary.py [--auction-count 300000] [--item-count 5000]
+
+tests/test_summary.py checks that the two agree, on many random snapshots from
+`random_snapshot`.
+"""
+
+import time
+
+import click
+import numpy as np
+
+from wowauction.snapshot import AuctionSnapshot
+from wowauction.summary import PHIS, summarize
+
+
+def reference_summary(
+    prices_gold: list[float], quantities: list[int]
+) -> tuple[dict[float, float], float, float, int]:
+    """
+    The per-item loop from `VMAgentAPI.export_auction_summary`, as it was before
+    `summarize`. Returns the quantiles, min, sum and count.
+    """
+    phis = sorted(PHIS)
+    percentiles = {}
+
+    total_items = sum(quantities)
+    items_seen = 0
+    phi_index = 0
+    auctions_sorted_by_price = sorted(
+        zip(prices_gold, quantities), key=lambda a: a[0], reverse=True
+    )
+    for price_gold, quantity in auctions_sorted_by_price:
+        items_seen += quantity
+
+        cur_percent = items_seen / total_items
+
+        while phis[phi_index] < cur_percent and phi_index < len(phis):
+            percentiles[phis[phi_index]] = price_gold
+            phi_index += 1
+
+        if phi_index == len(phis):
+            break
+
+    if phi_index < len(phis):
+        percentiles[phis[phi_index]] = auctions_sorted_by_price[-1][0]
+
+    return (
+        percentiles,
+        min(prices_gold),
+        sum(q * p for p, q in zip(prices_gold, quantities)),
+        total_items,
+    )
+
+
+def random_snapshot(
+    rng: np.random.Generator, auction_count: int, item_count: int
+) -> AuctionSnapshot:
+    # a small price range makes ties common, which is where off-by-ones show up
+    price_range = int(rng.choice([5, 1_000, 10_000_000]))
+    return AuctionSnapshot(
+        item_id=rng.integers(1, item_count + 1, auction_count).astype(np.int32),
+        unit_price=(rng.integers(1, price_range + 1, auction_count) * 100).astype(
+            np.int64
+        ),
+        quantity=rng.choice([1, 2, 3, 20, 200, 5000], auction_count).astype(np.int32),
+        time_left=rng.integers(0, 4, auction_count).astype(np.uint8),
+        timestamp=0.0,
+        region="us",
+    )
+
+
+def bench_reference(snapshot: AuctionSnapshot) -> None:
+    for _, auctions in snapshot.group_by_item():
+        reference_summary(auctions.price_gold.tolist(), auctions.quantity.tolist())
+
+
+@click.command()
+@click.option("--auction-count", default=300_000, type=int, show_default=True)
+@click.option("--item-count", default=5_000, type=int, show_default=True)
+@click.option("--seed", default=0, type=int, show_default=True)
+def main(auction_count: int, item_count: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    snapshot = random_snapshot(rng, auction_count, item_count)
+    start = time.perf_counter()
+    bench_reference(snapshot)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    summarize(snapshot)
+    vectorized_seconds = time.perf_counter() - start
+    print(
+        f"{auction_count:,} auctions, {item_count:,} items: "
+        f"reference {reference_seconds * 1000:,.1f}ms, "
+        f"summarize {vectorized_seconds * 1000:,.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
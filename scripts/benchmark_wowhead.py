@@ -0,0 +1,121 @@
+"""
+Time extracting items from wowhead item pages, the old way (a BeautifulSoup DOM of the
+whole page, then regexes) against `parse_item_page` (regexes only), and check that
+both extract the same items.
+
+    python scripts/benchmark_wowhead.py [--pages cache/wowhead] [--page-count 200]
+
+The pages are the ones saved with `--wowhead-page-path` if `--pages` is given, or else
+synthetic ones for the items of the shipped cache/item.db (see fixtures.py).
+"""
+
+import sqlite3
+import statistics
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import click
+from bs4 import BeautifulSoup
+from fixtures import ITEM_DB_PATH, synthetic_item_page
+
+from wowauction.item import Item
+from wowauction.wowhead import (
+    QUALITY_PATTERN,
+    RANK_PATTERN,
+    VERSION_PATTERN,
+    PageArchive,
+    parse_item_page,
+)
+
+
+def parse_item_page_with_soup(id_: int, source: str) -> Item:
+    """How items were extracted before `parse_item_page`."""
+    soup = BeautifulSoup(source, "html.parser")
+    name_ele = soup.select_one("h1")
+    if name_ele is None:
+        raise ValueError(f"Couldn't find name of item with id {id_}")
+    name = next(name_ele.stripped_strings)
+    if (quality_match := QUALITY_PATTERN.search(source)) is None:
+        raise ValueError(f"Couldn't find quality of item with id {id_}")
+    rank_match = RANK_PATTERN.search(source)
+    if (version_match := VERSION_PATTERN.search(source)) is None:
+        raise ValueError(f"Couldn't find version of item with id {id_}")
+    return Item(
+        id_=id_,
+        name=name,
+        quality=int(quality_match.group("quality")),
+        rank=int(rank_match.group("rank")) if rank_match is not None else None,
+        major=int(version_match.group("major")),
+        minor=int(version_match.group("minor")),
+        patch=int(version_match.group("patch")),
+        build=int(version_match.group("build")),
+    )
+
+
+def synthetic_pages(item_db: Path, page_count: int) -> dict[int, str]:
+    con = sqlite3.connect(item_db)
+    try:
+        rows = con.execute(
+            "SELECT id, name, quality, rank, major, minor, patch, build FROM item "
+            "ORDER BY id LIMIT ?",
+            (page_count,),
+        ).fetchall()
+    finally:
+        con.close()
+    return {
+        id_: synthetic_item_page(
+            id_, name, quality, rank, f"{major}.{minor}.{patch}.{build}"
+        )
+        for id_, name, quality, rank, major, minor, patch, build in rows
+    }
+
+
+def time_extractor(
+    pages: dict[int, str], extract: Callable[[int, str], Item]
+) -> tuple[list[float], dict[int, Item | str]]:
+    seconds = []
+    items: dict[int, Item | str] = {}
+    for id_, source in pages.items():
+        start = time.perf_counter()
+        try:
+            items[id_] = extract(id_, source)
+        except ValueError as exc:
+            items[id_] = str(exc)
+        seconds.append(time.perf_counter() - start)
+    return seconds, items
+
+
+@click.command()
+@click.option("--pages", "pages_path", type=click.Path(exists=True, path_type=Path))
+@click.option("--item-db", default=ITEM_DB_PATH, type=click.Path(path_type=Path))
+@click.option("--page-count", default=200, type=int, show_default=True)
+def main(pages_path: Path | None, item_db: Path, page_count: int) -> None:
+    if pages_path is not None:
+        archive = PageArchive(pages_path)
+        pages = {id_: archive.read(id_) for id_ in sorted(archive.ids())[:page_count]}
+    else:
+        pages = synthetic_pages(item_db, page_count)
+    total_bytes = sum(len(source) for source in pages.values())
+    print(f"{len(pages):,} pages, {total_bytes / len(pages) / 1024:,.0f}KiB each")
+
+    results = {}
+    for name, extract in (
+        ("soup", parse_item_page_with_soup),
+        ("regex", parse_item_page),
+    ):
+        seconds, items = time_extractor(pages, extract)
+        results[name] = items
+        print(
+            f"{name:>6}: median {statistics.median(seconds) * 1000:,.2f}ms, "
+            f"total {sum(seconds) * 1000:,.0f}ms"
+        )
+
+    mismatches = [id_ for id_ in pages if results["soup"][id_] != results["regex"][id_]]
+    for id_ in mismatches[:10]:
+        print(f"mismatch for {id_}: {results['soup'][id_]} != {results['regex'][id_]}")
+    print(f"{len(pages) - len(mismatches):,} of {len(pages):,} pages agree")
+
+
+if __name__ == "__main__":
+    main()
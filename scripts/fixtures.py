@@ -0,0 +1,180 @@
+"""
+Commodities payload fixtures for the benchmark scripts.
+
+A payload can be recorded from the live API by saving the body of
+https://us.api.blizzard.com/data/wow/auctions/commodities to a file, or generated
+synthetically with this script:
+
+    python scripts/fixtures.py --auction-count 300000 cache/commodities.json
+
+Synthetic payloads use the item IDs from the item cache, so they can be enriched
+without any Wowhead lookups. `FixtureBlizzardAPI` serves a payload to a pull (see
+wowauction.pipeline.run_pull) in place of the real API.
+
+Wowhead item pages can be recorded by running with `--wowhead-page-path` (see
+wowauction.wowhead.PageArchive), or generated from the items of the cache with
+`synthetic_item_page`.
+"""
+
+from __future__ import annotations
+
+import html
+import json
+import random
+import sqlite3
+from collections.abc import AsyncGenerator
+from pathlib import Path
+
+import click
+from attrs import frozen
+
+from wowauction.blizzard import DownloadStats
+
+REPO_PATH = Path(__file__).parent.parent
+ITEM_DB_PATH = REPO_PATH / "cache" / "item.db"
+
+TIME_LEFTS = ["SHORT", "MEDIUM", "LONG", "VERY_LONG"]
+
+
+def cached_item_ids(item_db_path: Path = ITEM_DB_PATH) -> list[int]:
+    con = sqlite3.connect(item_db_path)
+    try:
+        return [row[0] for row in con.execute("SELECT id FROM item ORDER BY id")]
+    finally:
+        con.close()
+
+
+def synthetic_commodities_payload(
+    auction_count: int = 300_000,
+    item_count: int = 5_000,
+    seed: int = 0,
+    item_db_path: Path = ITEM_DB_PATH,
+) -> bytes:
+    """
+    Generate a commodities payload shaped like Blizzard's, with `auction_count` auctions
+    spread unevenly over `item_count` items.
+    """
+    rng = random.Random(seed)
+    item_ids = cached_item_ids(item_db_path)[:item_count]
+
+    # some items are much more popular than others, like on the real auction house
+    weights = [1 / rank for rank in range(1, len(item_ids) + 1)]
+    rng.shuffle(weights)
+    base_prices = {item_id: rng.randint(100, 5_000_000) for item_id in item_ids}
+
+    auctions = []
+    for auction_id, item_id in enumerate(
+        rng.choices(item_ids, weights=weights, k=auction_count), start=1
+    ):
+        base_price = base_prices[item_id]
+        auctions.append(
+            {
+                "id": auction_id,
+                "item": {"id": item_id},
+                "quantity": rng.choice([1, 1, 5, 20, 100, 200, 1000]),
+                "unit_price": int(base_price * rng.uniform(1, 3)) // 100 * 100,
+                "time_left": rng.choice(TIME_LEFTS),
+            }
+        )
+
+    payload = {
+        "_links": {
+            "self": {
+                "href": "https://us.api.blizzard.com/data/wow/auctions/commodities"
+                "?namespace=dynamic-us"
+            }
+        },
+        "auctions": auctions,
+    }
+    return json.dumps(payload).encode()
+
+
+def synthetic_item_page(
+    id_: int,
+    name: str,
+    quality: int,
+    rank: int | None,
+    version: str,
+    filler_bytes: int = 300_000,
+) -> str:
+    """
+    A page shaped like a wowhead item page: the item's heading, its tooltip as a
+    string in a script, and `filler_bytes` of the markup and script that surround them
+    on the real thing.
+    """
+    filler_line = (
+        '<div class="infobox-inner-table"><ul><li><div>Level: 70</div></li>'
+        '<li><div><a href="/items/trade-goods">Trade Goods</a></div></li></ul></div>\n'
+    )
+    filler = filler_line * (filler_bytes // 2 // len(filler_line))
+    script_line = (
+        'WH.Gatherer.addData(3, 1, {"%d":{"name_enus":"Filler","quality":1}});\n' % id_
+    )
+    script = script_line * (filler_bytes // 2 // len(script_line))
+    rank_icon = (
+        '<img src="https://wow.zamimg.com/images/icons/'
+        f'professions-chaticon-quality-tier{rank}.png">'
+        if rank is not None
+        else ""
+    )
+    return (
+        "<!DOCTYPE html><html><head><title>"
+        f"{html.escape(name)} - Item - World of Warcraft</title>"
+        f"<script>{script}</script></head><body>"
+        f'<div class="text"><h1 class="heading-size-1">{html.escape(name)}'
+        f"{rank_icon}</h1>{filler}"
+        f'<script>WH.Gatherer.addData(3, 1, {{"{id_}":{{"tooltip_enus":"'
+        f'<table><tr><td><!--nstart--><b class=\\"q{quality}\\">'
+        f'{html.escape(name)}</b><!--nend--></td></tr></table>"}}}});</script>'
+        f"<div>Added in patch {version}</div></div></body></html>"
+    )
+
+
+@frozen
+class FixtureBlizzardAPI:
+    """Serves the commodities of a payload in memory, in place of `BlizzardAPI`."""
+
+    payload: bytes
+    timestamp: float = 1_700_000_000.0
+    region: str = "us"
+
+    async def iter_commodity_payload(
+        self, segment_bytes: int = 1024 * 1024, stats: DownloadStats | None = None
+    ) -> AsyncGenerator[bytes, None]:
+        if stats is not None:
+            stats.accessed_at = self.timestamp
+        for start in range(0, len(self.payload), segment_bytes):
+            segment = self.payload[start : start + segment_bytes]
+            if stats is not None:
+                stats.payload_bytes += len(segment)
+            yield segment
+
+    def commit_snapshot(self) -> None:
+        pass
+
+
+def load_or_generate(
+    path: Path | None, auction_count: int, item_count: int = 5_000
+) -> bytes:
+    if path is not None:
+        return path.read_bytes()
+    return synthetic_commodities_payload(
+        auction_count=auction_count, item_count=item_count
+    )
+
+
+@click.command()
+@click.argument("output", type=click.Path(path_type=Path))
+@click.option("--auction-count", default=300_000, type=int, show_default=True)
+@click.option("--item-count", default=5_000, type=int, show_default=True)
+@click.option("--seed", default=0, type=int, show_default=True)
+def main(output: Path, auction_count: int, item_count: int, seed: int) -> None:
+    payload = synthetic_commodities_payload(
+        auction_count=auction_count, item_count=item_count, seed=seed
+    )
+    output.write_bytes(payload)
+    print(f"wrote {auction_count:,} auctions ({len(payload):,} bytes) to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+A local stand-in for vmagent's /api/v1/import/csv, for the benchmark scripts. It
+accepts every import request, throws the rows away, and counts the requests, rows and
+bytes (as sent, so compressed if they were) it got.
+
+It can also stand in for a vmagent that's struggling: one that's slow to answer
+(`--delay-seconds`), or that fails some of the requests with a 503 on purpose
+(`--failure-rate`), without counting their rows.
+
+    python scripts/vmsink.py [--port 8429] [--delay-seconds 0] [--failure-rate 0]
+
+Run on its own, it prints a line for each request, so `python -m wowauction run` can be
+pointed at it with `--vmagent-host localhost` instead of a real vmagent.
+"""
+
+from __future__ import annotations
+
+import gzip
+import random
+from collections.abc import Callable
+
+import anyio
+import click
+from anyio.abc import SocketAttribute, SocketStream, TaskStatus
+from anyio.streams.buffered import BufferedByteReceiveStream
+from attrs import define, field
+
+_MAX_HEADER_BYTES = 64 * 1024
+
+_NO_CONTENT = b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n"
+_NOT_FOUND = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+_UNAVAILABLE = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n"
+
+
+@define
+class SinkCounts:
+    """What the sink has been sent, over all its connections."""
+
+    request_count: int = 0
+    row_count: int = 0
+    byte_count: int = 0
+
+    # the requests failed on purpose, whose rows aren't counted
+    failed_request_count: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            "request_count": self.request_count,
+            "row_count": self.row_count,
+            "byte_count": self.byte_count,
+            "failed_request_count": self.failed_request_count,
+        }
+
+
+@define
+class VMSink:
+    """
+    A minimal HTTP/1.1 server that only knows `POST /api/v1/import/csv`. Start it in a
+    task group with `await task_group.start(sink.serve)`, which gives the port it's
+    listening on.
+    """
+
+    counts: SinkCounts = field(factory=SinkCounts)
+    on_request: Callable[[str, int, int], None] | None = None
+
+    # how long each request takes to answer, and the share of them that fail
+    delay_seconds: float = 0.0
+    failure_rate: float = 0.0
+
+    async def serve(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        *,
+        task_status: TaskStatus = anyio.TASK_STATUS_IGNORED,
+    ) -> None:
+        listener = await anyio.create_tcp_listener(local_host=host, local_port=port)
+        async with listener:
+            task_status.started(listener.extra(SocketAttribute.local_port))
+            await listener.serve(self._handle)
+
+    async def _handle(self, stream: SocketStream) -> None:
+        # httpx keeps its connections alive, so each one carries many requests
+        async with stream:
+            receive = BufferedByteReceiveStream(stream)
+            while True:
+                try:
+                    head = await receive.receive_until(b"\r\n\r\n", _MAX_HEADER_BYTES)
+                except (anyio.EndOfStream, anyio.IncompleteRead):
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = request_line.split(" ", 2)
+                headers = {
+                    name.strip().lower(): value.strip()
+                    for name, _, value in (
+                        line.partition(":") for line in header_lines if line
+                    )
+                }
+                content_length = int(headers.get("content-length", 0))
+                body = (
+                    await receive.receive_exactly(content_length)
+                    if content_length
+                    else b""
+                )
+
+                path = target.partition("?")[0]
+                if method != "POST" or path != "/api/v1/import/csv":
+                    await stream.send(_NOT_FOUND)
+                    continue
+
+                if self.delay_seconds:
+                    await anyio.sleep(self.delay_seconds)
+                if random.random() < self.failure_rate:
+                    self.counts.failed_request_count += 1
+                    await stream.send(_UNAVAILABLE)
+                    continue
+
+                if headers.get("content-encoding") == "gzip":
+                    body = gzip.decompress(body)
+                row_count = body.count(b"\n")
+                self.counts.request_count += 1
+                self.counts.row_count += row_count
+                self.counts.byte_count += content_length
+                if self.on_request is not None:
+                    self.on_request(target, row_count, content_length)
+                await stream.send(_NO_CONTENT)
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8429, type=int, show_default=True)
+@click.option("--delay-seconds", default=0.0, type=float, show_default=True)
+@click.option(
+    "--failure-rate", default=0.0, type=click.FloatRange(0, 1), show_default=True
+)
+def main(host: str, port: int, delay_seconds: float, failure_rate: float) -> None:
+    def on_request(target: str, row_count: int, byte_count: int) -> None:
+        print(f"{row_count:,} rows ({byte_count:,} bytes) to {target[:80]}")
+
+    sink = VMSink(
+        on_request=on_request, delay_seconds=delay_seconds, failure_rate=failure_rate
+    )
+
+    async def serve() -> None:
+        async with anyio.create_task_group() as task_group:
+            port_ = await task_group.start(sink.serve, host, port)
+            print(f"listening on http://{host}:{port_}/api/v1/import/csv")
+
+    anyio.run(serve)
+
+
+if __name__ == "__main__":
+    main()
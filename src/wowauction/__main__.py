@@ -1,15 +1,35 @@
-from collections import defaultdict
-from collections.abc import AsyncIterator, Mapping
+import time
+from collections.abc import AsyncIterator, Callable, Mapping, Sequence
+from contextlib import ExitStack
+from datetime import datetime, timezone
 from pathlib import Path
 
 import anyio
 import click
+import httpx
 
-from wowauction.auction import Auction
-from wowauction.blizzard import BlizzardAPI
+from wowauction.archive import SnapshotArchive
+from wowauction.blizzard import REGIONS, BlizzardAPI
 from wowauction.cache import Cache
-from wowauction.item import Item
-from wowauction.vmagent import VMAgentAPI
+from wowauction.depth import DEPTH_EDGES
+from wowauction.exported import ExportedSeries
+from wowauction.exposition import MetricsPage
+from wowauction.itemfilter import ItemFilter
+from wowauction.market import MarketTracker
+from wowauction.oauth import TokenManager
+from wowauction.pipeline import (
+    CommoditiesSource,
+    PullOptions,
+    PullReport,
+    StageFailed,
+    run_pull,
+    run_replay,
+)
+from wowauction.schedule import PublicationSchedule
+from wowauction.selfmetrics import export_process_metrics, export_pull_metrics
+from wowauction.spool import FSYNC_POLICIES, ExportSpool, FsyncPolicy, drain
+from wowauction.vmagent import ExportBatch, VMAgentAPI
+from wowauction.wowhead import PageArchive
 
 
 async def periodic(period: float) -> AsyncIterator[None]:
@@ -26,84 +46,688 @@ async def periodic(period: float) -> AsyncIterator[None]:
         now = await anyio.current_time()
 
 
-@click.command()
-@click.option("--cache-path", required=True, type=click.Path(path_type=Path))
+async def aligned(
+    blizzard_api: BlizzardAPI, schedule: PublicationSchedule
+) -> AsyncIterator[None]:
+    """
+    Yields whenever the region of `blizzard_api` should be pulled next, going by when
+    its snapshots come out (see `PublicationSchedule`). The first iteration will yield
+    immediately.
+    """
+    while True:
+        yield
+        await anyio.sleep(schedule.delay(blizzard_api.published_at, time.time()))
+
+
+# the options of both commands. they're read from WOWAUCTION_* environment variables too
+cache_path_option = click.option(
+    "--cache-path", required=True, type=click.Path(path_type=Path)
+)
+# required, except by `run` with --metrics-port
+vmagent_host_option = click.option("--vmagent-host")
+vmagent_port_option = click.option("--vmagent-port", type=int)
+vmagent_max_batch_rows_option = click.option(
+    "--vmagent-max-batch-rows",
+    default=10_000,
+    type=click.IntRange(min=1),
+    help="The maximum number of rows sent to vmagent in one import request",
+    show_default=True,
+)
+vmagent_gzip_level_option = click.option(
+    "--vmagent-gzip-level",
+    default=1,
+    type=click.IntRange(min=0, max=9),
+    help="The gzip level of the import requests sent to vmagent, 0 for uncompressed",
+    show_default=True,
+)
+export_workers_option = click.option(
+    "--export-workers",
+    default=4,
+    type=click.IntRange(min=1),
+    help="The number of import requests sent to vmagent at once",
+    show_default=True,
+)
+wowhead_concurrency_option = click.option(
+    "--wowhead-concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    help="The maximum number of wowhead lookups in flight at once",
+    show_default=True,
+)
+wowhead_max_per_second_option = click.option(
+    "--wowhead-max-per-second",
+    default=4.0,
+    type=click.FloatRange(min=0, min_open=True),
+    help="The maximum number of wowhead lookups started per second",
+    show_default=True,
+)
+wowhead_page_path_option = click.option(
+    "--wowhead-page-path",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="A directory to save the wowhead page of every looked up item in",
+)
+depth_edge_option = click.option(
+    "--depth-edge",
+    "depth_edges",
+    multiple=True,
+    default=DEPTH_EDGES,
+    type=click.FloatRange(min=1),
+    help=(
+        "An order book depth level to export, as a multiple of each item's minimum "
+        "price. Give this more than once for several levels, and inf for all auctions"
+    ),
+    show_default=True,
+)
+
+
+DEFAULT_ITEM_FILTER = ItemFilter()
+
+
+def item_filter_options(func: Callable[..., None]) -> Callable[..., None]:
+    """The options of both commands that make up an `ItemFilter`."""
+    for option in reversed(
+        [
+            click.option(
+                "--item-min-major",
+                default=DEFAULT_ITEM_FILTER.min_major,
+                type=int,
+                help=(
+                    "The oldest expansion whose items are exported, as the major game "
+                    "version it came out in"
+                ),
+                show_default=True,
+            ),
+            click.option(
+                "--item-min-quality",
+                default=DEFAULT_ITEM_FILTER.min_quality,
+                type=click.IntRange(min=0),
+                help="The lowest quality of exported items, 0 being poor, 1 common",
+                show_default=True,
+            ),
+            click.option(
+                "--item-rank",
+                "item_ranks",
+                multiple=True,
+                type=click.IntRange(min=1),
+                help=(
+                    "A crafting rank to export. Give this more than once for several. "
+                    "Defaults to all, and items without a rank are always exported"
+                ),
+            ),
+            click.option(
+                "--item-id",
+                "item_ids",
+                multiple=True,
+                type=int,
+                help=(
+                    "An item to export. Give this more than once for several. If any "
+                    "are given, no other items are exported"
+                ),
+            ),
+            click.option(
+                "--exclude-item-id",
+                "exclude_item_ids",
+                multiple=True,
+                type=int,
+                help="An item never to export. Give this more than once for several",
+            ),
+        ]
+    ):
+        func = option(func)
+    return func
+
+
+def _item_filter(
+    item_min_major: int,
+    item_min_quality: int,
+    item_ranks: tuple[int, ...],
+    item_ids: tuple[int, ...],
+    exclude_item_ids: tuple[int, ...],
+) -> ItemFilter:
+    return ItemFilter(
+        min_major=item_min_major,
+        min_quality=item_min_quality,
+        ranks=item_ranks,
+        allow_ids=item_ids,
+        deny_ids=exclude_item_ids,
+    )
+
+
+# so that the options of every command are WOWAUCTION_*, not WOWAUCTION_RUN_* etc
+COMMAND_CONTEXT_SETTINGS = {"auto_envvar_prefix": "WOWAUCTION"}
+
+
+@click.group()
+def main() -> None:
+    """
+    Pull World of Warcraft commodity auctions from Blizzard into VictoriaMetrics.
+    """
+
+
+@main.command(context_settings=COMMAND_CONTEXT_SETTINGS)
+@cache_path_option
 @click.option("--blizz-client-id", required=True)
 @click.option("--blizz-client-secret", required=True)
-@click.option("--vmagent-host", required=True)
-@click.option("--vmagent-port", required=True, type=int)
+@click.option(
+    "--region",
+    "regions",
+    multiple=True,
+    default=["us"],
+    type=click.Choice(REGIONS),
+    help="A region to pull. Give this more than once to pull several regions at once",
+    show_default=True,
+)
+@vmagent_host_option
+@vmagent_port_option
+@vmagent_max_batch_rows_option
+@vmagent_gzip_level_option
+@export_workers_option
+@wowhead_concurrency_option
+@wowhead_max_per_second_option
+@wowhead_page_path_option
+@depth_edge_option
+@item_filter_options
+@click.option(
+    "--item-max-age-days",
+    default=30.0,
+    type=click.FloatRange(min=0),
+    help=(
+        "The number of days after which a cached item is looked up on wowhead again. "
+        "Items are also looked up again after a new patch build shows up."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--item-refresh-limit",
+    default=100,
+    type=click.IntRange(min=0),
+    help="The maximum number of stale cached items looked up again per pull",
+    show_default=True,
+)
+@click.option(
+    "--archive-path",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="A directory to archive every pulled snapshot in, for the replay command",
+)
 @click.option(
     "--period-seconds",
     default=60 * 60,
     type=int,
-    help="The number of seconds between pulls",
+    help=(
+        "The number of seconds between pulls with --schedule fixed, or between "
+        "snapshots until their times are learned with --schedule adaptive"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--schedule",
+    default="adaptive",
+    type=click.Choice(["adaptive", "fixed"]),
+    help=(
+        "Pull each region a little before its next snapshot is predicted to come out, "
+        "and probe for it until it does (adaptive), or every --period-seconds (fixed)"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--probe-max-seconds",
+    default=120,
+    type=click.IntRange(min=1),
+    help="The most seconds between probes for a snapshot with --schedule adaptive",
+    show_default=True,
+)
+@click.option(
+    "--export-refresh-seconds",
+    default=60 * 60,
+    type=click.IntRange(min=0),
+    help=(
+        "Only export the series that changed since the last pull, and every series "
+        "at least this often. 0 exports every series of every pull"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--export-state-path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="A file to keep the last exported value of every series in, across restarts",
+)
+@click.option(
+    "--metrics-port",
+    type=click.IntRange(min=0, max=65535),
+    help=(
+        "Serve the metrics of the latest pulls at /metrics on this port, for vmagent "
+        "to scrape, instead of pushing them to vmagent"
+    ),
+)
+@click.option(
+    "--metrics-gzip-level",
+    default=1,
+    type=click.IntRange(min=0, max=9),
+    help="The gzip level of the served metrics, 0 for uncompressed",
+    show_default=True,
+)
+@click.option(
+    "--spool-path",
+    type=click.Path(file_okay=False, path_type=Path),
+    help=(
+        "A directory to spool the exports in, to be sent on to vmagent in the "
+        "background, so that a slow or unavailable vmagent doesn't hold up the pulls "
+        "or lose their rows"
+    ),
+)
+@click.option(
+    "--spool-max-mb",
+    default=1024,
+    type=click.IntRange(min=1),
+    help="The most megabytes spooled before the oldest exports are dropped",
     show_default=True,
 )
-def main(
+@click.option(
+    "--spool-fsync",
+    default="always",
+    type=click.Choice(FSYNC_POLICIES),
+    help=(
+        "When spooled exports are synced to disk: after every append, when each "
+        "segment file is done with, or never"
+    ),
+    show_default=True,
+)
+def run(
     cache_path: Path,
     blizz_client_id: str,
     blizz_client_secret: str,
-    vmagent_host: str,
-    vmagent_port: int,
+    regions: tuple[str, ...],
+    vmagent_host: str | None,
+    vmagent_port: int | None,
+    vmagent_max_batch_rows: int,
+    vmagent_gzip_level: int,
+    export_workers: int,
+    wowhead_concurrency: int,
+    wowhead_max_per_second: float,
+    wowhead_page_path: Path | None,
+    depth_edges: tuple[float, ...],
+    item_min_major: int,
+    item_min_quality: int,
+    item_ranks: tuple[int, ...],
+    item_ids: tuple[int, ...],
+    exclude_item_ids: tuple[int, ...],
+    item_max_age_days: float,
+    item_refresh_limit: int,
+    archive_path: Path | None,
     period_seconds: int,
+    schedule: str,
+    probe_max_seconds: int,
+    export_refresh_seconds: int,
+    export_state_path: Path | None,
+    metrics_port: int | None,
+    metrics_gzip_level: int,
+    spool_path: Path | None,
+    spool_max_mb: int,
+    spool_fsync: FsyncPolicy,
 ) -> None:
-    blizzard_api = BlizzardAPI(
+    """
+    Pull the auctions of each region as its snapshots come out (or every period), and
+    export them to vmagent, or serve them for it to scrape.
+    """
+    page = None
+    if metrics_port is not None:
+        page = MetricsPage(gzip_level=metrics_gzip_level or None)
+        # a scrape gets every series, so there's nothing to leave out
+        export_refresh_seconds = 0
+    elif vmagent_host is None or vmagent_port is None:
+        raise click.UsageError(
+            "--vmagent-host and --vmagent-port are required without --metrics-port"
+        )
+
+    # one token works for every region, so they all share one
+    token_manager = TokenManager(
         client_id=blizz_client_id, client_secret=blizz_client_secret
     )
-    vmagent_api = VMAgentAPI(host=vmagent_host, port=vmagent_port)
+    blizzard_apis = [
+        BlizzardAPI(token_manager=token_manager, region=region)
+        for region in dict.fromkeys(regions)
+    ]
+    exported = None
+    if export_refresh_seconds:
+        exported = (
+            ExportedSeries.load(export_state_path, export_refresh_seconds)
+            if export_state_path is not None
+            else ExportedSeries(refresh_seconds=export_refresh_seconds)
+        )
+    options = PullOptions(
+        wowhead_concurrency=wowhead_concurrency,
+        wowhead_max_per_second=wowhead_max_per_second,
+        item_max_age_seconds=item_max_age_days * 24 * 60 * 60,
+        item_refresh_limit=item_refresh_limit,
+        export_workers=export_workers,
+        depth_edges=tuple(sorted(depth_edges)),
+        item_filter=_item_filter(
+            item_min_major, item_min_quality, item_ranks, item_ids, exclude_item_ids
+        ),
+    )
+    archive = SnapshotArchive(archive_path) if archive_path is not None else None
+    schedules = None
+    if schedule == "adaptive":
+        schedules = {
+            blizzard_api.region: PublicationSchedule(
+                default_interval_seconds=period_seconds,
+                max_probe_seconds=probe_max_seconds,
+                min_probe_seconds=min(10, probe_max_seconds),
+            )
+            for blizzard_api in blizzard_apis
+        }
+
+    with ExitStack() as stack:
+        # the cache lives as long as the process, so known items never touch disk
+        # again
+        cache = stack.enter_context(
+            Cache.open(cache_path, _page_archive(wowhead_page_path))
+        )
+        # nothing is pushed with a page, so there's nothing to spool
+        spool = None
+        if spool_path is not None and page is None:
+            spool = stack.enter_context(
+                ExportSpool.open(
+                    spool_path,
+                    max_bytes=spool_max_mb * 1024 * 1024,
+                    fsync=spool_fsync,
+                )
+            )
+        # with a page, this only renders the rows, and nothing is sent to it
+        vmagent_api = VMAgentAPI(
+            host=vmagent_host or "",
+            port=vmagent_port or 0,
+            max_batch_rows=vmagent_max_batch_rows,
+            gzip_level=vmagent_gzip_level or None,
+            exported=exported,
+            spool=spool,
+        )
+        anyio.run(
+            inner_loop,
+            blizzard_apis,
+            vmagent_api,
+            cache,
+            period_seconds,
+            options,
+            archive,
+            export_state_path,
+            page,
+            metrics_port,
+            schedules,
+        )
+
+
+@main.command(context_settings=COMMAND_CONTEXT_SETTINGS)
+@cache_path_option
+@click.option(
+    "--archive-path",
+    required=True,
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+)
+@click.option(
+    "--region",
+    "regions",
+    multiple=True,
+    type=click.Choice(REGIONS),
+    help="A region to replay. Give this more than once for several. Defaults to all",
+)
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    help="Only replay snapshots pulled at or after this UTC time",
+)
+@click.option(
+    "--until",
+    type=click.DateTime(),
+    help="Only replay snapshots pulled at or before this UTC time",
+)
+@vmagent_host_option
+@vmagent_port_option
+@vmagent_max_batch_rows_option
+@vmagent_gzip_level_option
+@export_workers_option
+@wowhead_concurrency_option
+@wowhead_max_per_second_option
+@wowhead_page_path_option
+@depth_edge_option
+@item_filter_options
+def replay(
+    cache_path: Path,
+    archive_path: Path,
+    regions: tuple[str, ...],
+    since: datetime | None,
+    until: datetime | None,
+    vmagent_host: str | None,
+    vmagent_port: int | None,
+    vmagent_max_batch_rows: int,
+    vmagent_gzip_level: int,
+    export_workers: int,
+    wowhead_concurrency: int,
+    wowhead_max_per_second: float,
+    wowhead_page_path: Path | None,
+    depth_edges: tuple[float, ...],
+    item_min_major: int,
+    item_min_quality: int,
+    item_ranks: tuple[int, ...],
+    item_ids: tuple[int, ...],
+    exclude_item_ids: tuple[int, ...],
+) -> None:
+    """
+    Export archived snapshots again, with the times they were pulled at, e.g. to
+    backfill a new metric or one that was fixed.
+    """
+    if vmagent_host is None or vmagent_port is None:
+        raise click.UsageError("--vmagent-host and --vmagent-port are required")
+    archive = SnapshotArchive(archive_path)
+    paths = archive.paths(
+        regions=regions,
+        since=_utc_timestamp(since) if since is not None else None,
+        until=_utc_timestamp(until) if until is not None else None,
+    )
+    print(f"replaying {len(paths):,} snapshots from {archive_path}")
+
+    vmagent_api = VMAgentAPI(
+        host=vmagent_host,
+        port=vmagent_port,
+        max_batch_rows=vmagent_max_batch_rows,
+        gzip_level=vmagent_gzip_level or None,
+    )
+    options = PullOptions(
+        wowhead_concurrency=wowhead_concurrency,
+        wowhead_max_per_second=wowhead_max_per_second,
+        export_workers=export_workers,
+        depth_edges=tuple(sorted(depth_edges)),
+        item_filter=_item_filter(
+            item_min_major, item_min_quality, item_ranks, item_ids, exclude_item_ids
+        ),
+    )
+    with Cache.open(cache_path, _page_archive(wowhead_page_path)) as cache:
+        report = anyio.run(run_replay, archive, paths, vmagent_api, cache, options)
+    print(
+        f"replayed {report.snapshot_count:,} snapshots ({report.auction_count:,} "
+        f"auctions) in {report.timings}: {report.row_count:,} rows in "
+        f"{report.request_count:,} requests"
+    )
+
+
+@main.command("reparse-items", context_settings=COMMAND_CONTEXT_SETTINGS)
+@cache_path_option
+@click.option(
+    "--wowhead-page-path",
+    required=True,
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+)
+def reparse_items(cache_path: Path, wowhead_page_path: Path) -> None:
+    """
+    Extract the cached items from their saved wowhead pages again, without fetching
+    them, e.g. after a fix to how items are extracted.
+    """
+    with Cache.open(cache_path, PageArchive(wowhead_page_path)) as cache:
+        changed, failed = cache.reparse()
+    print(f"updated {len(changed):,} items, couldn't reparse {len(failed):,} pages")
 
-    anyio.run(inner_loop, blizzard_api, vmagent_api, cache_path, period_seconds)
+
+def _page_archive(wowhead_page_path: Path | None) -> PageArchive | None:
+    return PageArchive(wowhead_page_path) if wowhead_page_path is not None else None
+
+
+def _utc_timestamp(naive: datetime) -> float:
+    return naive.replace(tzinfo=timezone.utc).timestamp()
 
 
 async def inner_loop(
-    blizzard_api: BlizzardAPI,
+    blizzard_apis: Sequence[BlizzardAPI],
     vmagent_api: VMAgentAPI,
-    cache_path: Path,
+    cache: Cache,
     period_seconds: int,
+    options: PullOptions = PullOptions(),
+    archive: SnapshotArchive | None = None,
+    export_state_path: Path | None = None,
+    page: MetricsPage | None = None,
+    metrics_port: int = 0,
+    schedules: Mapping[str, PublicationSchedule] | None = None,
 ) -> None:
-    # note: this code is "async", but it doesn't really go concurrent (as of now). we
-    # only really gain from being able to use this periodic function, which schedules
-    # our loop. otherwise, i don't think there's much need to rearchitect for
-    # concurrency: the network I/O in this project is:
-    #   1. one big request to the blizzard API, or
-    #   2. many little requests to localhost, which will have hardly any delay.
-    # so, again, for now, i don't see the need to do any kind of async queue, etc.
-    async for _ in periodic(period_seconds):
-        print("starting periodic pull of auctions")
-
-        with Cache.open(cache_path) as cache:
-            total_auction_count = 0
-            exported_auction_count = 0
-            exported_item_ids = set()
-            auctions_for_item: Mapping[Item, list[Auction]] = defaultdict(list)
-
-            async for auction in blizzard_api.get_commodity_auctions(cache=cache):
-                total_auction_count += 1
-
-                # there's too much data coming in -- roughly 300k auctions per API call.
-                # here, we do some filtering: only show common-or-better items in the
-                # current expac. this reduces the number of auctions by half
-                if auction.item.major < 10 or auction.item.quality < 1:
-                    continue
-
-                auctions_for_item[auction.item].append(auction)
-
-                # await vmagent_api.export_auction(auction=auction)
-                exported_auction_count += 1
-                exported_item_ids.add(auction.item.id_)
-
-            print('sorted auctions by item')
-
-            for auctions in auctions_for_item.values():
-                await vmagent_api.export_auction_summary(auctions)
-                await vmagent_api.export_auction_min(auctions)
+    """
+    Pull the regions until cancelled: each one on its own schedule if `schedules` has
+    one for every region, or else all of them together every `period_seconds`.
+    """
+    # the candles and other market metrics of every region, built up pull by pull
+    market = MarketTracker()
+    # the regions save the exported state from their own tasks
+    save_lock = anyio.Lock()
+
+    async def after_pulls() -> None:
+        batch = ExportBatch()
+        export_process_metrics(batch, cache, vmagent_api)
+        await send_self_metrics(vmagent_api, batch, page, "process")
+
+        if vmagent_api.exported is not None and export_state_path is not None:
+            async with save_lock:
+                await anyio.to_thread.run_sync(
+                    vmagent_api.exported.save, export_state_path
+                )
 
+    async def pull(blizzard_api: BlizzardAPI) -> PullReport | None:
+        return await pull_region(
+            blizzard_api, vmagent_api, cache, options, archive, market, page
+        )
+
+    async def pull_when_published(
+        blizzard_api: BlizzardAPI, schedule: PublicationSchedule
+    ) -> None:
+        async for _ in aligned(blizzard_api, schedule):
+            probe_count = schedule.probe_count
+            if await pull(blizzard_api) is None:
+                continue
             print(
-                f"exported {exported_auction_count:,} auctions for "
-                f"{len(exported_item_ids):,} matching items to vmagent (of a total "
-                f"{total_auction_count:,} auctions)."
+                f"next {blizzard_api.region} snapshot due in "
+                f"{schedule.interval_seconds:,.0f}s, got this one after "
+                f"{probe_count:,} probes"
             )
+            await after_pulls()
+
+    async with anyio.create_task_group() as server_group:
+        if page is not None:
+            port = await server_group.start(page.serve, "0.0.0.0", metrics_port)
+            print(f"serving metrics at http://0.0.0.0:{port}/metrics")
+        if vmagent_api.spool is not None:
+            # the pulls only append to the spool, and this sends it on
+            server_group.start_soon(drain, vmagent_api.spool, vmagent_api)
+
+        # the regions are pulled concurrently, sharing the item cache and the http
+        # client. most of a pull is waiting on the network (the blizzard download,
+        # wowhead lookups of new items, and the export to vmagent), so the time of a
+        # pull of all the regions is about the time of the slowest one, not their sum.
+        # within a pull, the stages overlap in the same way (see wowauction.pipeline).
+        if schedules is not None:
+            # each region's snapshots come out on their own time, so each region
+            # waits for its own
+            async with anyio.create_task_group() as task_group:
+                for blizzard_api in blizzard_apis:
+                    task_group.start_soon(
+                        pull_when_published,
+                        blizzard_api,
+                        schedules[blizzard_api.region],
+                    )
+        else:
+            async for _ in periodic(period_seconds):
+                print("starting periodic pull of auctions")
+
+                async with anyio.create_task_group() as task_group:
+                    for blizzard_api in blizzard_apis:
+                        task_group.start_soon(pull, blizzard_api)
+
+                await after_pulls()
+
+
+async def pull_region(
+    blizzard_api: CommoditiesSource,
+    vmagent_api: VMAgentAPI,
+    cache: Cache,
+    options: PullOptions,
+    archive: SnapshotArchive | None = None,
+    market: MarketTracker | None = None,
+    page: MetricsPage | None = None,
+) -> PullReport | None:
+    """
+    Pull the auctions of one region and export them, and return what happened, or None
+    if nothing was exported. A failed stage (e.g. an HTTP error) ends just this pull, so
+    one region's outage doesn't hold up the others.
+    """
+    try:
+        report = await run_pull(
+            blizzard_api, vmagent_api, cache, options, archive, market, page
+        )
+    except StageFailed as exc:
+        print(f"pull of {blizzard_api.region} failed: {exc}")
+        # some of the series it marked as exported may not have made it
+        if vmagent_api.exported is not None:
+            vmagent_api.exported.forget(blizzard_api.region)
+        return None
+    if report is None:
+        # we've already exported this one
+        return None
+    print(
+        f"pulled {report.region} in {report.timings}: {report.row_count:,} rows in "
+        f"{report.request_count:,} requests, {report.unchanged_row_count:,} unchanged "
+        "rows left out"
+    )
+    batch = ExportBatch()
+    export_pull_metrics(batch, report)
+    await send_self_metrics(vmagent_api, batch, page, f"pull/{report.region}")
+
+    # now that this pull is out, look up a few of the stale items again. they'll be
+    # used from the next pull on.
+    stale_ids = cache.stale_ids(
+        report.item_ids, max_age_seconds=options.item_max_age_seconds
+    )
+    await cache.refresh(
+        stale_ids[: options.item_refresh_limit],
+        concurrency=options.wowhead_concurrency,
+        max_per_second=options.wowhead_max_per_second,
+    )
+    return report
+
+
+async def send_self_metrics(
+    vmagent_api: VMAgentAPI,
+    batch: ExportBatch,
+    page: MetricsPage | None = None,
+    section: str = "",
+) -> None:
+    """
+    Send our own metrics to vmagent, or put them in `section` of the page to be
+    scraped, if there's a page.
+    """
+    if page is not None:
+        await page.replace_batch(section, batch)
+        return
+    # these are only about us, so losing some isn't worth failing anything over
+    try:
+        await vmagent_api.send(batch)
+    except httpx.HTTPError as exc:
+        print(f"couldn't send our own metrics: {exc!r}")
 
 
 if __name__ == "__main__":
-    main(auto_envvar_prefix="WOWAUCTION")
+    main()
@@ -1,42 +1,201 @@
-from collections.abc import AsyncIterable
+import hashlib
+import time
+from collections.abc import AsyncGenerator, AsyncIterable, AsyncIterator
+from email.utils import parsedate_to_datetime
 
 import arrow
-from attrs import frozen
+from attrs import define, field, frozen
 
-from wowauction.auction import Auction
-from wowauction.cache import Cache
-from wowauction.http_client import CLIENT
+from wowauction.http_client import BLIZZARD_CLIENT
+from wowauction.oauth import TokenManager
+
+
+class SnapshotUnchanged(Exception):
+    """The commodities snapshot is the same one we got last time."""
+
+
+@define
+class _CommoditiesState:
+    """What we know about the last commodities snapshot we got."""
+
+    # the Last-Modified header of the response, sent back as If-Modified-Since
+    last_modified: str | None = None
+
+    # a hash of the body, in case the server ignores If-Modified-Since
+    digest: bytes | None = None
+
+    # the Last-Modified header and hash of a snapshot that's been downloaded but not
+    # yet exported. they take the place of the above once it is (see
+    # `BlizzardAPI.commit_snapshot`), so a failed export is downloaded again instead of
+    # getting a 304.
+    pending: tuple[str | None, bytes] | None = None
+
+
+@define
+class DownloadStats:
+    """What happened in one commodities download, see `iter_commodity_payload`."""
+
+    # when the response came in, which is the time of the snapshot
+    accessed_at: float = 0.0
+
+    # when blizzard put out the snapshot, from its Last-Modified header, if it has one
+    published_at: float | None = None
+
+    # getting the access token
+    token_seconds: float = 0.0
+
+    # waiting on the response and its body
+    network_seconds: float = 0.0
+
+    # the size of the body as it was sent, and once it's decompressed
+    download_bytes: int = 0
+    payload_bytes: int = 0
+
+
+# the regions with their own auction houses. (china has a separate API, and isn't
+# supported.)
+REGIONS = ("us", "eu", "kr", "tw")
 
 
 @frozen
 class BlizzardAPI:
-    client_id: str
-    client_secret: str
-
-    async def get_commodity_auctions(self, cache: Cache) -> AsyncIterable[Auction]:
-        token_response = await CLIENT.post(
-            "https://oauth.battle.net/token",
-            data={"grant_type": "client_credentials"},
-            auth=(self.client_id, self.client_secret),
-        )
-        response_json = token_response.json()
-        print("got POST https://oauth.battle.net/token")
-
-        access_token = response_json["access_token"]
-
-        commodities_response = await CLIENT.get(
-            "https://us.api.blizzard.com/data/wow/auctions/commodities",
+    token_manager: TokenManager
+    region: str = "us"
+    _commodities_state: _CommoditiesState = field(init=False, factory=_CommoditiesState)
+
+    @property
+    def last_modified(self) -> str | None:
+        """The Last-Modified header of the last commodities snapshot we got."""
+        return self._commodities_state.last_modified
+
+    @property
+    def published_at(self) -> float | None:
+        """
+        When the last commodities snapshot we got was put out, as a unix timestamp, if
+        its Last-Modified header said.
+        """
+        return _http_date_timestamp(self._commodities_state.last_modified)
+
+    def commit_snapshot(self) -> None:
+        """
+        Take the snapshot last yielded by `iter_commodity_payload` as the one we got,
+        once it's been exported, so that the next download only gets it again if it's
+        changed.
+        """
+        state = self._commodities_state
+        if state.pending is not None:
+            state.last_modified, state.digest = state.pending
+            state.pending = None
+
+    async def iter_commodity_payload(
+        self, segment_bytes: int = 1024 * 1024, stats: DownloadStats | None = None
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Yield the body of the current commodities snapshot as it downloads, in segments
+        of at least `segment_bytes` (but the last), so it can be parsed as it comes in
+        instead of being held in memory whole.
+
+        The commodities only change about once an hour, so this makes a conditional
+        request with the snapshot's Last-Modified time. An unchanged snapshot costs a
+        304 and no parsing at all. If the server sends it anyway, it's still recognized
+        by its content hash once it's all downloaded. Either way, raises
+        SnapshotUnchanged. A new snapshot only counts as the last one we got once
+        `commit_snapshot` is called.
+
+        If `stats` is given, it's filled in as the download goes.
+        """
+        if stats is None:
+            stats = DownloadStats()
+
+        start = time.perf_counter()
+        access_token = await self.token_manager.get()
+        stats.token_seconds += time.perf_counter() - start
+
+        state = self._commodities_state
+        state.pending = None
+        headers = {}
+        if state.last_modified is not None:
+            headers["If-Modified-Since"] = state.last_modified
+
+        url = f"https://{self.region}.api.blizzard.com/data/wow/auctions/commodities"
+
+        start = time.perf_counter()
+        async with BLIZZARD_CLIENT.stream(
+            "GET",
+            url,
             params={
-                "namespace": "dynamic-us",
+                "namespace": f"dynamic-{self.region}",
                 "locale": "en_US",
                 "access_token": access_token,
             },
-        )
-        print("got GET https://us.api.blizzard.com/data/wow/auctions/commodities")
+            headers=headers,
+        ) as commodities_response:
+            stats.network_seconds += time.perf_counter() - start
+            if commodities_response.status_code == 401:
+                # the token was revoked or expired early. the next pull gets a new one.
+                self.token_manager.invalidate(access_token)
+            if commodities_response.status_code == 304:
+                raise SnapshotUnchanged(
+                    f"{self.region} commodities have not changed since the last pull"
+                )
+            commodities_response.raise_for_status()
+            print(f"got GET {url}")
+
+            stats.accessed_at = arrow.get().timestamp()
+            stats.published_at = _http_date_timestamp(
+                commodities_response.headers.get("Last-Modified")
+            )
 
-        access_time = arrow.get().timestamp()
+            digest = hashlib.blake2b()
+            segment: list[bytes] = []
+            segment_size = 0
+            async for chunk in _measured(
+                commodities_response.aiter_bytes(), digest, stats
+            ):
+                segment.append(chunk)
+                segment_size += len(chunk)
+                if segment_size >= segment_bytes:
+                    yield b"".join(segment)
+                    segment, segment_size = [], 0
+            if segment:
+                yield b"".join(segment)
 
-        for blizz_auction_obj in commodities_response.json()["auctions"]:
-            yield await Auction.from_blizz_auction(
-                blizz_auction_obj=blizz_auction_obj, cache=cache, timestamp=access_time
+        stats.download_bytes += commodities_response.num_bytes_downloaded
+        last_modified = commodities_response.headers.get("Last-Modified")
+        if digest.digest() == state.digest:
+            state.last_modified = last_modified
+            raise SnapshotUnchanged(
+                f"{self.region} commodities are the same as the last pull"
             )
+        state.pending = (last_modified, digest.digest())
+
+
+def _http_date_timestamp(value: str | None) -> float | None:
+    # e.g. "Tue, 14 Mar 2023 18:04:05 GMT", or None if it's missing or malformed
+    if value is None:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+async def _measured(
+    chunks: AsyncIterable[bytes], digest: hashlib.blake2b, stats: DownloadStats
+) -> AsyncIterator[bytes]:
+    """
+    Pass `chunks` through, hashing them into `digest` and counting their bytes and the
+    time spent waiting on each one into `stats`.
+    """
+    iterator = aiter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        finally:
+            stats.network_seconds += time.perf_counter() - start
+        digest.update(chunk)
+        stats.payload_bytes += len(chunk)
+        yield chunk
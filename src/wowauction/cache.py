@@ -1,24 +1,56 @@
 from __future__ import annotations
 
 import sqlite3
-from collections.abc import Iterator
+import time
+from collections.abc import Iterable, Iterator
 from contextlib import contextmanager
 from pathlib import Path
 
-from attrs import field, frozen
+import anyio
+import httpx
+from attrs import define, field, frozen
 
 from wowauction.item import Item
+from wowauction.throttle import RateLimiter
+from wowauction.wowhead import PageArchive, parse_item_page
 from wowauction.wowhead import lookup as wowhead_lookup
 
 
+@define
+class LookupStats:
+    """Running totals of the wowhead lookups made by a cache, since it was opened."""
+
+    lookup_count: int = 0
+    failure_count: int = 0
+    seconds: float = 0.0
+
+
 @frozen
 class Cache:
     con: sqlite3.Connection
 
     # i see that you like caches, we put a cache in your cache so you can cache while
     # you cache.
-    # so, the hierarchy is: in-memory cache, sqlite, wowhead
-    in_memory: dict[str, Item] = field(factory=dict)
+    # so, the hierarchy is: in-memory cache, sqlite, wowhead. the whole sqlite table is
+    # loaded into memory when the cache opens, so the in-memory cache is never missing
+    # anything that sqlite has.
+    in_memory: dict[int, Item] = field(factory=dict)
+
+    # when each item was last looked up on wowhead, as a unix timestamp. see
+    # `stale_ids` for how this decides when an item is looked up again.
+    looked_up_at: dict[int, float] = field(factory=dict)
+
+    # items that have been looked up but not yet written to sqlite. see `flush`.
+    pending: list[Item] = field(factory=list)
+
+    # the lookups in progress, so that concurrent pulls (e.g. of different regions) that
+    # need the same new item only look it up once
+    in_flight: dict[int, anyio.Event] = field(factory=dict)
+
+    lookup_stats: LookupStats = field(factory=LookupStats)
+
+    # where the pages of looked up items are saved, if anywhere. see `reparse`.
+    page_archive: PageArchive | None = None
 
     @classmethod
     def _create_tables(cls, con: sqlite3.Connection) -> None:
@@ -34,37 +66,41 @@ class Cache:
                     major INTEGER,
                     minor INTEGER,
                     patch INTEGER,
-                    build INTEGER
+                    build INTEGER,
+                    looked_up_at REAL
                 );
             """
             )
+            # caches from before looked_up_at existed: count their items as looked up
+            # now, so they aren't all looked up again at once.
+            columns = {row[1] for row in con.execute("PRAGMA table_info(item)")}
+            if "looked_up_at" not in columns:
+                con.execute("ALTER TABLE item ADD COLUMN looked_up_at REAL")
+                con.execute("UPDATE item SET looked_up_at = ?", (time.time(),))
 
     @classmethod
     @contextmanager
-    def open(cls, path: Path) -> Iterator[Cache]:
+    def open(
+        cls, path: Path, page_archive: PageArchive | None = None
+    ) -> Iterator[Cache]:
         path.parent.mkdir(parents=True, exist_ok=True)
         con = sqlite3.Connection(path)
         con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
         cls._create_tables(con)
-        yield cls(con=con)
-        con.close()
-
-    def get(self, id_: str) -> Item | None:
-        if id_ in self.in_memory:
-            return self.in_memory[id_]
+        cache = cls(con=con, page_archive=page_archive)
+        cache._load()
+        try:
+            yield cache
+        finally:
+            cache.flush()
+            con.close()
 
-        with self.con:
-            result = self.con.execute(
-                """
-                SELECT *
-                FROM item WHERE item.id = :id;
-                """,
-                {"id": id_},
-            )
-            if (row := result.fetchone()) is None:
-                return None
-            item = Item(
-                id_=id_,
+    def _load(self) -> None:
+        result = self.con.execute("SELECT * FROM item")
+        for row in result:
+            self.in_memory[row["id"]] = Item(
+                id_=row["id"],
                 name=row["name"],
                 quality=row["quality"],
                 rank=row["rank"],
@@ -73,34 +109,202 @@ class Cache:
                 patch=row["patch"],
                 build=row["build"],
             )
-            self.in_memory[id_] = item
-            return item
+            self.looked_up_at[row["id"]] = row["looked_up_at"]
+
+    def get(self, id_: int) -> Item | None:
+        return self.in_memory.get(id_)
+
+    def get_many(self, ids: Iterable[int]) -> dict[int, Item]:
+        """
+        The cached items of `ids`, by ID. IDs that aren't cached are left out.
+        """
+        in_memory = self.in_memory
+        return {id_: in_memory[id_] for id_ in ids if id_ in in_memory}
 
     def insert(self, item: Item) -> None:
+        """
+        Add an item to the cache. It's written to sqlite on the next `flush`.
+        """
+        self.in_memory[item.id_] = item
+        self.looked_up_at[item.id_] = time.time()
+        self.pending.append(item)
+
+    def flush(self) -> None:
+        """
+        Write all the pending items to sqlite in one transaction.
+        """
+        if not self.pending:
+            return
         with self.con:
-            self.con.execute(
+            self.con.executemany(
                 """
-                INSERT INTO item (id, name, quality, rank, major, minor, patch, build)
-                VALUES (:id, :name, :quality, :rank, :major, :minor, :patch, :build)
+                INSERT OR REPLACE INTO item
+                (id, name, quality, rank, major, minor, patch, build, looked_up_at)
+                VALUES (
+                    :id, :name, :quality, :rank, :major, :minor, :patch, :build,
+                    :looked_up_at
+                )
                 """,
-                {
-                    "id": item.id_,
-                    "name": item.name,
-                    "quality": item.quality,
-                    "rank": item.rank,
-                    "major": item.major,
-                    "minor": item.minor,
-                    "patch": item.patch,
-                    "build": item.build,
-                },
+                [
+                    {
+                        "id": item.id_,
+                        "name": item.name,
+                        "quality": item.quality,
+                        "rank": item.rank,
+                        "major": item.major,
+                        "minor": item.minor,
+                        "patch": item.patch,
+                        "build": item.build,
+                        "looked_up_at": self.looked_up_at[item.id_],
+                    }
+                    for item in self.pending
+                ],
             )
-        self.in_memory[item.id_] = item
+        self.pending.clear()
+
+    def reparse(self) -> tuple[list[int], list[int]]:
+        """
+        Extract every item from its saved page again, e.g. after a fix to
+        `parse_item_page`, and update the ones that came out different. They keep the
+        time they were looked up at, since their pages are no newer.
+
+        Returns the IDs of the items that changed, and of the pages that couldn't be
+        parsed.
+        """
+        if self.page_archive is None:
+            raise ValueError("Can't reparse items without a page archive")
+        changed: list[int] = []
+        failed: list[int] = []
+        for id_ in sorted(self.page_archive.ids()):
+            try:
+                item = parse_item_page(id_, self.page_archive.read(id_))
+            except ValueError as exc:
+                print(f"Couldn't reparse item with id {id_}: {exc}")
+                failed.append(id_)
+                continue
+            if self.in_memory.get(id_) == item:
+                continue
+            self.in_memory[id_] = item
+            self.looked_up_at.setdefault(id_, time.time())
+            self.pending.append(item)
+            changed.append(id_)
+        self.flush()
+        return changed, failed
+
+    def stale_ids(self, ids: Iterable[int], max_age_seconds: float) -> list[int]:
+        """
+        The cached items of `ids` that should be looked up again, oldest first.
+
+        An item is stale when it was looked up more than `max_age_seconds` ago, or when
+        it was looked up before we first saw an item from the newest patch build. (A new
+        build means a patch came out, and a patch can change names, qualities and
+        ranks.)
+        """
+        looked_up_at = self.looked_up_at
+        stale_before = time.time() - max_age_seconds
+
+        if self.in_memory:
+            newest_build = max(item.build for item in self.in_memory.values())
+            newest_build_seen_at = min(
+                looked_up_at[id_]
+                for id_, item in self.in_memory.items()
+                if item.build == newest_build
+            )
+            stale_before = max(stale_before, newest_build_seen_at)
+
+        return sorted(
+            (
+                id_
+                for id_ in ids
+                if id_ in looked_up_at and looked_up_at[id_] < stale_before
+            ),
+            key=looked_up_at.__getitem__,
+        )
+
+    async def prefetch(
+        self,
+        ids: Iterable[int],
+        concurrency: int = 8,
+        max_per_second: float = 4,
+    ) -> list[int]:
+        """
+        Look up every item of `ids` that isn't in the cache yet, running up to
+        `concurrency` wowhead lookups at once and starting at most `max_per_second` of
+        them a second.
+
+        A failed lookup doesn't stop the others. Returns the IDs that couldn't be looked
+        up, which will be tried again the next time they are prefetched.
+        """
+        missing = [id_ for id_ in ids if self.get(id_=id_) is None]
+        if not missing:
+            return []
+        print(f"Looking up {len(missing):,} items that are not in cache.")
+        return await self._lookup_all(missing, concurrency, max_per_second)
+
+    async def refresh(
+        self,
+        ids: Iterable[int],
+        concurrency: int = 8,
+        max_per_second: float = 4,
+    ) -> list[int]:
+        """
+        Look up the items of `ids` again, whether or not they're cached, like
+        `prefetch` does. An item that fails to refresh keeps its cached data.
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+        print(f"Refreshing {len(ids):,} stale items.")
+        return await self._lookup_all(ids, concurrency, max_per_second)
+
+    async def _lookup_all(
+        self, ids: list[int], concurrency: int, max_per_second: float
+    ) -> list[int]:
+        already_in_flight = [
+            self.in_flight[id_] for id_ in ids if id_ in self.in_flight
+        ]
+        ids = [id_ for id_ in ids if id_ not in self.in_flight]
+        for id_ in ids:
+            self.in_flight[id_] = anyio.Event()
+
+        limiter = anyio.CapacityLimiter(concurrency)
+        rate_limiter = RateLimiter(per_second=max_per_second)
+        failed: list[int] = []
+
+        async def lookup(id_: int) -> None:
+            async with limiter:
+                await rate_limiter.wait()
+                try:
+                    item = await self._timed_lookup(id_)
+                except (httpx.HTTPError, ValueError) as exc:
+                    print(f"Couldn't look up item with id {id_}: {exc}")
+                    failed.append(id_)
+                    return
+            print(f"Looked up {item.name} (id={item.id_}).")
+            self.insert(item)
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                for id_ in ids:
+                    task_group.start_soon(lookup, id_)
+        finally:
+            for id_ in ids:
+                self.in_flight.pop(id_).set()
+        self.flush()
+
+        for event in already_in_flight:
+            await event.wait()
+
+        return failed
 
-    async def get_or_lookup(self, id_: str) -> Item:
-        cached = self.get(id_=id_)
-        if cached is not None:
-            return cached
-        item = await wowhead_lookup(id_=id_)
-        print(f"Looked up {item.name} (id={item.id_}) because it was not in cache.")
-        self.insert(item)
-        return item
+    async def _timed_lookup(self, id_: int) -> Item:
+        stats = self.lookup_stats
+        start = time.perf_counter()
+        try:
+            return await wowhead_lookup(id_=id_, page_archive=self.page_archive)
+        except Exception:
+            stats.failure_count += 1
+            raise
+        finally:
+            stats.lookup_count += 1
+            stats.seconds += time.perf_counter() - start
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import math
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from attrs import frozen
+
+from wowauction.snapshot import COPPER_PER_GOLD, AuctionSnapshot
+
+# the price levels of the order book we export, as multiples of each item's minimum
+# price. the last one takes in every auction of the item.
+DEPTH_EDGES: tuple[float, ...] = (1.0, 1.01, 1.02, 1.05, 1.1, 1.25, 1.5, 2.0, math.inf)
+
+
+@frozen
+class ItemDepths:
+    """
+    The order book depth of every item in a snapshot: how much of the item is for sale
+    at or under each price level, and what buying all of it would cost. The levels are
+    multiples of the item's minimum price, so each item has the same few series no
+    matter how many auctions it has or how its price moves. Row `i` of each column
+    describes the item `item_id[i]`, and column `j` the level `edges[j]`.
+
+    Like the buckets of a Prometheus histogram, each level counts everything under it,
+    see https://prometheus.io/docs/concepts/metric_types/#histogram.
+    """
+
+    edges: tuple[float, ...]
+    item_id: npt.NDArray[np.int32]
+    quantity: npt.NDArray[np.int64]  # shape (len(item_id), len(edges))
+    cost_gold: npt.NDArray[np.float64]  # shape (len(item_id), len(edges))
+    timestamp: float
+    region: str
+
+    def __len__(self) -> int:
+        return len(self.item_id)
+
+
+def depth(
+    snapshot: AuctionSnapshot, edges: tuple[float, ...] = DEPTH_EDGES
+) -> ItemDepths:
+    """
+    Collapse the auctions of every item in `snapshot` into its order book depth at each
+    of `edges`.
+
+    Like `summarize`, this sorts the snapshot once, by item and ascending price, and
+    finds every level of every item with cumulative sums.
+    """
+    if not all(edge >= 1 for edge in edges):
+        raise ValueError(f"Depth edges must be at least 1, got {edges}")
+    if list(edges) != sorted(edges):
+        raise ValueError(f"Depth edges must be in ascending order, got {edges}")
+
+    # by item, then by ascending price. (the keys are given one type, since that's all
+    # numpy's stubs take.)
+    keys: list[npt.NDArray[Any]] = [snapshot.unit_price, snapshot.item_id]
+    order = np.lexsort(keys)
+    item_id = snapshot.item_id[order]
+    unit_price = snapshot.unit_price[order]
+    quantity = snapshot.quantity[order].astype(np.int64)
+
+    starts = np.flatnonzero(np.r_[True, item_id[1:] != item_id[:-1]])[: len(item_id)]
+    ends = np.r_[starts[1:], len(item_id)][: len(starts)].astype(np.intp)
+    lengths = ends - starts
+
+    # each auction's price as a multiple of its item's minimum
+    relative_price = unit_price / np.repeat(unit_price[starts], lengths)
+
+    # the quantity and cost seen so far within each item
+    cumulative_quantity = np.cumsum(quantity)
+    cumulative_cost = np.cumsum(quantity * unit_price)
+    before_quantity = cumulative_quantity[starts] - quantity[starts]
+    before_cost = cumulative_cost[starts] - quantity[starts] * unit_price[starts]
+
+    last = np.empty((len(starts), len(edges)), dtype=np.intp)
+    for edge_index, edge in enumerate(edges):
+        if math.isinf(edge):
+            last[:, edge_index] = ends - 1
+            continue
+        if not len(starts):
+            # there are no items, and reduceat doesn't take no indices
+            continue
+        # the prices only grow within an item, so counting the ones under the level
+        # gives the offset of the last one that is. the minimum always is.
+        under = np.add.reduceat(relative_price <= edge, starts)
+        last[:, edge_index] = starts + under - 1
+
+    return ItemDepths(
+        edges=edges,
+        item_id=item_id[starts],
+        quantity=cumulative_quantity[last] - before_quantity[:, np.newaxis],
+        cost_gold=(cumulative_cost[last] - before_cost[:, np.newaxis])
+        / COPPER_PER_GOLD,
+        timestamp=snapshot.timestamp,
+        region=snapshot.region,
+    )
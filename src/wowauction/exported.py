@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+from attrs import define, field
+
+# the values of a series as they were rendered into its last row, and the time of it
+_Sent = tuple[str, int]
+
+
+@define
+class ExportedSeries:
+    """
+    The values last exported for every series, so that a pull only sends the series
+    that changed since. Most commodities keep the same minimum price, quantiles and
+    depth from one snapshot to the next, so at a short period most rows repeat the last
+    ones exactly.
+
+    A series is sent again anyway once `refresh_seconds` have gone by since it was
+    last sent, so that every live series has a recent sample and doesn't go stale in
+    VictoriaMetrics' queries.
+
+    The series are keyed by region, then row format, then the labels of the row as
+    rendered (everything before its values). The state can be saved to and loaded from
+    a JSON file, so that a restart doesn't send everything again.
+    """
+
+    refresh_seconds: int = 60 * 60
+    _sent: dict[str, dict[str, dict[str, _Sent]]] = field(factory=dict)
+
+    def series_for(
+        self, region: str, url_format_parameter_value: str
+    ) -> dict[str, _Sent]:
+        """The sent series of one region and format, to check rows against."""
+        return self._sent.setdefault(region, {}).setdefault(
+            url_format_parameter_value, {}
+        )
+
+    def forget(self, region: str) -> None:
+        """
+        Forget what was sent for `region`, so its next pull sends every series. Do this
+        when a pull fails, because some of what it marked as sent may not have been.
+        """
+        self._sent.pop(region, None)
+
+    @classmethod
+    def load(cls, path: Path, refresh_seconds: int) -> ExportedSeries:
+        """Load the state saved at `path`, or start over if there's none yet."""
+        try:
+            saved = json.loads(path.read_text())
+        except FileNotFoundError:
+            return cls(refresh_seconds=refresh_seconds)
+        return cls(
+            refresh_seconds=refresh_seconds,
+            sent={
+                region: {
+                    url_format_parameter_value: {
+                        labels: (values, sent_at)
+                        for labels, (values, sent_at) in series.items()
+                    }
+                    for url_format_parameter_value, series in formats.items()
+                }
+                for region, formats in saved.items()
+            },
+        )
+
+    def save(self, path: Path) -> None:
+        """
+        Save the state to `path`. This blocks while it writes, so run it in a worker
+        thread from async code.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # like the archive, never leave half a file behind
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._sent, separators=(",", ":")))
+        os.replace(tmp_path, path)
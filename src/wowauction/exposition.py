@@ -0,0 +1,229 @@
+"""
+The metrics of the latest pulls, served at `/metrics` in the Prometheus text exposition
+format, for vmagent (or VictoriaMetrics, or Prometheus) to scrape instead of us pushing
+to vmagent. See `--metrics-port` of the run command.
+
+The rows that would otherwise be pushed are rendered into the body of the page once per
+pull, and the finished body (gzipped too, unless that's turned off) replaces the last
+one in a single assignment. A scrape only writes out whatever body is current, so it
+costs the same however many items there are, and never sees half of a pull.
+
+Samples carry the time of their snapshot, like pushed rows do, so scraping the same
+body again doesn't move them. Scrape with deduplication (`-dedup.minScrapeInterval`)
+to keep only one sample of each.
+"""
+
+from __future__ import annotations
+
+import csv
+import gzip
+from collections import defaultdict
+from collections.abc import Mapping, Sequence
+
+import anyio
+from anyio.abc import SocketAttribute, SocketStream, TaskStatus
+from anyio.streams.buffered import BufferedByteReceiveStream
+from attrs import define, field, frozen
+
+from wowauction.vmagent import ExportBatch
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_MAX_HEADER_BYTES = 64 * 1024
+_MAX_BODY_BYTES = 64 * 1024
+
+_NOT_FOUND = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+_BAD_REQUEST = (
+    b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+)
+
+# the lines of each metric, by its name. the lines of one metric have to be together in
+# a page, so they're kept apart until the page is put together.
+MetricLines = dict[str, list[str]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_lines(rows_for_format: Mapping[str, Sequence[str]]) -> MetricLines:
+    """
+    Render the CSV rows of a batch (see `ExportBatch`) as exposition lines, one per
+    metric of each row. This takes a while for the rows of a whole pull, so run it in a
+    worker process from async code.
+    """
+    lines: MetricLines = defaultdict(list)
+    for url_format_parameter_value, rows in rows_for_format.items():
+        columns = [
+            column.split(":", 2) for column in url_format_parameter_value.split(",")
+        ]
+        label_indexes = [
+            (int(index) - 1, name) for index, type_, name in columns if type_ == "label"
+        ]
+        metric_indexes = [
+            (int(index) - 1, name)
+            for index, type_, name in columns
+            if type_ == "metric"
+        ]
+        time_indexes = [
+            int(index) - 1 for index, type_, _ in columns if type_ == "time"
+        ]
+        time_index = time_indexes[0] if time_indexes else None
+
+        for values in csv.reader(rows):
+            labels = ",".join(
+                f'{name}="{_escape(values[index])}"' for index, name in label_indexes
+            )
+            # a unix_s time column, in the milliseconds the exposition format uses
+            timestamp = (
+                f" {int(values[time_index]) * 1000}" if time_index is not None else ""
+            )
+            for index, name in metric_indexes:
+                lines[name].append(f"{name}{{{labels}}} {values[index]}{timestamp}\n")
+    return dict(lines)
+
+
+@frozen
+class _Body:
+    plain: bytes
+    gzipped: bytes | None
+
+
+@define
+class MetricsPage:
+    """
+    The body served at `/metrics`, put together from named sections (e.g. the auctions
+    of each region, and our own metrics). Replacing a section puts the whole body
+    together again.
+    """
+
+    # the gzip level of the body served to scrapers that accept it, or None to only
+    # serve it uncompressed
+    gzip_level: int | None = 1
+
+    _sections: dict[str, MetricLines] = field(init=False, factory=dict)
+    _body: _Body = field(init=False, factory=lambda: _Body(plain=b"", gzipped=None))
+    _lock: anyio.Lock = field(init=False, factory=anyio.Lock)
+
+    @property
+    def body(self) -> _Body:
+        return self._body
+
+    async def replace(self, section: str, lines: MetricLines) -> None:
+        """
+        Replace a section with lines rendered by `render_lines`. The body is put
+        together and compressed in a worker thread, and swapped in when it's done.
+        """
+        async with self._lock:
+            self._sections[section] = lines
+            self._body = await anyio.to_thread.run_sync(self._render)
+
+    async def replace_batch(self, section: str, batch: ExportBatch) -> None:
+        """Replace a section with the rows of a (small) batch."""
+        await self.replace(section, render_lines(batch.rows_for_format))
+
+    def _render(self) -> _Body:
+        sections = list(self._sections.values())
+        names = sorted({name for lines in sections for name in lines})
+        plain = "".join(
+            line for name in names for lines in sections for line in lines.get(name, ())
+        ).encode()
+        return _Body(
+            plain=plain,
+            gzipped=(
+                gzip.compress(plain, compresslevel=self.gzip_level, mtime=0)
+                if self.gzip_level is not None
+                else None
+            ),
+        )
+
+    async def serve(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 0,
+        *,
+        task_status: TaskStatus = anyio.TASK_STATUS_IGNORED,
+    ) -> None:
+        """
+        Serve `GET /metrics` over HTTP/1.1 until cancelled. Start it in a task group
+        with `await task_group.start(page.serve, ...)`, which gives the port it's
+        listening on.
+        """
+        listener = await anyio.create_tcp_listener(local_host=host, local_port=port)
+        async with listener:
+            task_status.started(listener.extra(SocketAttribute.local_port))
+            await listener.serve(self._handle)
+
+    async def _handle(self, stream: SocketStream) -> None:
+        # a scraper that hangs up mid-request or mid-response is its own problem, and
+        # only ends its own connection
+        async with stream:
+            try:
+                await self._respond(stream)
+            except (
+                anyio.BrokenResourceError,
+                anyio.EndOfStream,
+                anyio.IncompleteRead,
+                ConnectionError,
+            ):
+                return
+
+    async def _respond(self, stream: SocketStream) -> None:
+        # scrapers keep their connections alive, so each one carries many requests
+        receive = BufferedByteReceiveStream(stream)
+        while True:
+            try:
+                head = await receive.receive_until(b"\r\n\r\n", _MAX_HEADER_BYTES)
+            except (anyio.EndOfStream, anyio.IncompleteRead):
+                return
+            except anyio.DelimiterNotFound:
+                await stream.send(_BAD_REQUEST)
+                return
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, _ = request_line.split(" ", 2)
+            except ValueError:
+                await stream.send(_BAD_REQUEST)
+                return
+            headers = {
+                name.strip().lower(): value.strip()
+                for name, _, value in (
+                    line.partition(":") for line in header_lines if line
+                )
+            }
+            # a scrape has no body, but one sent anyway has to be read past. (one
+            # that's cut short just ends the connection, see `_handle`.)
+            content_length = headers.get("content-length", "0")
+            if (
+                not content_length.isascii()
+                or not content_length.isdigit()
+                or int(content_length) > _MAX_BODY_BYTES
+            ):
+                await stream.send(_BAD_REQUEST)
+                return
+            if int(content_length):
+                await receive.receive_exactly(int(content_length))
+
+            if method not in ("GET", "HEAD") or target.partition("?")[0] != "/metrics":
+                await stream.send(_NOT_FOUND)
+                continue
+
+            # whatever body is current now is the one sent, even if it's replaced
+            # while it's being sent
+            body = self._body
+            content = body.plain
+            encoding = ""
+            if body.gzipped is not None and "gzip" in headers.get(
+                "accept-encoding", ""
+            ):
+                content = body.gzipped
+                encoding = "Content-Encoding: gzip\r\n"
+            response_head = (
+                "HTTP/1.1 200 OK\r\n"
+                f"Content-Type: {CONTENT_TYPE}\r\n"
+                f"{encoding}"
+                f"Content-Length: {len(content)}\r\n\r\n"
+            ).encode()
+            await stream.send(response_head)
+            if method == "GET" and content:
+                await stream.send(content)
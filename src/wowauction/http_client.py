@@ -1,3 +1,48 @@
+"""
+The HTTP clients we make requests with, one per destination, so that each one's pool
+and timeouts suit what we ask of it.
+
+Every client keeps its connections alive between requests and retries a request whose
+connection couldn't be made. Responses are decompressed transparently, and httpx asks
+for gzip (and brotli, when its package is installed) by itself.
+"""
+
 import httpx
 
-CLIENT = httpx.AsyncClient()
+# how many times a request is tried again when its connection fails
+CONNECT_RETRIES = 3
+
+# the commodities download and the OAuth tokens. a pull is one long download per
+# region, so few connections are needed, and a read only times out if the body stalls.
+BLIZZARD_CLIENT = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        retries=CONNECT_RETRIES,
+        limits=httpx.Limits(
+            max_connections=8, max_keepalive_connections=8, keepalive_expiry=60
+        ),
+    ),
+    timeout=httpx.Timeout(30, connect=10),
+)
+
+# item lookups, at most `--wowhead-concurrency` at once
+WOWHEAD_CLIENT = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        retries=CONNECT_RETRIES,
+        limits=httpx.Limits(
+            max_connections=16, max_keepalive_connections=16, keepalive_expiry=30
+        ),
+    ),
+    timeout=httpx.Timeout(20, connect=10),
+)
+
+# import requests, at most `--export-workers` at once. vmagent is close by, but can
+# take a while to accept rows when it's applying backpressure.
+VMAGENT_CLIENT = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        retries=CONNECT_RETRIES,
+        limits=httpx.Limits(
+            max_connections=16, max_keepalive_connections=16, keepalive_expiry=30
+        ),
+    ),
+    timeout=httpx.Timeout(60, connect=5),
+)
@@ -3,7 +3,7 @@ from attrs import frozen
 
 @frozen
 class Item:
-    id_: str
+    id_: int
     name: str
     quality: int
     rank: None | int
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from collections.abc import Iterable, Mapping
+
+from attrs import field, frozen
+
+from wowauction.item import Item
+
+
+def _frozenset(values: Iterable[int]) -> frozenset[int]:
+    # (frozenset itself as a converter leaves the fields untyped for mypy)
+    return frozenset(values)
+
+
+@frozen
+class ItemFilter:
+    """
+    Which items' auctions we export. By default, common-or-better items of the current
+    expansion, which is about half of the ~300k auctions of a pull.
+    """
+
+    # the oldest expansion exported, as the major version of the game it came out in
+    min_major: int = 10
+
+    # the lowest quality exported, 0 being poor and 1 common
+    min_quality: int = 1
+
+    # the crafting ranks exported, if any are given. items without a rank are kept.
+    ranks: frozenset[int] = field(default=frozenset(), converter=_frozenset)
+
+    # if any are given, only these items are exported
+    allow_ids: frozenset[int] = field(default=frozenset(), converter=_frozenset)
+
+    # these items are never exported
+    deny_ids: frozenset[int] = field(default=frozenset(), converter=_frozenset)
+
+    def allows(self, item: Item) -> bool:
+        return (
+            item.major >= self.min_major
+            and item.quality >= self.min_quality
+            and (not self.ranks or item.rank is None or item.rank in self.ranks)
+            and (not self.allow_ids or item.id_ in self.allow_ids)
+            and item.id_ not in self.deny_ids
+        )
+
+    def compile(self, items: Mapping[int, Item]) -> ItemIDFilter:
+        """
+        This filter, worked out for the known `items` into a set of IDs, so that each
+        raw auction can be checked with one set lookup before anything is built for
+        it. Items that aren't known yet are kept, unless their ID alone rules them out,
+        so they can still be looked up.
+        """
+        if self.allow_ids:
+            return ItemIDFilter(
+                ids=frozenset(
+                    id_
+                    for id_ in self.allow_ids - self.deny_ids
+                    if id_ not in items or self.allows(items[id_])
+                ),
+                allow=True,
+            )
+        return ItemIDFilter(
+            ids=self.deny_ids.union(
+                id_ for id_, item in items.items() if not self.allows(item)
+            ),
+            allow=False,
+        )
+
+
+@frozen
+class ItemIDFilter:
+    """
+    An `ItemFilter` compiled into a set of item IDs: either the only ones kept (if
+    `allow`), or the ones rejected.
+    """
+
+    ids: frozenset[int]
+    allow: bool
+
+    def keeps(self, id_: int) -> bool:
+        return (id_ in self.ids) == self.allow
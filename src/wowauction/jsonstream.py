@@ -0,0 +1,145 @@
+"""
+Incremental parsing of one array in a JSON document, so that large payloads can be
+consumed while they download instead of being held in memory all at once.
+"""
+
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+from attrs import define, field
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DELIMITERS = frozenset(" \t\n\r,]")
+
+# how much of the buffer to keep around when we haven't found the array yet. this
+# needs to be at least as long as the key and the characters around it, so a key split
+# over two chunks is still found.
+_SEEK_TAIL = 256
+
+
+@define
+class ArrayScanner:
+    """
+    Finds the array value of `key` in a JSON document fed to it in chunks, and returns
+    the elements of that array as soon as each one is complete.
+
+    This is not a full validating parser: it looks for the first occurrence of
+    `"key": [` in the document and decodes the elements from there with the standard
+    library decoder. That's fine for the payloads we parse, where the key is unique.
+    """
+
+    key: str
+    _pattern: re.Pattern[str] = field(init=False)
+    _decoder: json.JSONDecoder = field(init=False, factory=json.JSONDecoder)
+    _text_decoder: codecs.IncrementalDecoder = field(
+        init=False, factory=lambda: codecs.getincrementaldecoder("utf-8")()
+    )
+    _buffer: str = field(init=False, default="")
+    _in_array: bool = field(init=False, default=False)
+    _done: bool = field(init=False, default=False)
+
+    def __attrs_post_init__(self) -> None:
+        self._pattern = re.compile(
+            rf"{re.escape(json.dumps(self.key))}[ \t\n\r]*:[ \t\n\r]*\["
+        )
+
+    # the decoders can't be pickled, so a scanner is pickled as what it has seen so far
+    # and rebuilds them when it's unpickled. that way it can be handed to a worker
+    # process along with the next chunk (see wowauction.workers).
+    def __getstate__(self) -> dict[str, Any]:
+        pending, flag = self._text_decoder.getstate()
+        return {
+            "key": self.key,
+            "buffer": self._buffer,
+            "pending": (pending, flag),
+            "in_array": self._in_array,
+            "done": self._done,
+        }
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__init__(state["key"])  # type: ignore[misc]
+        self._text_decoder.setstate(state["pending"])
+        self._buffer = state["buffer"]
+        self._in_array = state["in_array"]
+        self._done = state["done"]
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        """
+        Add the next chunk of the document, and return the array elements it completed.
+        """
+        if self._done:
+            return []
+        self._buffer += self._text_decoder.decode(chunk)
+        return self._drain(final=False)
+
+    def close(self) -> list[Any]:
+        """
+        Signal the end of the document, and return any remaining array elements.
+        """
+        if not self._done:
+            self._buffer += self._text_decoder.decode(b"", final=True)
+            elements = self._drain(final=True)
+            if not self._done:
+                raise ValueError(f"Document ended before the array of {self.key!r}")
+            return elements
+        return []
+
+    def _drain(self, final: bool) -> list[Any]:
+        if not self._in_array:
+            if (match := self._pattern.search(self._buffer)) is None:
+                self._buffer = self._buffer[-_SEEK_TAIL:]
+                return []
+            self._in_array = True
+            self._buffer = self._buffer[match.end() :]
+
+        elements = []
+        buffer = self._buffer
+        pos = 0
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()  # type: ignore[union-attr]
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if char == "]":
+                self._done = True
+                pos += 1
+                break
+            if char == ",":
+                pos += 1
+                continue
+            try:
+                element, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break
+            # a number at the end of the buffer could still be cut off (e.g. "12" of
+            # "123.4"), so only accept an element once a delimiter follows it.
+            if not final and (end == len(buffer) or buffer[end] not in _DELIMITERS):
+                break
+            elements.append(element)
+            pos = end
+
+        self._buffer = buffer[pos:]
+        return elements
+
+
+def iter_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """
+    Yield the elements of the array value of `key` from a JSON document in `chunks`.
+    """
+    scanner = ArrayScanner(key)
+    for chunk in chunks:
+        yield from scanner.feed(chunk)
+        if scanner.done:
+            return
+    yield from scanner.close()
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+from collections.abc import Mapping
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from attrs import define, field, frozen
+
+from wowauction.summary import ItemSummaries
+
+# the candle resolutions we export, by label, in seconds
+RESOLUTIONS: Mapping[str, int] = {"1h": 60 * 60, "1d": 24 * 60 * 60}
+
+
+@frozen
+class ItemCandles:
+    """
+    The open, high, low and close of the minimum price of every item, over the
+    `resolution` interval that the snapshot falls in, as of that snapshot. The candle
+    of an interval is complete once a snapshot of the next interval shows up, so the
+    last value of each interval is its candle.
+
+    Row `i` of each column describes the item `item_id[i]`.
+    """
+
+    resolution: str
+    item_id: npt.NDArray[np.int32]
+    open_gold: npt.NDArray[np.float64]
+    high_gold: npt.NDArray[np.float64]
+    low_gold: npt.NDArray[np.float64]
+    close_gold: npt.NDArray[np.float64]
+    timestamp: float
+    region: str
+
+
+@frozen
+class ItemMarket:
+    """
+    What `MarketTracker` worked out for the items of a snapshot: their candles at every
+    resolution, and
+
+    - vwap_gold: the volume weighted average price of the auctions
+    - spread_gold: the median price less the minimum price
+    - supply_delta: the change in quantity for sale since the last snapshot the item
+      was in, only for the items that were in an earlier snapshot (`supply_item_id`)
+
+    The quantity for sale within some percent of the minimum price is the order book
+    depth, see `depth`.
+    """
+
+    candles: tuple[ItemCandles, ...]
+    item_id: npt.NDArray[np.int32]
+    vwap_gold: npt.NDArray[np.float64]
+    spread_gold: npt.NDArray[np.float64]
+    supply_item_id: npt.NDArray[np.int32]
+    supply_delta: npt.NDArray[np.int64]
+    timestamp: float
+    region: str
+
+
+@define
+class _Candles:
+    start: npt.NDArray[np.int64]  # the start of each item's interval, in unix seconds
+    open_gold: npt.NDArray[np.float64]
+    high_gold: npt.NDArray[np.float64]
+    low_gold: npt.NDArray[np.float64]
+    close_gold: npt.NDArray[np.float64]
+
+
+@define
+class _RegionState:
+    # every item seen so far, ascending, and what we last knew of it. the other arrays
+    # line up with this one.
+    item_id: npt.NDArray[np.int32]
+    count: npt.NDArray[np.int64]
+    candles: dict[str, _Candles]
+
+    # the snapshot the state is as of, and the state before it was folded in
+    timestamp: float | None = None
+    previous: _RegionState | None = None
+
+
+@define
+class MarketTracker:
+    """
+    Rolling per-item state of each region, kept in memory from one snapshot to the
+    next, so that candles and changes can be exported as their own series instead of
+    being rebuilt by dashboards from the raw quantiles.
+
+    Snapshots of a region must be given in the order they were pulled. The same
+    snapshot can be given again, e.g. when the pull that exported it failed and is
+    tried again, and replaces itself instead of being folded in twice. Everything is
+    worked out for all the items of a snapshot at once, with the items lined up with
+    the state by a binary search.
+    """
+
+    resolutions: Mapping[str, int] = RESOLUTIONS
+    _states: dict[str, _RegionState] = field(init=False, factory=dict)
+
+    def update(self, summaries: ItemSummaries) -> ItemMarket:
+        """
+        Fold the summaries of a snapshot into the state, and return its metrics. The
+        summaries must have the median (a phi of 0.5).
+        """
+        if 0.5 not in summaries.phis:
+            raise ValueError(f"The summaries need the median, got {summaries.phis}")
+        median_index = summaries.phis.index(0.5)
+        item_id = summaries.item_id
+        price = summaries.min_gold
+        count = summaries.count.astype(np.int64)
+        timestamp = int(summaries.timestamp)
+
+        state = self._states.get(summaries.region)
+        if state is not None and state.timestamp == summaries.timestamp:
+            state = state.previous
+        if state is None:
+            state = _RegionState(
+                item_id=np.empty(0, dtype=np.int32),
+                count=np.empty(0, dtype=np.int64),
+                candles={
+                    resolution: _Candles(
+                        start=np.empty(0, dtype=np.int64),
+                        open_gold=np.empty(0),
+                        high_gold=np.empty(0),
+                        low_gold=np.empty(0),
+                        close_gold=np.empty(0),
+                    )
+                    for resolution in self.resolutions
+                },
+            )
+
+        # where each item of the snapshot is in the state, if it's there
+        index = np.searchsorted(state.item_id, item_id)
+        found = index < len(state.item_id)
+        found[found] = state.item_id[index[found]] == item_id[found]
+        index[~found] = 0
+
+        # the state of the items, whether or not they're in this snapshot
+        all_item_id = np.union1d(state.item_id, item_id).astype(np.int32)
+        old_position = np.searchsorted(all_item_id, state.item_id)
+        new_position = np.searchsorted(all_item_id, item_id)
+
+        def merged(old: npt.NDArray[Any], new: npt.NDArray[Any]) -> npt.NDArray:
+            column = np.empty(len(all_item_id), dtype=new.dtype)
+            column[old_position] = old
+            column[new_position] = new
+            return column
+
+        new_state = _RegionState(
+            item_id=all_item_id,
+            count=merged(state.count, count),
+            candles={},
+            timestamp=summaries.timestamp,
+            previous=state,
+        )
+        candles = []
+        for resolution, seconds in self.resolutions.items():
+            old = state.candles[resolution]
+            start = timestamp - timestamp % seconds
+            same = found & (_at(old.start, index) == start)
+            new = _Candles(
+                start=np.full(len(item_id), start, dtype=np.int64),
+                open_gold=np.where(same, _at(old.open_gold, index), price),
+                high_gold=np.where(
+                    same, np.maximum(_at(old.high_gold, index), price), price
+                ),
+                low_gold=np.where(
+                    same, np.minimum(_at(old.low_gold, index), price), price
+                ),
+                close_gold=price,
+            )
+            new_state.candles[resolution] = _Candles(
+                start=merged(old.start, new.start),
+                open_gold=merged(old.open_gold, new.open_gold),
+                high_gold=merged(old.high_gold, new.high_gold),
+                low_gold=merged(old.low_gold, new.low_gold),
+                close_gold=merged(old.close_gold, new.close_gold),
+            )
+            candles.append(
+                ItemCandles(
+                    resolution=resolution,
+                    item_id=item_id,
+                    open_gold=new.open_gold,
+                    high_gold=new.high_gold,
+                    low_gold=new.low_gold,
+                    close_gold=new.close_gold,
+                    timestamp=summaries.timestamp,
+                    region=summaries.region,
+                )
+            )
+
+        # only one snapshot back is kept
+        state.previous = None
+        self._states[summaries.region] = new_state
+
+        supply_delta = count[found] - _at(state.count, index)[found]
+
+        return ItemMarket(
+            candles=tuple(candles),
+            item_id=item_id,
+            vwap_gold=summaries.sum_gold / count,
+            spread_gold=summaries.quantiles_gold[:, median_index] - price,
+            supply_item_id=item_id[found],
+            supply_delta=supply_delta,
+            timestamp=summaries.timestamp,
+            region=summaries.region,
+        )
+
+
+def _at(column: npt.NDArray[Any], index: npt.NDArray[np.intp]) -> npt.NDArray:
+    # the values at `index`, which are all 0 when the column is still empty
+    if len(column) == 0:
+        return np.zeros(len(index), dtype=column.dtype)
+    return column[index]
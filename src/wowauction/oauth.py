@@ -0,0 +1,88 @@
+import anyio
+import httpx
+from attrs import define, field, frozen
+
+from wowauction.http_client import BLIZZARD_CLIENT
+
+TOKEN_URL = "https://oauth.battle.net/token"
+
+
+@frozen
+class _Token:
+    access_token: str
+    # in anyio.current_time() terms
+    expires_at: float
+
+
+@define
+class TokenManager:
+    """
+    Gets Battle.net client credentials access tokens, and reuses each one until shortly
+    before it expires.
+
+    Concurrent callers of `get` share a single refresh: the first one fetches the new
+    token while the rest wait for it. A failed fetch is retried with exponential
+    backoff.
+    """
+
+    client_id: str
+    client_secret: str
+
+    # how long before its expiry that a token is replaced
+    refresh_margin_seconds: float = 5 * 60
+
+    max_attempts: int = 5
+    first_backoff_seconds: float = 1
+
+    _token: _Token | None = field(init=False, default=None)
+    _lock: anyio.Lock = field(init=False, factory=anyio.Lock)
+
+    async def get(self) -> str:
+        """A valid access token, fetching a new one if needed."""
+        async with self._lock:
+            now = await anyio.current_time()
+            if (
+                self._token is None
+                or now >= self._token.expires_at - self.refresh_margin_seconds
+            ):
+                self._token = await self._fetch()
+            return self._token.access_token
+
+    def invalidate(self, access_token: str) -> None:
+        """
+        Stop using `access_token`, e.g. because it was rejected. The next `get` fetches
+        a new token, unless another caller already replaced this one.
+        """
+        if self._token is not None and self._token.access_token == access_token:
+            self._token = None
+
+    async def _fetch(self) -> _Token:
+        backoff_seconds = self.first_backoff_seconds
+        attempt = 1
+        while True:
+            requested_at = await anyio.current_time()
+            try:
+                token_response = await BLIZZARD_CLIENT.post(
+                    TOKEN_URL,
+                    data={"grant_type": "client_credentials"},
+                    auth=(self.client_id, self.client_secret),
+                )
+                token_response.raise_for_status()
+                response_json = token_response.json()
+                token = _Token(
+                    access_token=response_json["access_token"],
+                    expires_at=requested_at + response_json["expires_in"],
+                )
+            except (httpx.HTTPError, KeyError, ValueError) as exc:
+                if attempt == self.max_attempts:
+                    raise
+                print(
+                    f"couldn't get a token from {TOKEN_URL} (attempt {attempt}): "
+                    f"{exc!r}, retrying in {backoff_seconds}s"
+                )
+                await anyio.sleep(backoff_seconds)
+                backoff_seconds *= 2
+                attempt += 1
+                continue
+            print(f"got POST {TOKEN_URL}")
+            return token
@@ -0,0 +1,703 @@
+"""
+A pull of one region, as concurrent stages connected by bounded memory object streams:
+
+    download --bytes--> parse --chunks--> enrich --chunks--> aggregate --requests-->
+    export (N workers)
+
+- download: streams the commodities payload in segments of raw bytes.
+- parse: parses each segment into a snapshot chunk, in a worker process. Auctions of
+  items the item filter already rules out are dropped here, with one set lookup each.
+- enrich: finds the items of each chunk that aren't cached, and looks them up in the
+  background while the download goes on.
+- aggregate: joins the chunks, filters out newly looked up items that don't match,
+  summarizes them, updates the candles and other market metrics (see
+  wowauction.market) in a worker process, and
+  splits the rows into import requests. The snapshot is also written to the archive
+  (if there is one) in a worker thread.
+- export: posts the import requests to vmagent.
+
+So the time of a pull is about the time of its slowest stage (usually the download),
+not the sum of all of them. When a downstream stage falls behind, its full input buffer
+makes the stage before it wait. When a stage fails, the rest of the pull is cancelled,
+and the pull raises StageFailed with the stage's error as its cause.
+
+The parsing and summarizing are offloaded to worker processes (see wowauction.workers)
+so that they don't stall the event loop, and so that the pulls of several regions can
+use several cores.
+
+A replay of archived snapshots (see `run_replay`) works the same way, with a read stage
+in place of the download and enrich stages.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from collections.abc import (
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Iterator,
+    Mapping,
+    Sequence,
+)
+from contextlib import aclosing, contextmanager
+from pathlib import Path
+from typing import Protocol, TypeVar
+
+import anyio
+import anyio.to_process
+from anyio.abc import CancelScope, ObjectReceiveStream, ObjectSendStream
+from attrs import define, field, frozen
+
+from wowauction.archive import SnapshotArchive
+from wowauction.blizzard import DownloadStats, SnapshotUnchanged
+from wowauction.cache import Cache
+from wowauction.depth import DEPTH_EDGES
+from wowauction.exposition import MetricsPage, render_lines
+from wowauction.item import Item
+from wowauction.itemfilter import ItemFilter
+from wowauction.jsonstream import ArrayScanner
+from wowauction.market import MarketTracker
+from wowauction.snapshot import AuctionSnapshot
+from wowauction.summary import PHIS
+from wowauction.vmagent import ExportBatch, ImportRequest, VMAgentAPI
+from wowauction.workers import parse_segment, summarize_and_depth
+
+T = TypeVar("T")
+
+STAGES = ("download", "parse", "enrich", "aggregate", "archive", "export")
+REPLAY_STAGES = ("read", "aggregate", "export")
+
+
+class CommoditiesSource(Protocol):
+    """
+    What a pull needs of a `wowauction.blizzard.BlizzardAPI`, so that a fixture can
+    stand in for it.
+    """
+
+    @property
+    def region(self) -> str:
+        ...
+
+    def iter_commodity_payload(
+        self, segment_bytes: int = ..., stats: DownloadStats | None = ...
+    ) -> AsyncGenerator[bytes, None]:
+        ...
+
+    def commit_snapshot(self) -> None:
+        ...
+
+
+class StageFailed(Exception):
+    """
+    A stage of a pull or replay failed, which stopped the rest of it. The stage's own
+    error is the cause.
+    """
+
+
+@frozen
+class PullOptions:
+    wowhead_concurrency: int = 8
+    wowhead_max_per_second: float = 4
+    item_max_age_seconds: float = 30 * 24 * 60 * 60
+    item_refresh_limit: int = 100
+
+    # the size of the payload segments passed from the download to the parse stage.
+    # each one becomes a chunk of about 10k auctions.
+    segment_bytes: int = 1024 * 1024
+
+    # the number of segments, chunks or requests a stage can get ahead of the next one
+    buffer_size: int = 64
+
+    # the number of import requests sent to vmagent at once
+    export_workers: int = 4
+
+    # the order book depth levels exported for each item, see `depth`. none turns the
+    # depth export off.
+    depth_edges: tuple[float, ...] = DEPTH_EDGES
+
+    # the items whose auctions are exported
+    item_filter: ItemFilter = ItemFilter()
+
+    # whether to parse and summarize in worker processes. without them, that work runs
+    # on the event loop, which is only better for tiny snapshots.
+    worker_processes: bool = True
+
+
+@define
+class StageTimings:
+    """
+    How long each stage of a pull spent working, as opposed to waiting on the stages
+    around it, and how long the whole pull took. The export time is summed over its
+    workers.
+    """
+
+    stages: tuple[str, ...] = STAGES
+    busy_seconds: dict[str, float] = field(factory=lambda: defaultdict(float))
+    total_seconds: float = 0.0
+
+    @contextmanager
+    def busy(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy_seconds[stage] += time.perf_counter() - start
+
+    def __str__(self) -> str:
+        stages = ", ".join(
+            f"{stage} {self.busy_seconds[stage]:.2f}s" for stage in self.stages
+        )
+        return f"{self.total_seconds:.2f}s ({stages})"
+
+
+@define
+class PullReport:
+    """What happened in a pull that exported a snapshot."""
+
+    region: str
+    timings: StageTimings = field(factory=StageTimings)
+
+    # the download stage's time, split up. its time parsing is what's left over.
+    download: DownloadStats = field(factory=DownloadStats)
+
+    # all the items in the snapshot, and the ones whose auctions were exported
+    item_ids: list[int] = field(factory=list)
+    exported_item_count: int = 0
+
+    # how many of the items were already cached when they first showed up
+    cache_hit_count: int = 0
+    cache_miss_count: int = 0
+
+    # the auctions left out while parsing, because the item filter ruled out their
+    # items, and the ones that made it into the snapshot
+    filtered_auction_count: int = 0
+    auction_count: int = 0
+    exported_auction_count: int = 0
+
+    # the number of rows and import requests sent to vmagent, and the rows left out
+    # because their series hadn't changed since the last pull
+    row_count: int = 0
+    request_count: int = 0
+    unchanged_row_count: int = 0
+
+
+@define
+class ReplayReport:
+    """What happened in a replay of archived snapshots."""
+
+    timings: StageTimings = field(factory=lambda: StageTimings(stages=REPLAY_STAGES))
+    snapshot_count: int = 0
+    auction_count: int = 0
+    row_count: int = 0
+    request_count: int = 0
+
+
+@define
+class _StageFailure:
+    """The first stage of a pull or replay that failed, and its error."""
+
+    stage: str = ""
+    error: Exception | None = None
+
+    def record(self, stage: str, error: Exception) -> None:
+        # a failed stage closes its streams, which breaks the stages next to it. the
+        # error that broke them is the one worth keeping.
+        if self.error is None or (
+            isinstance(self.error, anyio.BrokenResourceError)
+            and not isinstance(error, anyio.BrokenResourceError)
+        ):
+            self.stage, self.error = stage, error
+
+    def raise_if_failed(self, what: str) -> None:
+        if self.error is not None:
+            raise StageFailed(
+                f"the {self.stage} stage of {what} failed: {self.error!r}"
+            ) from self.error
+
+
+@define
+class _PullState:
+    report: PullReport
+
+    # set by the download stage before it closes its stream
+    unchanged: bool = False
+
+    failure: _StageFailure = field(factory=_StageFailure)
+
+    @property
+    def timings(self) -> StageTimings:
+        return self.report.timings
+
+
+def matching_items(
+    items: Mapping[int, Item], item_filter: ItemFilter = ItemFilter()
+) -> dict[int, Item]:
+    """
+    The items whose auctions we export.
+
+    There's too much data coming in -- roughly 300k auctions per API call. here, we do
+    some filtering (by default, only common-or-better items in the current expac). this
+    reduces the number of auctions by half
+    """
+    return {
+        item_id: item for item_id, item in items.items() if item_filter.allows(item)
+    }
+
+
+async def run_pull(
+    blizzard_api: CommoditiesSource,
+    vmagent_api: VMAgentAPI,
+    cache: Cache,
+    options: PullOptions,
+    archive: SnapshotArchive | None = None,
+    market: MarketTracker | None = None,
+    page: MetricsPage | None = None,
+) -> PullReport | None:
+    """
+    Pull the auctions of one region and export them, and archive the snapshot if
+    `archive` is given. The candles and other market metrics are exported too, if
+    there's a `market` to keep their state across pulls. Returns a report of the pull,
+    or None if the snapshot was unchanged and nothing was exported.
+
+    With a `page`, the rows replace the region's section of it to be scraped, instead
+    of being pushed to vmagent.
+    """
+    state = _PullState(report=PullReport(region=blizzard_api.region))
+    start = time.perf_counter()
+
+    send_segments, receive_segments = anyio.create_memory_object_stream(
+        options.buffer_size, item_type=bytes
+    )
+    send_chunks, receive_chunks = anyio.create_memory_object_stream(
+        options.buffer_size, item_type=AuctionSnapshot
+    )
+    send_enriched, receive_enriched = anyio.create_memory_object_stream(
+        options.buffer_size, item_type=AuctionSnapshot
+    )
+    send_requests, receive_requests = anyio.create_memory_object_stream(
+        options.buffer_size, item_type=ImportRequest
+    )
+
+    failure = state.failure
+    async with anyio.create_task_group() as task_group:
+
+        def start_stage(
+            stage: str, func: Callable[..., Awaitable[None]], *args: object
+        ) -> None:
+            task_group.start_soon(
+                _stage, failure, task_group.cancel_scope, stage, func, *args
+            )
+
+        start_stage("download", _download, blizzard_api, options, state, send_segments)
+        start_stage(
+            "parse",
+            _parse,
+            blizzard_api,
+            cache,
+            options,
+            state,
+            receive_segments,
+            send_chunks,
+        )
+        start_stage(
+            "enrich", _enrich, cache, options, state, receive_chunks, send_enriched
+        )
+        start_stage(
+            "aggregate",
+            _aggregate,
+            vmagent_api,
+            cache,
+            options,
+            archive,
+            market,
+            page,
+            state,
+            receive_enriched,
+            send_requests,
+        )
+        async with receive_requests:
+            for _ in range(options.export_workers):
+                start_stage(
+                    "export",
+                    _export,
+                    vmagent_api,
+                    state.timings,
+                    receive_requests.clone(),
+                )
+
+    state.timings.total_seconds = time.perf_counter() - start
+    failure.raise_if_failed(f"the {blizzard_api.region} pull")
+    if state.unchanged:
+        return None
+    # it's out, so don't download it again
+    blizzard_api.commit_snapshot()
+    return state.report
+
+
+async def _stage(
+    failure: _StageFailure,
+    scope: CancelScope,
+    stage: str,
+    func: Callable[..., Awaitable[None]],
+    *args: object,
+) -> None:
+    """
+    Run a stage of a pull or replay. If it fails, its error is recorded in `failure`
+    and the rest of the stages (in `scope`) are cancelled, so that the caller gets one
+    error instead of a group of them.
+    """
+    try:
+        await func(*args)
+    except Exception as exc:
+        failure.record(stage, exc)
+        scope.cancel()
+
+
+async def _download(
+    blizzard_api: CommoditiesSource,
+    options: PullOptions,
+    state: _PullState,
+    send: ObjectSendStream[bytes],
+) -> None:
+    segments = blizzard_api.iter_commodity_payload(
+        options.segment_bytes, state.report.download
+    )
+    async with send, aclosing(segments):
+        while True:
+            with state.timings.busy("download"):
+                try:
+                    segment = await anext(segments, None)
+                except SnapshotUnchanged as exc:
+                    print(exc)
+                    state.unchanged = True
+                    return
+            if segment is None:
+                return
+            await send.send(segment)
+
+
+async def _parse(
+    blizzard_api: CommoditiesSource,
+    cache: Cache,
+    options: PullOptions,
+    state: _PullState,
+    receive: ObjectReceiveStream[bytes],
+    send: ObjectSendStream[AuctionSnapshot],
+) -> None:
+    # a scanner carries what it has seen of the payload from one segment to the next,
+    # so the segments are parsed one at a time, in whichever worker is free
+    download = state.report.download
+    report = state.report
+    async with receive, send:
+        # compiled from the items cached when the pull starts. ones looked up during
+        # the pull are filtered in the aggregate stage.
+        with state.timings.busy("parse"):
+            id_filter = options.item_filter.compile(cache.in_memory)
+        scanner = ArrayScanner("auctions")
+        async for segment in receive:
+            with state.timings.busy("parse"):
+                scanner, chunk, filtered_count = await _run_sync(
+                    options,
+                    parse_segment,
+                    scanner,
+                    segment,
+                    download.accessed_at,
+                    blizzard_api.region,
+                    id_filter,
+                )
+            report.filtered_auction_count += filtered_count
+            await send.send(chunk)
+
+        # there's nothing to finish parsing if the download didn't happen, or failed
+        if state.unchanged or state.failure.error is not None:
+            return
+        with state.timings.busy("parse"):
+            _, chunk, filtered_count = await _run_sync(
+                options,
+                parse_segment,
+                scanner,
+                None,
+                download.accessed_at,
+                blizzard_api.region,
+                id_filter,
+            )
+        report.filtered_auction_count += filtered_count
+        await send.send(chunk)
+
+
+async def _enrich(
+    cache: Cache,
+    options: PullOptions,
+    state: _PullState,
+    receive: ObjectReceiveStream[AuctionSnapshot],
+    send: ObjectSendStream[AuctionSnapshot],
+) -> None:
+    send_missing, receive_missing = anyio.create_memory_object_stream(
+        float("inf"), item_type=int
+    )
+
+    async def look_up_missing() -> None:
+        # look up whatever has piled up since the last batch, all together, so the
+        # wowhead limits hold across chunks
+        async with receive_missing:
+            async for id_ in receive_missing:
+                missing = [id_]
+                while True:
+                    try:
+                        missing.append(receive_missing.receive_nowait())
+                    except (anyio.WouldBlock, anyio.EndOfStream):
+                        break
+                await cache.prefetch(
+                    missing,
+                    concurrency=options.wowhead_concurrency,
+                    max_per_second=options.wowhead_max_per_second,
+                )
+
+    # the chunks are only closed out once every lookup is done, so the aggregate stage
+    # sees every item that could be looked up
+    async with receive, send, anyio.create_task_group() as lookups:
+        lookups.start_soon(look_up_missing)
+        async with send_missing:
+            seen: set[int] = set()
+            async for chunk in receive:
+                with state.timings.busy("enrich"):
+                    for id_ in chunk.item_ids():
+                        if id_ not in seen:
+                            seen.add(id_)
+                            if cache.get(id_) is None:
+                                state.report.cache_miss_count += 1
+                                send_missing.send_nowait(id_)
+                            else:
+                                state.report.cache_hit_count += 1
+                await send.send(chunk)
+
+
+async def _run_sync(options: PullOptions, func: Callable[..., T], *args: object) -> T:
+    """Run `func` in a worker process, unless `options` say not to."""
+    if options.worker_processes:
+        return await anyio.to_process.run_sync(func, *args)
+    return func(*args)
+
+
+async def export_snapshot(
+    vmagent_api: VMAgentAPI,
+    cache: Cache,
+    options: PullOptions,
+    snapshot: AuctionSnapshot,
+    report: PullReport,
+    market: MarketTracker | None = None,
+    page: MetricsPage | None = None,
+) -> list[ImportRequest]:
+    """
+    Filter, summarize and find the depth of `snapshot` (and update `market` with it, if
+    given), and split its rows into import requests. Fills in the counts of `report`.
+
+    If there's a `page`, the rows replace the snapshot's region on it instead, and
+    there are no requests.
+    """
+    item_ids = snapshot.item_ids()
+    items = matching_items(cache.get_many(item_ids), options.item_filter)
+    matching = snapshot.for_items(items)
+    summaries, depths = await _run_sync(
+        options, summarize_and_depth, matching, PHIS, options.depth_edges
+    )
+
+    batch = ExportBatch()
+    vmagent_api.export_item_summaries(batch, items, summaries)
+    if depths is not None:
+        vmagent_api.export_item_depths(batch, items, depths)
+    if market is not None:
+        vmagent_api.export_item_market(batch, items, market.update(summaries))
+    if page is not None:
+        lines = await _run_sync(options, render_lines, dict(batch.rows_for_format))
+        await page.replace(f"auctions/{snapshot.region}", lines)
+        requests = []
+    else:
+        requests = list(vmagent_api.requests(batch))
+
+    report.item_ids = item_ids
+    report.exported_item_count = len(items)
+    report.auction_count = len(snapshot)
+    report.exported_auction_count = len(matching)
+    report.row_count = batch.row_count
+    report.request_count = len(requests)
+    report.unchanged_row_count = batch.unchanged_row_count
+    return requests
+
+
+async def _aggregate(
+    vmagent_api: VMAgentAPI,
+    cache: Cache,
+    options: PullOptions,
+    archive: SnapshotArchive | None,
+    market: MarketTracker | None,
+    page: MetricsPage | None,
+    state: _PullState,
+    receive: ObjectReceiveStream[AuctionSnapshot],
+    send: ObjectSendStream[ImportRequest],
+) -> None:
+    async with receive, send:
+        chunks = [chunk async for chunk in receive]
+        if state.unchanged:
+            return
+
+        with state.timings.busy("aggregate"):
+            snapshot = AuctionSnapshot.concatenate(chunks)
+            requests = await export_snapshot(
+                vmagent_api, cache, options, snapshot, state.report, market, page
+            )
+
+        report = state.report
+        print(
+            f"exporting {report.exported_auction_count:,} {snapshot.region} auctions "
+            f"for {report.exported_item_count:,} matching items (of a total "
+            f"{report.auction_count + report.filtered_auction_count:,} auctions)."
+        )
+
+        async with anyio.create_task_group() as task_group:
+            if archive is not None:
+                task_group.start_soon(_archive, archive, state.timings, snapshot)
+            for request in requests:
+                await send.send(request)
+
+
+async def _archive(
+    archive: SnapshotArchive, timings: StageTimings, snapshot: AuctionSnapshot
+) -> None:
+    # a full disk shouldn't stop the export, the archive is only a backup
+    with timings.busy("archive"):
+        try:
+            path = await anyio.to_thread.run_sync(archive.write, snapshot)
+        except OSError as exc:
+            print(f"couldn't archive the {snapshot.region} snapshot: {exc!r}")
+            return
+    print(f"archived the {snapshot.region} snapshot to {path}")
+
+
+async def _export(
+    vmagent_api: VMAgentAPI,
+    timings: StageTimings,
+    receive: ObjectReceiveStream[ImportRequest],
+) -> None:
+    async with receive:
+        async for request in receive:
+            with timings.busy("export"):
+                await vmagent_api.post(request)
+
+
+async def run_replay(
+    archive: SnapshotArchive,
+    paths: Sequence[Path],
+    vmagent_api: VMAgentAPI,
+    cache: Cache,
+    options: PullOptions,
+) -> ReplayReport:
+    """
+    Export the archived snapshots at `paths` again, in order, with the times they were
+    originally pulled at. Snapshots are read ahead in a worker thread while earlier
+    ones are summarized and exported.
+
+    The candles and other market metrics are worked out again from the replayed
+    snapshots alone.
+    """
+    report = ReplayReport()
+    start = time.perf_counter()
+
+    send_snapshots, receive_snapshots = anyio.create_memory_object_stream(
+        options.buffer_size, item_type=AuctionSnapshot
+    )
+    send_requests, receive_requests = anyio.create_memory_object_stream(
+        options.buffer_size, item_type=ImportRequest
+    )
+
+    failure = _StageFailure()
+    async with anyio.create_task_group() as task_group:
+
+        def start_stage(
+            stage: str, func: Callable[..., Awaitable[None]], *args: object
+        ) -> None:
+            task_group.start_soon(
+                _stage, failure, task_group.cancel_scope, stage, func, *args
+            )
+
+        start_stage("read", _read, archive, paths, report, send_snapshots)
+        start_stage(
+            "aggregate",
+            _aggregate_replay,
+            vmagent_api,
+            cache,
+            options,
+            report,
+            receive_snapshots,
+            send_requests,
+        )
+        async with receive_requests:
+            for _ in range(options.export_workers):
+                start_stage(
+                    "export",
+                    _export,
+                    vmagent_api,
+                    report.timings,
+                    receive_requests.clone(),
+                )
+
+    report.timings.total_seconds = time.perf_counter() - start
+    failure.raise_if_failed("the replay")
+    return report
+
+
+async def _read(
+    archive: SnapshotArchive,
+    paths: Sequence[Path],
+    report: ReplayReport,
+    send: ObjectSendStream[AuctionSnapshot],
+) -> None:
+    # decompressing mostly happens outside of the GIL, so it overlaps with summarizing
+    async with send:
+        for path in paths:
+            with report.timings.busy("read"):
+                snapshot = await anyio.to_thread.run_sync(archive.read, path)
+            await send.send(snapshot)
+
+
+async def _aggregate_replay(
+    vmagent_api: VMAgentAPI,
+    cache: Cache,
+    options: PullOptions,
+    report: ReplayReport,
+    receive: ObjectReceiveStream[AuctionSnapshot],
+    send: ObjectSendStream[ImportRequest],
+) -> None:
+    async with receive, send:
+        id_filter = options.item_filter.compile(cache.in_memory)
+        market = MarketTracker()
+        seen: set[int] = set()
+        async for snapshot in receive:
+            # old snapshots can have items that have never been cached. each one is
+            # only tried once, so an item wowhead doesn't know can't hold up every
+            # snapshot it's in. items the filter rules out are never looked up.
+            unseen = [
+                id_
+                for id_ in snapshot.item_ids()
+                if id_ not in seen and id_filter.keeps(id_)
+            ]
+            seen.update(unseen)
+            await cache.prefetch(
+                unseen,
+                concurrency=options.wowhead_concurrency,
+                max_per_second=options.wowhead_max_per_second,
+            )
+            with report.timings.busy("aggregate"):
+                snapshot_report = PullReport(region=snapshot.region)
+                requests = await export_snapshot(
+                    vmagent_api, cache, options, snapshot, snapshot_report, market
+                )
+
+            report.snapshot_count += 1
+            report.auction_count += snapshot_report.auction_count
+            report.row_count += snapshot_report.row_count
+            report.request_count += snapshot_report.request_count
+            for request in requests:
+                await send.send(request)
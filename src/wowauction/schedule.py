@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import random
+import statistics
+from itertools import pairwise
+
+from attrs import define, field
+
+
+@define
+class PublicationSchedule:
+    """
+    When to pull a region, learned from when its commodities snapshots come out.
+
+    Blizzard puts out a new snapshot about once an hour, but not at a fixed time of the
+    hour, so pulling at a fixed period leaves the data up to a period stale, and a
+    shorter period downloads the same snapshot again and again. Instead, the time
+    between the last few snapshots (by their Last-Modified times) predicts when the
+    next one comes out. The next pull waits until a little before then, and from then
+    on each pull is a probe: a conditional request that only costs a 304 until the new
+    snapshot is out, with a growing and jittered backoff between probes.
+    """
+
+    # the time between snapshots until there are two to go by
+    default_interval_seconds: float = 60 * 60
+
+    # how long before the predicted snapshot to start probing for it
+    lead_seconds: float = 60
+
+    # the backoff between probes, which doubles from the first to the most
+    min_probe_seconds: float = 10
+    max_probe_seconds: float = 120
+
+    # the number of snapshot times kept to predict from
+    history: int = 24
+
+    _published: list[float] = field(init=False, factory=list)
+    _probe_count: int = field(init=False, default=0)
+    _random: random.Random = field(init=False, factory=random.Random)
+
+    @property
+    def interval_seconds(self) -> float:
+        """
+        The predicted time between snapshots: the median of the last few, which isn't
+        thrown off by one that was late, or that we missed.
+        """
+        intervals = [later - earlier for earlier, later in pairwise(self._published)]
+        if not intervals:
+            return self.default_interval_seconds
+        return statistics.median(intervals)
+
+    @property
+    def probe_count(self) -> int:
+        """The number of probes since the last new snapshot."""
+        return self._probe_count
+
+    def delay(self, published_at: float | None, now: float) -> float:
+        """
+        The number of seconds to wait before the next pull, after a pull that saw the
+        snapshot put out at `published_at` (e.g. `BlizzardAPI.published_at`, which is
+        None until a pull succeeds). Both are unix timestamps.
+        """
+        if published_at is not None and (
+            not self._published or published_at > self._published[-1]
+        ):
+            # a new snapshot. wait for the next one.
+            self._published.append(published_at)
+            del self._published[: -self.history]
+            self._probe_count = 0
+            next_published_at = self._published[-1] + self.interval_seconds
+            return max(0.0, next_published_at - self.lead_seconds - now)
+
+        # the next one isn't out yet (or the pull failed)
+        self._probe_count += 1
+        # (the exponent is capped, so a long outage doesn't overflow it)
+        backoff = min(
+            self.max_probe_seconds,
+            self.min_probe_seconds * 2 ** min(self._probe_count - 1, 32),
+        )
+        # somewhere in the second half of the backoff, so that the regions (and the
+        # restarts of a crash loop) don't all probe in step
+        return self._random.uniform(backoff / 2, backoff)
@@ -0,0 +1,150 @@
+"""
+Metrics about our own work, exported to vmagent next to the auction metrics so that a
+slow pull or a failing dependency shows up on the "wow-auction" dashboard.
+
+Per pull, labelled with the region:
+
+- wowauction_pull_stage_seconds{stage}: the time each stage spent working. The
+  download stage is split into getting the token and waiting on the network.
+- wowauction_pull_seconds: the time of the whole pull
+- wowauction_pull_download_bytes and wowauction_pull_payload_bytes: the size of the
+  commodities body as it was sent (usually compressed), and once it's decompressed
+- wowauction_pull_auctions, wowauction_pull_items and the exported auctions and
+  items, rows and requests
+- wowauction_pull_filtered_auctions: the auctions dropped while parsing, because the
+  item filter ruled out their items
+- wowauction_pull_cache_hits and wowauction_pull_cache_misses: the items of the pull
+  that were already cached, or not
+- wowauction_pull_unchanged_rows: the rows left out of the export because their
+  series hadn't changed since the last pull
+- wowauction_pull_snapshot_age_seconds: how long the snapshot had been out when we
+  got it, by its Last-Modified time, which is how stale the freshest data was
+
+For the process, as counters since it started:
+
+- wowauction_wowhead_lookups_total, wowauction_wowhead_lookup_failures_total and
+  wowauction_wowhead_lookup_seconds_total (so the mean latency is the rate of the
+  seconds over the rate of the lookups)
+- wowauction_vmagent_requests_total, wowauction_vmagent_request_errors_total and
+  wowauction_vmagent_bytes_total
+
+and the most memory held at once: wowauction_peak_rss_bytes by the process, and
+wowauction_worker_peak_rss_bytes by any one of the worker processes it parses and
+summarizes in (see wowauction.workers). The workers are only counted once they've
+exited, which they do when they've been idle for a while.
+
+With a spool (see wowauction.spool), its lag behind the export too:
+
+- wowauction_spool_pending_bytes: the size of the requests not yet sent to vmagent
+- wowauction_spool_lag_seconds: how long the oldest of them has waited
+- wowauction_spool_appended_rows_total, wowauction_spool_drained_rows_total,
+  wowauction_spool_rejected_rows_total (refused by vmagent) and
+  wowauction_spool_dropped_bytes_total (dropped to keep the spool under its bound)
+"""
+
+from __future__ import annotations
+
+import resource
+import sys
+
+from wowauction.cache import Cache
+from wowauction.pipeline import PullReport
+from wowauction.vmagent import ExportBatch, VMAgentAPI
+
+
+def peak_rss_bytes(who: int = resource.RUSAGE_SELF) -> int:
+    """
+    The peak RSS of this process, or with `resource.RUSAGE_CHILDREN`, of the largest
+    of its child processes that have exited.
+    """
+    # linux gives kibibytes, macos gives bytes
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def export_pull_metrics(batch: ExportBatch, report: PullReport) -> None:
+    timings = report.timings
+    download = report.download
+    stage_seconds = {
+        "token": download.token_seconds,
+        "network": download.network_seconds,
+        **{
+            stage: timings.busy_seconds[stage]
+            for stage in timings.stages
+            if stage != "download"
+        },
+    }
+    for stage, seconds in stage_seconds.items():
+        batch.add_metrics(
+            {"region": report.region, "stage": stage},
+            {"wowauction_pull_stage_seconds": seconds},
+        )
+
+    batch.add_metrics(
+        {"region": report.region},
+        {
+            "wowauction_pull_seconds": timings.total_seconds,
+            "wowauction_pull_download_bytes": download.download_bytes,
+            "wowauction_pull_payload_bytes": download.payload_bytes,
+            "wowauction_pull_auctions": report.auction_count,
+            "wowauction_pull_filtered_auctions": report.filtered_auction_count,
+            "wowauction_pull_exported_auctions": report.exported_auction_count,
+            "wowauction_pull_items": len(report.item_ids),
+            "wowauction_pull_exported_items": report.exported_item_count,
+            "wowauction_pull_cache_hits": report.cache_hit_count,
+            "wowauction_pull_cache_misses": report.cache_miss_count,
+            "wowauction_pull_rows": report.row_count,
+            "wowauction_pull_requests": report.request_count,
+            "wowauction_pull_unchanged_rows": report.unchanged_row_count,
+        },
+    )
+    if download.published_at is not None:
+        batch.add_metrics(
+            {"region": report.region},
+            {
+                "wowauction_pull_snapshot_age_seconds": (
+                    download.accessed_at - download.published_at
+                )
+            },
+        )
+
+
+def export_process_metrics(
+    batch: ExportBatch, cache: Cache, vmagent_api: VMAgentAPI
+) -> None:
+    lookup_stats = cache.lookup_stats
+    export_stats = vmagent_api.stats
+    batch.add_metrics(
+        {"job": "wowauction"},
+        {
+            "wowauction_wowhead_lookups_total": lookup_stats.lookup_count,
+            "wowauction_wowhead_lookup_failures_total": lookup_stats.failure_count,
+            "wowauction_wowhead_lookup_seconds_total": lookup_stats.seconds,
+            "wowauction_vmagent_requests_total": export_stats.request_count,
+            "wowauction_vmagent_request_errors_total": export_stats.error_count,
+            "wowauction_vmagent_bytes_total": export_stats.byte_count,
+            "wowauction_peak_rss_bytes": peak_rss_bytes(),
+            "wowauction_worker_peak_rss_bytes": peak_rss_bytes(
+                resource.RUSAGE_CHILDREN
+            ),
+        },
+    )
+    spool = vmagent_api.spool
+    if spool is not None:
+        batch.add_metrics(
+            {"job": "wowauction"},
+            {
+                "wowauction_spool_pending_bytes": spool.pending_bytes,
+                "wowauction_spool_lag_seconds": spool.lag_seconds,
+                "wowauction_spool_appended_rows_total": (
+                    spool.stats.appended_row_count
+                ),
+                "wowauction_spool_drained_rows_total": spool.stats.drained_row_count,
+                "wowauction_spool_rejected_rows_total": (
+                    spool.stats.rejected_row_count
+                ),
+                "wowauction_spool_dropped_bytes_total": (
+                    spool.stats.dropped_byte_count
+                ),
+            },
+        )
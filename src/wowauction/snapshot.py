@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from attrs import define, field, frozen
+
+# the time left values blizzard gives, in the order of their codes in
+# `AuctionSnapshot.time_left`
+TIME_LEFTS = ("SHORT", "MEDIUM", "LONG", "VERY_LONG")
+TIME_LEFT_CODES = {time_left: code for code, time_left in enumerate(TIME_LEFTS)}
+
+# the upper bound in minutes on the time left in an auction, indexed by time left code
+TIME_LEFT_MINUTES = np.array([30, 60 * 2, 60 * 12, 60 * 48], dtype=np.int32)
+
+COPPER_PER_GOLD = 100 * 100
+
+
+@frozen
+class AuctionSnapshot:
+    """
+    All the auctions from one pull of a region's commodities endpoint, stored as
+    parallel columns instead of one object per auction. Row `i` of each column describes
+    the same auction.
+    """
+
+    item_id: npt.NDArray[np.int32]
+    unit_price: npt.NDArray[np.int64]  # in copper
+    quantity: npt.NDArray[np.int32]
+    time_left: npt.NDArray[np.uint8]  # see TIME_LEFTS
+    timestamp: float
+    region: str
+
+    @classmethod
+    def concatenate(cls, snapshots: Sequence[AuctionSnapshot]) -> AuctionSnapshot:
+        """
+        Join snapshots (e.g. the chunks of one download) into one. They must all be
+        from the same region and time.
+        """
+        first = snapshots[0]
+        return AuctionSnapshot(
+            item_id=np.concatenate([snapshot.item_id for snapshot in snapshots]),
+            unit_price=np.concatenate([snapshot.unit_price for snapshot in snapshots]),
+            quantity=np.concatenate([snapshot.quantity for snapshot in snapshots]),
+            time_left=np.concatenate([snapshot.time_left for snapshot in snapshots]),
+            timestamp=first.timestamp,
+            region=first.region,
+        )
+
+    def __len__(self) -> int:
+        return len(self.item_id)
+
+    @property
+    def price_gold(self) -> npt.NDArray[np.float64]:
+        return self.unit_price / COPPER_PER_GOLD
+
+    @property
+    def time_left_minutes(self) -> npt.NDArray[np.int32]:
+        return TIME_LEFT_MINUTES[self.time_left]
+
+    def item_ids(self) -> list[int]:
+        """The distinct item IDs in this snapshot, in ascending order."""
+        return np.unique(self.item_id).tolist()
+
+    def filter(self, selector: npt.NDArray[Any] | slice) -> AuctionSnapshot:
+        """
+        A snapshot of only the auctions selected by a boolean mask, index array or
+        slice.
+        """
+        return AuctionSnapshot(
+            item_id=self.item_id[selector],
+            unit_price=self.unit_price[selector],
+            quantity=self.quantity[selector],
+            time_left=self.time_left[selector],
+            timestamp=self.timestamp,
+            region=self.region,
+        )
+
+    def for_items(self, item_ids: Iterable[int]) -> AuctionSnapshot:
+        """A snapshot of only the auctions of the given items."""
+        return self.filter(np.isin(self.item_id, np.fromiter(item_ids, dtype=np.int32)))
+
+    def group_by_item(self) -> Iterator[tuple[int, AuctionSnapshot]]:
+        """
+        Yield each item ID with a snapshot of just its auctions, in ascending item ID
+        order. The auctions are sorted once, so each group is a cheap slice.
+        """
+        ordered = self.filter(np.argsort(self.item_id, kind="stable"))
+        boundaries = np.flatnonzero(np.diff(ordered.item_id)) + 1
+        starts = np.r_[0, boundaries].tolist()
+        ends = np.r_[boundaries, len(ordered)].tolist()
+        for start, end in zip(starts, ends):
+            if start == end:
+                continue
+            yield int(ordered.item_id[start]), ordered.filter(slice(start, end))
+
+
+@define
+class AuctionSnapshotBuilder:
+    """
+    Accumulates auctions from the commodities payload one at a time, so they can be
+    added as they are parsed. The columns grow as compact typed arrays, so no per
+    auction objects are kept around.
+    """
+
+    _item_id: array[int] = field(init=False, factory=lambda: array("i"))
+    _unit_price: array[int] = field(init=False, factory=lambda: array("q"))
+    _quantity: array[int] = field(init=False, factory=lambda: array("i"))
+    _time_left: array[int] = field(init=False, factory=lambda: array("B"))
+
+    def __len__(self) -> int:
+        return len(self._item_id)
+
+    def add(self, blizz_auction_obj: Any) -> None:
+        self._item_id.append(blizz_auction_obj["item"]["id"])
+        self._unit_price.append(blizz_auction_obj["unit_price"])
+        self._quantity.append(blizz_auction_obj["quantity"])
+        self._time_left.append(TIME_LEFT_CODES[blizz_auction_obj["time_left"]])
+
+    def build(self, timestamp: float, region: str) -> AuctionSnapshot:
+        return AuctionSnapshot(
+            item_id=np.frombuffer(self._item_id, dtype=np.int32).copy(),
+            unit_price=np.frombuffer(self._unit_price, dtype=np.int64).copy(),
+            quantity=np.frombuffer(self._quantity, dtype=np.int32).copy(),
+            time_left=np.frombuffer(self._time_left, dtype=np.uint8).copy(),
+            timestamp=timestamp,
+            region=region,
+        )
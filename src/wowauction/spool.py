@@ -0,0 +1,462 @@
+"""
+An on-disk spool of the import requests for vmagent, so that a slow or restarting
+vmagent holds up nothing but the spool's drain, and loses nothing. See `--spool-path`
+of the run command.
+
+With a spool, `VMAgentAPI.post` only appends a request to the spool, which takes as
+long as a local write. `drain` sends the spooled requests on to vmagent in the
+background, in order, merging the ones of each format into a few large requests, and
+keeps trying each one until vmagent takes it.
+
+The spool is a directory of append-only segment files, `<number>.seg`, and a
+`cursor.json` of how far the drain has got. Each record of a segment is one request,
+behind a header with a checksum, so a record that was only half written when the
+process died is recognized and dropped. A segment is deleted once it's drained. The
+spool is bounded: if it grows past `max_bytes` (e.g. in a long vmagent outage), its
+oldest segment is dropped, drained or not.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Literal
+
+import anyio
+import httpx
+from attrs import define, field, frozen
+
+from wowauction.vmagent import ImportRequest, VMAgentAPI
+
+# when the spool makes sure what's written is on disk, not just in the page cache:
+# after every append, when a segment is done with, or never (and leave it to the OS)
+FsyncPolicy = Literal["always", "segment", "never"]
+FSYNC_POLICIES: tuple[FsyncPolicy, ...] = ("always", "segment", "never")
+
+# a record's header: the CRC-32 of the rest of the record, when it was appended, its
+# row count, the lengths of its URL and content, and whether the content is gzipped
+_HEADER = struct.Struct("<IdIIIB")
+
+_CURSOR_NAME = "cursor.json"
+
+
+def _segment_name(number: int) -> str:
+    return f"{number:012d}.seg"
+
+
+def _encode(request: ImportRequest, appended_at: float) -> bytes:
+    url = request.url.encode()
+    rest = _HEADER.pack(
+        0,
+        appended_at,
+        request.row_count,
+        len(url),
+        len(request.content),
+        request.content_encoding == "gzip",
+    )[4:]
+    crc = zlib.crc32(request.content, zlib.crc32(url, zlib.crc32(rest)))
+    return struct.pack("<I", crc) + rest + url + request.content
+
+
+def _read_record(f: BinaryIO) -> tuple[ImportRequest, float, int] | None:
+    """
+    The request of the record at the position of `f`, when it was appended, and the
+    size of the record, or None if it's incomplete or corrupt.
+    """
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    crc, appended_at, row_count, url_length, content_length, gzipped = _HEADER.unpack(
+        header
+    )
+    body = f.read(url_length + content_length)
+    if len(body) < url_length + content_length:
+        return None
+    if zlib.crc32(body, zlib.crc32(header[4:])) != crc:
+        return None
+    request = ImportRequest(
+        url=body[:url_length].decode(),
+        content=body[url_length:],
+        row_count=row_count,
+        content_encoding="gzip" if gzipped else None,
+    )
+    return request, appended_at, _HEADER.size + len(body)
+
+
+@define
+class SpoolStats:
+    """Running totals of what went through a spool, since it was opened."""
+
+    appended_row_count: int = 0
+    drained_row_count: int = 0
+
+    # rows vmagent refused outright (and which are never tried again)
+    rejected_row_count: int = 0
+
+    # spooled bytes that were never drained: dropped to keep the spool under its
+    # bound, or corrupt
+    dropped_byte_count: int = 0
+
+
+@frozen
+class SpoolBatch:
+    """Some spooled requests, and the position in the spool right after them."""
+
+    requests: list[ImportRequest]
+    end: tuple[int, int]
+
+
+@define
+class ExportSpool:
+    """
+    The spooled import requests, in `directory`. Open it with `ExportSpool.open`, which
+    picks up whatever an earlier process left in it.
+
+    The methods that touch the files block (but for `append`), so run them in a worker
+    thread from async code. They're safe to call from several threads at once.
+    """
+
+    directory: Path
+
+    # the most the spool holds before its oldest segment is dropped
+    max_bytes: int = 1024 * 1024 * 1024
+
+    # the size a segment grows to before the next one is started
+    segment_bytes: int = 64 * 1024 * 1024
+
+    fsync: FsyncPolicy = "always"
+
+    stats: SpoolStats = field(init=False, factory=SpoolStats)
+
+    # the size of each segment, by number, oldest first. the last one is appended to.
+    _sizes: dict[int, int] = field(init=False, factory=dict)
+    _head: BinaryIO | None = field(init=False, default=None)
+
+    # the segment and offset the drain reads from next
+    _cursor: tuple[int, int] = field(init=False, default=(0, 0))
+
+    # when the oldest request that's still spooled was appended, if any are
+    _oldest_appended_at: float | None = field(init=False, default=None)
+
+    _lock: threading.Lock = field(init=False, factory=threading.Lock)
+    _appended: anyio.Event | None = field(init=False, default=None)
+
+    @classmethod
+    @contextmanager
+    def open(
+        cls,
+        directory: Path,
+        max_bytes: int = 1024 * 1024 * 1024,
+        fsync: FsyncPolicy = "always",
+    ) -> Iterator[ExportSpool]:
+        directory.mkdir(parents=True, exist_ok=True)
+        # at least a few segments, so that dropping one doesn't drop most of the spool
+        spool = cls(
+            directory=directory,
+            max_bytes=max_bytes,
+            segment_bytes=max(1, min(64 * 1024 * 1024, max_bytes // 8)),
+            fsync=fsync,
+        )
+        spool._recover()
+        try:
+            yield spool
+        finally:
+            spool.close()
+
+    def _path(self, number: int) -> Path:
+        return self.directory / _segment_name(number)
+
+    def _recover(self) -> None:
+        numbers = sorted(
+            int(path.name.removesuffix(".seg")) for path in self.directory.glob("*.seg")
+        )
+        self._sizes = {number: self._path(number).stat().st_size for number in numbers}
+        if numbers:
+            # a crash can leave half a record at the end of the last segment, which
+            # the next append would otherwise be written after
+            last = numbers[-1]
+            path = self._path(last)
+            valid_size = 0
+            with path.open("rb") as f:
+                while (record := _read_record(f)) is not None:
+                    valid_size += record[2]
+            if valid_size < self._sizes[last]:
+                print(
+                    f"dropping {self._sizes[last] - valid_size:,} bytes of a torn "
+                    f"write at the end of {path}"
+                )
+                os.truncate(path, valid_size)
+                self._sizes[last] = valid_size
+
+        try:
+            cursor = json.loads((self.directory / _CURSOR_NAME).read_text())
+            self._cursor = (cursor["segment"], cursor["offset"])
+        except FileNotFoundError:
+            self._cursor = (numbers[0], 0) if numbers else (0, 0)
+        # the segment drained up to may have been deleted since
+        number, offset = self._cursor
+        if number not in self._sizes:
+            later = [n for n in numbers if n > number]
+            self._cursor = (later[0], 0) if later else (number, 0)
+        elif offset > self._sizes[number]:
+            self._cursor = (number, self._sizes[number])
+        if self.pending_bytes:
+            self._oldest_appended_at = time.time()
+
+    @property
+    def pending_bytes(self) -> int:
+        """The size of the requests that are spooled and not yet drained."""
+        number, offset = self._cursor
+        # (a copy, since the segments can change in another thread)
+        return sum(
+            size - (offset if n == number else 0)
+            for n, size in tuple(self._sizes.items())
+            if n >= number
+        )
+
+    @property
+    def lag_seconds(self) -> float:
+        """How long the oldest request that's still spooled has waited."""
+        if self._oldest_appended_at is None:
+            return 0.0
+        return max(0.0, time.time() - self._oldest_appended_at)
+
+    def write(self, requests: Sequence[ImportRequest]) -> None:
+        """
+        Append requests to the spool. This blocks while it writes (and syncs), so use
+        `append` from async code.
+        """
+        now = time.time()
+        data = b"".join(_encode(request, now) for request in requests)
+        with self._lock:
+            if self.pending_bytes == 0:
+                self._oldest_appended_at = now
+            head_number = next(reversed(self._sizes), None)
+            if (
+                self._head is None
+                or head_number is None
+                or (
+                    self._sizes[head_number]
+                    and self._sizes[head_number] + len(data) > self.segment_bytes
+                )
+            ):
+                head_number = self._roll(head_number)
+            assert self._head is not None
+            self._head.write(data)
+            self._head.flush()
+            if self.fsync == "always":
+                os.fsync(self._head.fileno())
+            self._sizes[head_number] += len(data)
+            self.stats.appended_row_count += sum(r.row_count for r in requests)
+            self._trim()
+
+    def _roll(self, head_number: int | None) -> int:
+        # finish the segment being appended to, and start appending to another one.
+        # (after a restart, the last segment is appended to again.)
+        if self._head is not None:
+            if self.fsync != "never":
+                os.fsync(self._head.fileno())
+            self._head.close()
+            assert head_number is not None
+            head_number += 1
+        elif head_number is None:
+            head_number = self._cursor[0]
+        self._head = self._path(head_number).open("ab")
+        self._sizes.setdefault(head_number, 0)
+        if self.fsync != "never":
+            # so that the new segment is there after a crash, too
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return head_number
+
+    def _trim(self) -> None:
+        # drop the oldest segments until the spool fits, but never the one appended to
+        while sum(self._sizes.values()) > self.max_bytes and len(self._sizes) > 1:
+            oldest = next(iter(self._sizes))
+            size = self._sizes.pop(oldest)
+            self._path(oldest).unlink(missing_ok=True)
+            number, offset = self._cursor
+            if oldest >= number:
+                dropped = size - offset if oldest == number else size
+                if dropped:
+                    self.stats.dropped_byte_count += dropped
+                    print(f"the spool is full, dropped {dropped:,} undrained bytes")
+                self._cursor = (next(iter(self._sizes)), 0)
+
+    def read(
+        self, max_rows: int = 100_000, max_bytes: int = 8 * 1024 * 1024
+    ) -> SpoolBatch | None:
+        """
+        The oldest requests that haven't been drained yet, up to about `max_rows` rows
+        or `max_bytes` of content, or None if there are none. Nothing is taken off the
+        spool until the batch is committed, see `commit`.
+        """
+        with self._lock:
+            number, offset = self._cursor
+            numbers = [n for n in self._sizes if n >= number]
+            # skip the ends of the segments that are done with
+            while numbers and offset >= self._sizes[numbers[0]] and len(numbers) > 1:
+                numbers.pop(0)
+                number, offset = numbers[0], 0
+            if not numbers or offset >= self._sizes[number]:
+                return None
+
+            end = self._sizes[number]
+            requests: list[ImportRequest] = []
+            row_count = content_bytes = 0
+            with self._path(number).open("rb") as f:
+                f.seek(offset)
+                while (
+                    offset < end and row_count < max_rows and content_bytes < max_bytes
+                ):
+                    record = _read_record(f)
+                    if record is None:
+                        # what's left of the segment can't be trusted
+                        self.stats.dropped_byte_count += end - offset
+                        print(f"dropping {end - offset:,} corrupt bytes of the spool")
+                        offset = end
+                        break
+                    request, appended_at, size = record
+                    if not requests:
+                        self._oldest_appended_at = appended_at
+                    requests.append(request)
+                    row_count += request.row_count
+                    content_bytes += len(request.content)
+                    offset += size
+            return SpoolBatch(requests=requests, end=(number, offset))
+
+    def commit(self, end: tuple[int, int]) -> None:
+        """Take everything up to `end` (of a batch that was drained) off the spool."""
+        with self._lock:
+            # the spool may have been trimmed past it in the meantime
+            if end <= self._cursor:
+                return
+            self._cursor = end
+            for number in [n for n in self._sizes if n < end[0]]:
+                del self._sizes[number]
+                self._path(number).unlink(missing_ok=True)
+
+            path = self.directory / _CURSOR_NAME
+            tmp_path = path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                json.dump({"segment": end[0], "offset": end[1]}, f)
+                if self.fsync == "always":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+            if self.pending_bytes == 0:
+                self._oldest_appended_at = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._head is not None:
+                if self.fsync != "never":
+                    os.fsync(self._head.fileno())
+                self._head.close()
+                self._head = None
+
+    async def append(self, requests: Sequence[ImportRequest]) -> None:
+        """Append requests to the spool in a worker thread, and wake up the drain."""
+        await anyio.to_thread.run_sync(self.write, requests)
+        if self._appended is not None:
+            self._appended.set()
+
+    async def wait(self) -> None:
+        """Wait until there's something to drain."""
+        self._appended = anyio.Event()
+        if self.pending_bytes:
+            return
+        await self._appended.wait()
+
+
+def _merged(
+    vmagent_api: VMAgentAPI, requests: Sequence[ImportRequest]
+) -> list[ImportRequest]:
+    """
+    The requests, sent to `vmagent_api`, with those of the same format and encoding
+    merged into one. Concatenated CSV is still CSV, and concatenated gzip members are
+    still one gzip stream.
+    """
+    merged: dict[tuple[str, str | None], list[ImportRequest]] = {}
+    for request in requests:
+        request = vmagent_api.retargeted(request)
+        merged.setdefault((request.url, request.content_encoding), []).append(request)
+    return [
+        ImportRequest(
+            url=url,
+            content=b"".join(request.content for request in group),
+            row_count=sum(request.row_count for request in group),
+            content_encoding=content_encoding,
+        )
+        for (url, content_encoding), group in merged.items()
+    ]
+
+
+async def drain(
+    spool: ExportSpool,
+    vmagent_api: VMAgentAPI,
+    max_rows: int = 100_000,
+    max_bytes: int = 8 * 1024 * 1024,
+    max_retry_seconds: float = 60.0,
+) -> None:
+    """
+    Send the spooled requests to vmagent until cancelled, in batches of up to
+    `max_rows` rows or `max_bytes` of content, merged into one request per format. A
+    request that fails is tried again after a growing, jittered backoff (of at most
+    `max_retry_seconds`) until vmagent takes it, unless vmagent refuses it outright.
+    """
+    while True:
+        batch = await anyio.to_thread.run_sync(spool.read, max_rows, max_bytes)
+        if batch is None:
+            await spool.wait()
+            continue
+        for request in _merged(vmagent_api, batch.requests):
+            await _send(spool, vmagent_api, request, max_retry_seconds)
+        await anyio.to_thread.run_sync(spool.commit, batch.end)
+
+
+async def _send(
+    spool: ExportSpool,
+    vmagent_api: VMAgentAPI,
+    request: ImportRequest,
+    max_retry_seconds: float,
+) -> None:
+    backoff = 1.0
+    while True:
+        try:
+            response = await vmagent_api.post_now(request)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            status_code = exc.response.status_code
+            if status_code < 500 and status_code != 429:
+                # the rows themselves are the problem, so they'd never go through
+                print(f"vmagent refused {request.row_count:,} spooled rows: {exc!r}")
+                spool.stats.rejected_row_count += request.row_count
+                return
+            error: Exception = exc
+        except httpx.HTTPError as exc:
+            error = exc
+        else:
+            spool.stats.drained_row_count += request.row_count
+            return
+        # somewhere in the second half of the backoff, so that a vmagent that's coming
+        # back up isn't hit by every retry at once
+        delay = random.uniform(backoff / 2, backoff)
+        print(
+            f"couldn't drain {request.row_count:,} spooled rows, trying again in "
+            f"{delay:.1f}s: {error!r}"
+        )
+        await anyio.sleep(delay)
+        backoff = min(max_retry_seconds, backoff * 2)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+from attrs import frozen
+
+from wowauction.snapshot import COPPER_PER_GOLD, AuctionSnapshot
+
+# the quantiles we export. 1 is an int so that its label stays "1" like it always has.
+PHIS: tuple[float, ...] = (0.5, 0.75, 0.9, 0.95, 0.99, 0.999, 1)
+
+
+@frozen
+class ItemSummaries:
+    """
+    A "summary" of the auctions of every item in a snapshot: pricing quantiles, the
+    minimum price, a total count of items, and a total sum of the auction prices. Row
+    `i` of each column describes the item `item_id[i]`.
+
+    See https://prometheus.io/docs/concepts/metric_types/#summary for metric detail.
+    """
+
+    phis: tuple[float, ...]
+    item_id: npt.NDArray[np.int32]
+    quantiles_gold: npt.NDArray[np.float64]  # shape (len(item_id), len(phis))
+    min_gold: npt.NDArray[np.float64]
+    sum_gold: npt.NDArray[np.float64]
+    count: npt.NDArray[np.int64]
+    timestamp: float
+    region: str
+
+    def __len__(self) -> int:
+        return len(self.item_id)
+
+
+def summarize(
+    snapshot: AuctionSnapshot, phis: tuple[float, ...] = PHIS
+) -> ItemSummaries:
+    """
+    Summarize every item in `snapshot` at once.
+
+    The quantile of `phi` is the price of the first auction, walking from the most
+    to the least expensive, at which the fraction of the item's quantity seen so far
+    exceeds `phi`. A `phi` of 1 is the least expensive price. (That's the nearest
+    observation past the actual percentile, counted from the top.)
+
+    This sorts the snapshot once by item and descending price, then finds each
+    quantile of every item with cumulative sums instead of walking each item's
+    auctions.
+    """
+    if not all(0 < phi <= 1 for phi in phis):
+        raise ValueError(f"Quantiles must be in (0, 1], got {phis}")
+
+    # by item, then by descending price. (two argsorts are quicker than np.lexsort
+    # here, because the second stable sort is on plain integers.)
+    order = np.argsort(-snapshot.unit_price)
+    order = order[np.argsort(snapshot.item_id[order], kind="stable")]
+    item_id = snapshot.item_id[order]
+    unit_price = snapshot.unit_price[order]
+    quantity = snapshot.quantity[order].astype(np.int64)
+
+    # reduceat can't take empty input, so there are no items to find in that case
+    starts = np.flatnonzero(np.r_[True, item_id[1:] != item_id[:-1]])[: len(item_id)]
+    ends = np.r_[starts[1:], len(item_id)][: len(starts)].astype(np.intp)
+    lengths = ends - starts
+
+    count = np.add.reduceat(quantity, starts) if len(starts) else quantity
+
+    # the quantity seen so far within each item, as a fraction of the item's total
+    cumulative = np.cumsum(quantity)
+    before_item = cumulative[starts] - quantity[starts]
+    seen_fraction = (cumulative - np.repeat(before_item, lengths)) / np.repeat(
+        count, lengths
+    )
+
+    quantiles_copper = np.empty((len(starts), len(phis)), dtype=np.int64)
+    for phi_index, phi in enumerate(phis):
+        if phi >= 1:
+            quantiles_copper[:, phi_index] = unit_price[ends - 1]
+            continue
+        # the fractions only grow within an item, so counting the ones that haven't
+        # passed phi gives the offset of the first one that has.
+        not_passed = np.add.reduceat(seen_fraction <= phi, starts)
+        quantiles_copper[:, phi_index] = unit_price[starts + not_passed]
+
+    sum_copper = (
+        np.add.reduceat(quantity * unit_price, starts) if len(starts) else count
+    )
+
+    return ItemSummaries(
+        phis=phis,
+        item_id=item_id[starts],
+        quantiles_gold=quantiles_copper / COPPER_PER_GOLD,
+        min_gold=unit_price[ends - 1] / COPPER_PER_GOLD,
+        sum_gold=sum_copper / COPPER_PER_GOLD,
+        count=count,
+        timestamp=snapshot.timestamp,
+        region=snapshot.region,
+    )
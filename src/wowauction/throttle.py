@@ -0,0 +1,21 @@
+import anyio
+from attrs import define, field
+
+
+@define
+class RateLimiter:
+    """
+    Spaces out the start of some work so that it starts at most `per_second` times a
+    second, no matter how many tasks are waiting on it.
+    """
+
+    per_second: float
+    _lock: anyio.Lock = field(init=False, factory=anyio.Lock)
+    _next_start: float = field(init=False, default=0.0)
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = await anyio.current_time()
+            start = max(now, self._next_start)
+            self._next_start = start + 1 / self.per_second
+        await anyio.sleep_until(start)
@@ -1,16 +1,29 @@
 from __future__ import annotations
 
 import csv
+import functools
+import gzip
 import io
-from collections.abc import Iterable
-from typing import Any, Literal
-
-from attrs import frozen
+import math
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Mapping
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Literal
+
+import httpx
+from attrs import define, evolve, field, frozen
 from yarl import URL
 
-from wowauction.auction import Auction
-from wowauction.http_client import CLIENT
+from wowauction.depth import ItemDepths
+from wowauction.exported import ExportedSeries
+from wowauction.http_client import VMAGENT_CLIENT
 from wowauction.item import Item
+from wowauction.market import ItemMarket
+from wowauction.summary import ItemSummaries
+
+if TYPE_CHECKING:
+    # the spool sends its requests with this module
+    from wowauction.spool import ExportSpool
 
 
 @frozen
@@ -20,171 +33,449 @@ class _CSVRule:
     value: Any
 
 
-@frozen
-class _CSVRuleCollection:
+def _csv_line(values: Iterable[Any]) -> str:
+    csv_output = io.StringIO()
+    csv_writer = csv.writer(csv_output, lineterminator="\n")
+    csv_writer.writerow(values)
+    line = csv_output.getvalue()
+    csv_output.close()
+    return line
+
+
+def _format_parameter_value(columns: Iterable[tuple[str, str]]) -> str:
     """
-    The URL and data for importing arbitrary data into VictoriaMetrics,
+    The format for importing arbitrary data into VictoriaMetrics,
     https://docs.victoriametrics.com/Single-server-VictoriaMetrics.html#how-to-import-csv-data
     """
+    return ",".join(
+        f"{idx}:{type_}:{name}" for idx, (type_, name) in enumerate(columns, start=1)
+    )
+
+
+# every item row starts with these labels. see _ItemLabels.
+_ITEM_LABEL_NAMES = (
+    "region",
+    "id",
+    "name",
+    "quality",
+    "rank",
+    "major",
+    "minor",
+    "patch",
+    "build",
+)
+
+
+def _item_row_format(*columns: tuple[str, str]) -> str:
+    return _format_parameter_value(
+        [*(("label", name) for name in _ITEM_LABEL_NAMES), *columns]
+    )
+
+
+# the formats of the rows we export, worked out once
+_QUANTILE_FORMAT = _item_row_format(
+    ("label", "quantile"), ("metric", "auction_price_gold"), ("time", "unix_s")
+)
+_SUM_AND_COUNT_FORMAT = _item_row_format(
+    ("metric", "auction_price_gold_sum"),
+    ("metric", "auction_price_gold_count"),
+    ("time", "unix_s"),
+)
+_MIN_FORMAT = _item_row_format(("metric", "auction_price_gold_min"), ("time", "unix_s"))
+_DEPTH_FORMAT = _item_row_format(
+    ("label", "le"),
+    ("metric", "auction_depth_quantity"),
+    ("metric", "auction_depth_cost_gold"),
+    ("time", "unix_s"),
+)
+_CANDLE_FORMAT = _item_row_format(
+    ("label", "resolution"),
+    ("metric", "auction_candle_open_gold"),
+    ("metric", "auction_candle_high_gold"),
+    ("metric", "auction_candle_low_gold"),
+    ("metric", "auction_candle_close_gold"),
+    ("time", "unix_s"),
+)
+_MARKET_FORMAT = _item_row_format(
+    ("metric", "auction_price_gold_vwap"),
+    ("metric", "auction_price_gold_spread"),
+    ("time", "unix_s"),
+)
+_SUPPLY_DELTA_FORMAT = _item_row_format(
+    ("metric", "auction_supply_delta"), ("time", "unix_s")
+)
 
-    url_format_parameter_value: str
-    post_data: str
 
-    @classmethod
-    def from_rules(cls, rules: Iterable[_CSVRule]) -> _CSVRuleCollection:
-        csv_records = []
-        param_records = []
+@frozen
+class _ItemLabels:
+    """
+    The CSV of each item's labels, rendered once and reused for every row of the item
+    in every pull. Each one ends with a comma, so a row is its labels plus its values.
+    """
 
-        for idx, rule in enumerate(rules, start=1):
-            csv_records.append(rule.value)
-            param_records.append(f"{idx}:{rule.type_}:{rule.name}")
+    prefixes: dict[tuple[int, str], tuple[Item, str]] = field(factory=dict)
 
-        csv_output = io.StringIO()
-        csv_writer = csv.writer(csv_output)
-        csv_writer.writerow(csv_records)
-        post_data = csv_output.getvalue()
-        csv_output.close()
+    def prefix(self, item: Item, region: str) -> str:
+        key = (item.id_, region)
+        cached = self.prefixes.get(key)
+        # an item can change when it's refreshed from wowhead
+        if cached is not None and cached[0] == item:
+            return cached[1]
+        prefix = (
+            _csv_line(
+                [
+                    region,
+                    item.id_,
+                    item.name,
+                    item.quality,
+                    item.rank,
+                    item.major,
+                    item.minor,
+                    item.patch,
+                    item.build,
+                ]
+            )[:-1]
+            + ","
+        )
+        self.prefixes[key] = (item, prefix)
+        return prefix
+
+
+@functools.cache
+def _import_url(host: str, port: int, url_format_parameter_value: str) -> str:
+    return str(
+        URL.build(
+            scheme="http",
+            host=host,
+            port=port,
+            path="/api/v1/import/csv",
+            query={"format": url_format_parameter_value},
+        )
+    )
+
+
+@define
+class ExportBatch:
+    """
+    The CSV rows collected over a pull, grouped by their column format. VictoriaMetrics
+    accepts any number of rows in one import request as long as they share a format, so
+    each group can be sent in a few large requests instead of one request per row.
+    """
 
-        url_format_parameter_value = ",".join(param_records)
+    rows_for_format: dict[str, list[str]] = field(factory=lambda: defaultdict(list))
 
-        return _CSVRuleCollection(
-            url_format_parameter_value=url_format_parameter_value, post_data=post_data
+    # the rows left out because their series hadn't changed. see ExportedSeries.
+    unchanged_row_count: int = 0
+
+    def add(self, rules: Iterable[_CSVRule]) -> None:
+        """Add one row of any format."""
+        rules = list(rules)
+        url_format_parameter_value = _format_parameter_value(
+            (rule.type_, rule.name) for rule in rules
+        )
+        self.rows_for_format[url_format_parameter_value].append(
+            _csv_line(rule.value for rule in rules)
         )
 
-    def url(self, host: str, port: int) -> str:
-        return str(
-            URL.build(
-                scheme="http",
-                host=host,
-                port=port,
-                path="/api/v1/import/csv",
-                query={"format": self.url_format_parameter_value},
-            )
+    def add_metrics(
+        self, labels: Mapping[str, Any], metrics: Mapping[str, float]
+    ) -> None:
+        """Add one row of some metrics, all with the same labels."""
+        self.add(
+            [
+                *(_CSVRule("label", name, value) for name, value in labels.items()),
+                *(_CSVRule("metric", name, value) for name, value in metrics.items()),
+            ]
         )
 
+    def extend(self, url_format_parameter_value: str, rows: Iterable[str]) -> None:
+        """Add rows that are already rendered as CSV lines of the given format."""
+        self.rows_for_format[url_format_parameter_value].extend(rows)
+
+    @property
+    def row_count(self) -> int:
+        return sum(len(rows) for rows in self.rows_for_format.values())
+
+
+@frozen
+class ImportRequest:
+    url: str
+    content: bytes
+    row_count: int
+
+    # the Content-Encoding of `content`, if it's compressed
+    content_encoding: str | None = None
+
+
+@define
+class ExportStats:
+    """Running totals of the import requests sent to vmagent by this process."""
+
+    request_count: int = 0
+    error_count: int = 0
+    byte_count: int = 0
+
 
 @frozen
 class VMAgentAPI:
     host: str
     port: int
 
-    @staticmethod
-    def _label_rules_for_item(item: Item) -> Iterable[_CSVRule]:
-        return [
-            _CSVRule("label", "id", item.id_),
-            _CSVRule("label", "name", item.name),
-            _CSVRule("label", "quality", item.quality),
-            _CSVRule("label", "rank", item.rank),
-            _CSVRule("label", "major", item.major),
-            _CSVRule("label", "minor", item.minor),
-            _CSVRule("label", "patch", item.patch),
-            _CSVRule("label", "build", item.build),
-        ]
-
-    async def export_auction(self, auction: Auction) -> None:
-        rule_collection = _CSVRuleCollection.from_rules(
-            [
-                *self._label_rules_for_item(auction.item),
-                _CSVRule("metric", "auction_price_gold", auction.price_gold),
-                _CSVRule("metric", "auction_items_total", auction.quantity),
-                _CSVRule(
-                    "metric", "auction_time_left_minutes", auction.time_left_minutes
-                ),
-                _CSVRule("time", "unix_s", int(auction.timestamp)),
-            ]
-        )
-
-        await CLIENT.post(
-            url=rule_collection.url(self.host, self.port),
-            content=rule_collection.post_data,
-        )
+    # the most rows that go into one import request. vmagent buffers and forwards these
+    # itself, so this mostly just bounds the size of any single request body.
+    max_batch_rows: int = 10_000
 
-    async def export_auction_summary(self, auctions: list[Auction]) -> None:
-        """
-        Export a "summary" of auctions (which must be of the same item). This summary
-        includes pricing quantiles, a total count of items, and a total sum of the
-        auction prices.
+    # the gzip level of the import request bodies, or None to send them uncompressed.
+    # the rows repeat their labels a lot, so even the fastest level shrinks them to a
+    # fraction of their size.
+    gzip_level: int | None = 1
 
-        The method for calculating the quantiles is to use the nearest observation that
-        is greater actual percentile (or whatever... dunno how to describe. see code)
+    # the series already exported, to skip the ones that haven't changed since, or None
+    # to export every series of every pull
+    exported: ExportedSeries | None = None
 
-        See https://prometheus.io/docs/concepts/metric_types/#summary for metric detail.
-        """
-        # we sort it literally, but just in case edits down the road
-        phis = sorted([0.5, 0.75, 0.9, 0.95, 0.99, 0.999, 1])
-        percentiles = {}
+    # where import requests are appended, for `wowauction.spool.drain` to send on, or
+    # None to send them right away
+    spool: ExportSpool | None = None
 
-        total_items = sum(auction.quantity for auction in auctions)
-        items_seen = 0
-        phi_index = 0
-        auctions_sorted_by_price = sorted(
-            auctions, key=lambda a: a.price_gold, reverse=True
-        )
-        for auction in auctions_sorted_by_price:
-            items_seen += auction.quantity
+    _item_labels: _ItemLabels = field(init=False, factory=_ItemLabels)
+    stats: ExportStats = field(init=False, factory=ExportStats)
 
-            cur_percent = items_seen / total_items
+    async def send(self, batch: ExportBatch) -> None:
+        if self.spool is not None:
+            await self.spool.append(list(self.requests(batch)))
+            return
+        for request in self.requests(batch):
+            await self.post(request)
 
-            while phis[phi_index] < cur_percent and phi_index < len(phis):
-                percentiles[phis[phi_index]] = auction.price_gold
-                phi_index += 1
+    def requests(self, batch: ExportBatch) -> Iterator[ImportRequest]:
+        """
+        Split a batch into import requests of at most `max_batch_rows` rows each,
+        compressed if `gzip_level` is set.
+        """
+        content_encoding = "gzip" if self.gzip_level is not None else None
+        for url_format_parameter_value, rows in batch.rows_for_format.items():
+            url = _import_url(self.host, self.port, url_format_parameter_value)
+            rows_iter = iter(rows)
+            while chunk := list(islice(rows_iter, self.max_batch_rows)):
+                content = "".join(chunk).encode()
+                if self.gzip_level is not None:
+                    content = gzip.compress(
+                        content, compresslevel=self.gzip_level, mtime=0
+                    )
+                yield ImportRequest(
+                    url=url,
+                    content=content,
+                    row_count=len(chunk),
+                    content_encoding=content_encoding,
+                )
+
+    async def post(self, request: ImportRequest) -> None:
+        """
+        Send an import request, or append it to the spool, if there is one. Raises an
+        httpx.HTTPError if the request couldn't be sent, or if vmagent didn't take its
+        rows. That fails the pull, so that the series it marked as exported are
+        forgotten (see `ExportedSeries.forget`) and sent again by the next one.
+        """
+        if self.spool is not None:
+            await self.spool.append([request])
+            return
+        response = await self.post_now(request)
+        response.raise_for_status()
 
-            # in case we don't include 1, we can fast break
-            if phi_index == len(phis):
-                break
+    async def post_now(self, request: ImportRequest) -> httpx.Response:
+        """
+        Send an import request to vmagent, and return its response, which is counted
+        but not raised if it's an error. Raises an httpx.HTTPError if the request
+        couldn't be sent.
+        """
+        stats = self.stats
+        stats.request_count += 1
+        stats.byte_count += len(request.content)
+        try:
+            response = await VMAGENT_CLIENT.post(
+                url=request.url,
+                content=request.content,
+                headers=(
+                    {"Content-Encoding": request.content_encoding}
+                    if request.content_encoding is not None
+                    else None
+                ),
+            )
+        except Exception:
+            stats.error_count += 1
+            raise
+        if response.is_error:
+            stats.error_count += 1
+        return response
+
+    def retargeted(self, request: ImportRequest) -> ImportRequest:
+        """
+        `request`, sent to this vmagent, e.g. if it was spooled for another one before
+        a restart.
+        """
+        url = _import_url(self.host, self.port, URL(request.url).query["format"])
+        return request if url == request.url else evolve(request, url=url)
 
-        # # for when we do include 1, we need to check after all auctions
-        if phi_index < len(phis):
-            percentiles[phis[phi_index]] = auctions_sorted_by_price[-1].price_gold
+    def export_item_summaries(
+        self, batch: ExportBatch, items: Mapping[int, Item], summaries: ItemSummaries
+    ) -> None:
+        """
+        Export the summary (pricing quantiles, a total count of items, and a total sum
+        of the auction prices) and the minimum price of every summarized item.
 
-        item_rules = self._label_rules_for_item(auctions[0].item)
+        The rows are stamped with the time of the snapshot, so that replayed snapshots
+        land where they were pulled. Series that haven't changed since they were last
+        exported are left out, if `exported` is set.
 
-        # send quantiles
-        for phi, percentile in percentiles.items():
-            quantile_rule_collection = _CSVRuleCollection.from_rules(
-                [
-                    *item_rules,
-                    _CSVRule("label", "quantile", phi),
-                    _CSVRule("metric", "auction_price_gold", percentile),
-                ]
+        See https://prometheus.io/docs/concepts/metric_types/#summary for metric detail.
+        """
+        quantile_series: list[tuple[str, str]] = []
+        sum_and_count_series = []
+        min_series = []
+
+        phi_labels = [str(phi) for phi in summaries.phis]
+        for item_id, quantiles, min_gold, sum_gold, count in zip(
+            summaries.item_id.tolist(),
+            summaries.quantiles_gold.tolist(),
+            summaries.min_gold.tolist(),
+            summaries.sum_gold.tolist(),
+            summaries.count.tolist(),
+        ):
+            item = items[item_id]
+            prefix = self._item_labels.prefix(item, summaries.region)
+
+            quantile_series.extend(
+                (f"{prefix}{phi_label},", f"{quantile!r}")
+                for phi_label, quantile in zip(phi_labels, quantiles)
             )
-            await CLIENT.post(
-                url=quantile_rule_collection.url(self.host, self.port),
-                content=quantile_rule_collection.post_data,
+            sum_and_count_series.append((prefix, f"{sum_gold!r},{count}"))
+            min_series.append((prefix, f"{min_gold!r}"))
+
+        timestamp = int(summaries.timestamp)
+        for url_format_parameter_value, series in (
+            (_QUANTILE_FORMAT, quantile_series),
+            (_SUM_AND_COUNT_FORMAT, sum_and_count_series),
+            (_MIN_FORMAT, min_series),
+        ):
+            self._extend_changed(
+                batch, url_format_parameter_value, summaries.region, timestamp, series
             )
 
-        # send sum
-        sum_and_count_rule_collection = _CSVRuleCollection.from_rules(
-            [
-                *item_rules,
-                _CSVRule(
-                    "metric",
-                    "auction_price_gold_sum",
-                    sum(auction.quantity * auction.price_gold for auction in auctions),
-                ),
-                _CSVRule("metric", "auction_price_gold_count", total_items),
-            ]
-        )
-        await CLIENT.post(
-            url=sum_and_count_rule_collection.url(self.host, self.port),
-            content=sum_and_count_rule_collection.post_data,
+    def export_item_depths(
+        self, batch: ExportBatch, items: Mapping[int, Item], depths: ItemDepths
+    ) -> None:
+        """
+        Export the order book depth of every item: the quantity for sale at or under
+        each price level, and the cost of buying all of it. The `le` label is the level
+        as a multiple of the item's minimum price, like the buckets of a histogram.
+        """
+        edge_labels = [
+            "+Inf" if math.isinf(edge) else str(edge) for edge in depths.edges
+        ]
+        series: list[tuple[str, str]] = []
+        for item_id, quantities, costs_gold in zip(
+            depths.item_id.tolist(), depths.quantity.tolist(), depths.cost_gold.tolist()
+        ):
+            prefix = self._item_labels.prefix(items[item_id], depths.region)
+            series.extend(
+                (f"{prefix}{edge_label},", f"{quantity},{cost_gold!r}")
+                for edge_label, quantity, cost_gold in zip(
+                    edge_labels, quantities, costs_gold
+                )
+            )
+        self._extend_changed(
+            batch, _DEPTH_FORMAT, depths.region, int(depths.timestamp), series
         )
 
-        # TODO delete this, just for debug
-        print(f"{auctions[0].item.name} ({total_items:,}x): {percentiles}")
+    def export_item_market(
+        self, batch: ExportBatch, items: Mapping[int, Item], market: ItemMarket
+    ) -> None:
+        """
+        Export the candles of every item, at each resolution by the `resolution` label,
+        and its VWAP, spread and change in supply. See `MarketTracker`.
+        """
+        region = market.region
+        timestamp = int(market.timestamp)
+        item_labels = self._item_labels
+        prefixes = {
+            item_id: item_labels.prefix(items[item_id], region)
+            for item_id in market.item_id.tolist()
+        }
+
+        candle_series: list[tuple[str, str]] = []
+        for candles in market.candles:
+            candle_series.extend(
+                (
+                    f"{prefixes[item_id]}{candles.resolution},",
+                    f"{open_gold!r},{high_gold!r},{low_gold!r},{close_gold!r}",
+                )
+                for item_id, open_gold, high_gold, low_gold, close_gold in zip(
+                    candles.item_id.tolist(),
+                    candles.open_gold.tolist(),
+                    candles.high_gold.tolist(),
+                    candles.low_gold.tolist(),
+                    candles.close_gold.tolist(),
+                )
+            )
+        market_series = [
+            (prefixes[item_id], f"{vwap_gold!r},{spread_gold!r}")
+            for item_id, vwap_gold, spread_gold in zip(
+                market.item_id.tolist(),
+                market.vwap_gold.tolist(),
+                market.spread_gold.tolist(),
+            )
+        ]
+        supply_series = [
+            (prefixes[item_id], str(supply_delta))
+            for item_id, supply_delta in zip(
+                market.supply_item_id.tolist(), market.supply_delta.tolist()
+            )
+        ]
+
+        for url_format_parameter_value, series in (
+            (_CANDLE_FORMAT, candle_series),
+            (_MARKET_FORMAT, market_series),
+            (_SUPPLY_DELTA_FORMAT, supply_series),
+        ):
+            self._extend_changed(
+                batch, url_format_parameter_value, region, timestamp, series
+            )
 
-    async def export_auction_min(self, auctions: list[Auction]) -> None:
-        rule_collection = _CSVRuleCollection.from_rules(
-            [
-                *self._label_rules_for_item(auctions[0].item),
-                _CSVRule(
-                    "metric",
-                    "auction_price_gold_min",
-                    min(auction.price_gold for auction in auctions),
-                ),
-            ]
-        )
-        await CLIENT.post(
-            url=rule_collection.url(self.host, self.port),
-            content=rule_collection.post_data,
-        )
+    def _extend_changed(
+        self,
+        batch: ExportBatch,
+        url_format_parameter_value: str,
+        region: str,
+        timestamp: int,
+        series: Iterable[tuple[str, str]],
+    ) -> None:
+        """
+        Add a row for each series, given as its labels and values rendered as CSV, if
+        it changed since it was last exported (or every one, if `exported` is None).
+        """
+        exported = self.exported
+        if exported is None:
+            batch.extend(
+                url_format_parameter_value,
+                [f"{labels}{values},{timestamp}\n" for labels, values in series],
+            )
+            return
+
+        sent = exported.series_for(region, url_format_parameter_value)
+        refresh_seconds = exported.refresh_seconds
+        rows = []
+        unchanged_count = 0
+        for labels, values in series:
+            last = sent.get(labels)
+            if (
+                last is not None
+                and last[0] == values
+                and timestamp - last[1] < refresh_seconds
+            ):
+                unchanged_count += 1
+                continue
+            sent[labels] = (values, timestamp)
+            rows.append(f"{labels}{values},{timestamp}\n")
+        batch.extend(url_format_parameter_value, rows)
+        batch.unchanged_row_count += unchanged_count
@@ -0,0 +1,60 @@
+"""
+The CPU-heavy parts of a pull, as plain functions of picklable arguments, so they can
+run in a worker process (with `anyio.to_process.run_sync`) instead of on the event
+loop. Parsing a segment of the commodities payload and summarizing a snapshot each
+take long enough to stall every timer, keep-alive and other region's pull otherwise.
+
+What goes to and comes back from a worker is kept compact: raw bytes and the small
+state of a scanner in, snapshots and summaries (a few NumPy arrays each) out, never a
+list of parsed auction dicts.
+"""
+
+from __future__ import annotations
+
+from wowauction.depth import ItemDepths, depth
+from wowauction.itemfilter import ItemIDFilter
+from wowauction.jsonstream import ArrayScanner
+from wowauction.snapshot import AuctionSnapshot, AuctionSnapshotBuilder
+from wowauction.summary import PHIS, ItemSummaries, summarize
+
+
+def parse_segment(
+    scanner: ArrayScanner,
+    segment: bytes | None,
+    timestamp: float,
+    region: str,
+    id_filter: ItemIDFilter | None = None,
+) -> tuple[ArrayScanner, AuctionSnapshot, int]:
+    """
+    Parse the auctions completed by the next `segment` of a commodities payload, or the
+    rest of them if `segment` is None (the end of the payload). Returns the scanner to
+    pass along with the next segment, a snapshot of the auctions, and the number of
+    auctions left out of it by `id_filter`.
+    """
+    builder = AuctionSnapshotBuilder()
+    elements = scanner.feed(segment) if segment is not None else scanner.close()
+    if id_filter is None:
+        for blizz_auction_obj in elements:
+            builder.add(blizz_auction_obj)
+        return scanner, builder.build(timestamp=timestamp, region=region), 0
+
+    ids, allow = id_filter.ids, id_filter.allow
+    filtered_count = 0
+    for blizz_auction_obj in elements:
+        if (blizz_auction_obj["item"]["id"] in ids) == allow:
+            builder.add(blizz_auction_obj)
+        else:
+            filtered_count += 1
+    return scanner, builder.build(timestamp=timestamp, region=region), filtered_count
+
+
+def summarize_and_depth(
+    snapshot: AuctionSnapshot,
+    phis: tuple[float, ...] = PHIS,
+    depth_edges: tuple[float, ...] = (),
+) -> tuple[ItemSummaries, ItemDepths | None]:
+    """`summarize` the snapshot, and find its `depth` if there are `depth_edges`."""
+    return (
+        summarize(snapshot, phis),
+        depth(snapshot, depth_edges) if depth_edges else None,
+    )
@@ -1,11 +1,21 @@
+from __future__ import annotations
+
+import gzip
+import html
+import os
 import re
+from collections.abc import Iterator
+from pathlib import Path
 
-from bs4 import BeautifulSoup
+import anyio
+from attrs import frozen
 from yarl import URL
 
-from wowauction.http_client import CLIENT
+from wowauction.http_client import WOWHEAD_CLIENT
 from wowauction.item import Item
 
+NAME_PATTERN = re.compile(r"<h1\b[^>]*>(?P<inner>.*?)</h1>", re.DOTALL)
+TAG_PATTERN = re.compile(r"<[^>]*>")
 RANK_PATTERN = re.compile(r"professions-chaticon-quality-tier(?P<rank>\d+)\.png")
 QUALITY_PATTERN = re.compile(r"<!--nstart--><b class=\\\"q(?P<quality>\d+)\\\">")
 VERSION_PATTERN = re.compile(
@@ -13,28 +23,66 @@ VERSION_PATTERN = re.compile(
 )
 
 
-async def lookup(id_: str) -> Item:
+@frozen
+class PageArchive:
     """
-    Look up an item on wowhead by its ID.
+    The wowhead item pages we've fetched, as they were, so that the items can be
+    extracted from them again (e.g. after fixing `parse_item_page`) without fetching
+    every page again. See the `reparse-items` command.
 
-    In the long run, this function will not be used often. It's just used to build out
-    the cache initially.
+    Each page is gzipped at `<directory>/<id>.html.gz`.
     """
-    url = str(URL.build(scheme="https", host="www.wowhead.com", path=f"/item={id_}"))
 
-    response = await CLIENT.get(url, follow_redirects=True)
-    source = response.text
-    soup = BeautifulSoup(source, "html.parser")
+    directory: Path
+
+    def path_for(self, id_: int) -> Path:
+        return self.directory / f"{id_}.html.gz"
+
+    def write(self, id_: int, source: str) -> None:
+        """
+        Save the page of an item. This blocks while it compresses, so run it in a
+        worker thread from async code.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(id_)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(gzip.compress(source.encode(), compresslevel=6, mtime=0))
+        os.replace(tmp_path, path)
 
-    # name
-    name_ele = soup.select_one("h1")
-    if name_ele is None:
-        raise ValueError(f"Couldn't find name of item with id {id_} ({url})")
-    name = next(name_ele.stripped_strings)
+    def read(self, id_: int) -> str:
+        return gzip.decompress(self.path_for(id_).read_bytes()).decode()
+
+    def ids(self) -> Iterator[int]:
+        """The IDs of the items whose pages are saved."""
+        for path in self.directory.glob("*.html.gz"):
+            yield int(path.name.removesuffix(".html.gz"))
+
+
+def parse_item_page(id_: int, source: str) -> Item:
+    """
+    Extract an item from the source of its wowhead page.
+
+    The page is a few hundred KB of HTML and script, but everything we need is in a few
+    recognizable places, so each one is found with a regex instead of building a DOM
+    of the whole page.
+    """
+    # name: the first text in the page's heading
+    if (name_match := NAME_PATTERN.search(source)) is None:
+        raise ValueError(f"Couldn't find name of item with id {id_}")
+    name = next(
+        (
+            stripped
+            for text in TAG_PATTERN.split(name_match.group("inner"))
+            if (stripped := html.unescape(text).strip())
+        ),
+        None,
+    )
+    if name is None:
+        raise ValueError(f"Couldn't find name of item with id {id_}")
 
     # quality
     if (quality_match := QUALITY_PATTERN.search(source)) is None:
-        raise ValueError(f"Couldn't find quality of item with id {id_} ({url})")
+        raise ValueError(f"Couldn't find quality of item with id {id_}")
     quality = int(quality_match.group("quality"))
 
     # rank
@@ -44,13 +92,13 @@ async def lookup(id_: str) -> Item:
 
     # major, minor, patch, build
     if (version_match := VERSION_PATTERN.search(source)) is None:
-        raise ValueError(f"Couldn't find version of item with id {id_} ({url})")
+        raise ValueError(f"Couldn't find version of item with id {id_}")
     major = int(version_match.group("major"))
     minor = int(version_match.group("minor"))
     patch = int(version_match.group("patch"))
     build = int(version_match.group("build"))
 
-    item = Item(
+    return Item(
         id_=id_,
         name=name,
         quality=quality,
@@ -61,4 +109,30 @@ async def lookup(id_: str) -> Item:
         build=build,
     )
 
-    return item
+
+async def lookup(id_: int, page_archive: PageArchive | None = None) -> Item:
+    """
+    Look up an item on wowhead by its ID, and save its page to `page_archive` if one is
+    given.
+
+    In the long run, this function will not be used often. It's just used to build out
+    the cache initially.
+    """
+    url = str(URL.build(scheme="https", host="www.wowhead.com", path=f"/item={id_}"))
+
+    response = await WOWHEAD_CLIENT.get(url, follow_redirects=True)
+    source = response.text
+
+    # saved before it's parsed, so a page we fail to parse can be fixed up later. the
+    # archive is best-effort, like the snapshot one: the item is still parsed if the
+    # page couldn't be written.
+    if page_archive is not None and response.is_success:
+        try:
+            await anyio.to_thread.run_sync(page_archive.write, id_, source)
+        except OSError as exc:
+            print(f"couldn't archive the page of item {id_}: {exc!r}")
+
+    try:
+        return parse_item_page(id_, source)
+    except ValueError as exc:
+        raise ValueError(f"{exc} ({url})") from None
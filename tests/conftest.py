@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import shutil
+import socket
+from collections.abc import Iterator
+from pathlib import Path
+
+import httpx
+import pytest
+from fixtures import ITEM_DB_PATH, synthetic_commodities_payload
+
+import wowauction.vmagent
+from wowauction.cache import Cache
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def vmagent_client(monkeypatch: pytest.MonkeyPatch) -> None:
+    # each test has its own event loop, which the shared client's connections can't
+    # outlive
+    monkeypatch.setattr(wowauction.vmagent, "VMAGENT_CLIENT", httpx.AsyncClient())
+
+
+@pytest.fixture
+def closed_port() -> int:
+    """A local port that nothing is listening on, for a vmagent that's down."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> Iterator[Cache]:
+    """A copy of the shipped item cache, so that pulls don't look anything up."""
+    item_db_path = tmp_path / "item.db"
+    shutil.copy(ITEM_DB_PATH, item_db_path)
+    with Cache.open(item_db_path) as cache:
+        yield cache
+
+
+@pytest.fixture(scope="session")
+def payload() -> bytes:
+    return synthetic_commodities_payload(auction_count=2_000, item_count=200)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+from typing import cast
+
+import anyio
+import httpx
+import pytest
+from vmsink import VMSink
+
+import wowauction.blizzard
+import wowauction.oauth
+from wowauction.blizzard import BlizzardAPI
+from wowauction.cache import Cache
+from wowauction.itemfilter import ItemFilter
+from wowauction.oauth import TokenManager
+from wowauction.pipeline import PullOptions, StageFailed, run_pull
+from wowauction.vmagent import VMAgentAPI
+
+OPTIONS = PullOptions(
+    item_filter=ItemFilter(min_major=0, min_quality=0), worker_processes=False
+)
+
+LAST_MODIFIED = "Tue, 14 Mar 2023 18:04:05 GMT"
+
+
+@pytest.fixture
+def commodities_requests(
+    monkeypatch: pytest.MonkeyPatch, payload: bytes
+) -> list[httpx.Request]:
+    """
+    Stand in for Blizzard, with a commodities snapshot that never changes, and return
+    the commodities requests made to it.
+    """
+    requests = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "oauth.battle.net":
+            return httpx.Response(
+                200, content=json.dumps({"access_token": "t", "expires_in": 86400})
+            )
+        requests.append(request)
+        if request.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            return httpx.Response(304)
+        return httpx.Response(
+            200, content=payload, headers={"Last-Modified": LAST_MODIFIED}
+        )
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    monkeypatch.setattr(wowauction.blizzard, "BLIZZARD_CLIENT", client)
+    monkeypatch.setattr(wowauction.oauth, "BLIZZARD_CLIENT", client)
+    return requests
+
+
+@pytest.mark.anyio
+async def test_failed_export_is_downloaded_again(
+    cache: Cache, commodities_requests: list[httpx.Request], closed_port: int
+) -> None:
+    blizzard_api = BlizzardAPI(TokenManager("id", "secret"))
+    with pytest.raises(StageFailed):
+        await run_pull(
+            blizzard_api, VMAgentAPI(host="127.0.0.1", port=closed_port), cache, OPTIONS
+        )
+    assert blizzard_api.published_at is None
+
+    sink = VMSink()
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(sink.serve))
+        vmagent_api = VMAgentAPI(host="127.0.0.1", port=port)
+
+        # not a 304, though it's the same snapshot
+        report = await run_pull(blizzard_api, vmagent_api, cache, OPTIONS)
+        assert "If-Modified-Since" not in commodities_requests[1].headers
+        assert report is not None
+        assert sink.counts.row_count == report.row_count > 0
+        assert blizzard_api.last_modified == LAST_MODIFIED
+
+        # now it's been exported, it isn't again
+        assert await run_pull(blizzard_api, vmagent_api, cache, OPTIONS) is None
+        assert commodities_requests[2].headers["If-Modified-Since"] == LAST_MODIFIED
+
+        task_group.cancel_scope.cancel()
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from pathlib import Path
+
+import anyio
+import httpx
+import pytest
+from attrs import define, field
+from fixtures import synthetic_item_page
+
+import wowauction.wowhead
+from wowauction.cache import Cache
+from wowauction.wowhead import PageArchive
+
+# served with a 503, refused outright, and served as a page that can't be parsed
+UNAVAILABLE_ID = 1003
+REFUSED_ID = 1006
+GARBLED_ID = 1009
+FAILING_IDS = [UNAVAILABLE_ID, REFUSED_ID, GARBLED_ID]
+
+
+@define
+class FakeWowhead:
+    """Serves a synthetic page for each item, taking a while over each one."""
+
+    delay_seconds: float = 0.02
+    requested_ids: list[int] = field(factory=list)
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        id_ = int(request.url.path.removeprefix("/item="))
+        self.requested_ids.append(id_)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await anyio.sleep(self.delay_seconds)
+        finally:
+            self.in_flight -= 1
+        if id_ == UNAVAILABLE_ID:
+            return httpx.Response(503, text="<html>busy</html>")
+        if id_ == REFUSED_ID:
+            raise httpx.ConnectError("connection refused", request=request)
+        if id_ == GARBLED_ID:
+            return httpx.Response(200, text="<html>not an item</html>")
+        page = synthetic_item_page(
+            id_, f"Item {id_}", 1, None, "10.0.5.48001", filler_bytes=1_000
+        )
+        return httpx.Response(200, text=page)
+
+
+@pytest.fixture
+def wowhead(monkeypatch: pytest.MonkeyPatch) -> FakeWowhead:
+    fake = FakeWowhead()
+    # (an async handler works, though httpx only types a sync one)
+    transport = httpx.MockTransport(fake.handle)  # type: ignore[arg-type]
+    client = httpx.AsyncClient(transport=transport)
+    monkeypatch.setattr(wowauction.wowhead, "WOWHEAD_CLIENT", client)
+    return fake
+
+
+@pytest.fixture
+def empty_cache(tmp_path: Path) -> Iterator[Cache]:
+    with Cache.open(tmp_path / "item.db") as cache:
+        yield cache
+
+
+@pytest.mark.anyio
+async def test_prefetch_looks_up_concurrently(
+    empty_cache: Cache, wowhead: FakeWowhead
+) -> None:
+    ids = list(range(1000, 1012))
+    failed = await empty_cache.prefetch(ids, concurrency=4, max_per_second=1_000)
+
+    assert sorted(failed) == FAILING_IDS
+    assert sorted(wowhead.requested_ids) == ids
+    assert 1 < wowhead.max_in_flight <= 4
+    for id_ in ids:
+        item = empty_cache.get(id_=id_)
+        if id_ in FAILING_IDS:
+            assert item is None
+        else:
+            assert item is not None and item.name == f"Item {id_}"
+    assert empty_cache.lookup_stats.lookup_count == len(ids)
+    assert empty_cache.lookup_stats.failure_count == len(FAILING_IDS)
+
+
+@pytest.mark.anyio
+async def test_prefetch_retries_only_the_failures(
+    empty_cache: Cache, wowhead: FakeWowhead
+) -> None:
+    ids = list(range(1000, 1012))
+    await empty_cache.prefetch(ids, max_per_second=1_000)
+    wowhead.requested_ids.clear()
+
+    failed = await empty_cache.prefetch(ids, max_per_second=1_000)
+    assert sorted(failed) == FAILING_IDS
+    assert sorted(wowhead.requested_ids) == FAILING_IDS
+
+
+@pytest.mark.anyio
+async def test_concurrent_prefetches_share_lookups(
+    empty_cache: Cache, wowhead: FakeWowhead
+) -> None:
+    failed: dict[str, list[int]] = {}
+
+    async def prefetch(name: str, ids: list[int]) -> None:
+        failed[name] = await empty_cache.prefetch(ids, max_per_second=1_000)
+
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(prefetch, "first", list(range(1000, 1008)))
+        task_group.start_soon(prefetch, "second", list(range(1004, 1012)))
+
+    # each item is looked up once, and both see the ones the other looked up
+    assert sorted(wowhead.requested_ids) == list(range(1000, 1012))
+    for id_ in range(1000, 1012):
+        assert (empty_cache.get(id_=id_) is None) == (id_ in FAILING_IDS)
+    assert sorted(failed["first"] + failed["second"]) == FAILING_IDS
+
+
+@pytest.mark.anyio
+async def test_prefetch_keeps_items_whose_page_couldnt_be_archived(
+    tmp_path: Path, wowhead: FakeWowhead
+) -> None:
+    # a file where the archive's directory should be, so every write fails
+    blocked = tmp_path / "pages"
+    blocked.touch()
+    with Cache.open(tmp_path / "item.db", page_archive=PageArchive(blocked)) as cache:
+        failed = await cache.prefetch([1000, 1001], max_per_second=1_000)
+
+        assert failed == []
+        assert all(cache.get(id_=id_) is not None for id_ in [1000, 1001])
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import cast
+
+import anyio
+import pytest
+from anyio.abc import TaskGroup
+
+from wowauction.exposition import MetricsPage
+from wowauction.vmagent import ExportBatch
+
+
+async def _serve(task_group: TaskGroup) -> int:
+    page = MetricsPage()
+    batch = ExportBatch()
+    batch.add_metrics({"region": "us"}, {"auction_count": 3})
+    await page.replace_batch("test", batch)
+    return cast(int, await task_group.start(page.serve, "127.0.0.1"))
+
+
+async def _exchange(port: int, request: bytes) -> bytes:
+    """Send `request` on a new connection, and return all of the response."""
+    async with await anyio.connect_tcp("127.0.0.1", port) as stream:
+        await stream.send(request)
+        await stream.send_eof()
+        response = b""
+        try:
+            while True:
+                response += await stream.receive()
+        except anyio.EndOfStream:
+            return response
+
+
+async def _scrape(port: int) -> bytes:
+    return await _exchange(port, b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("content_length", [b"ten", b"-1", b"\xd9\xa3", b"99999999"])
+async def test_bad_content_length_is_a_bad_request(content_length: bytes) -> None:
+    async with anyio.create_task_group() as task_group:
+        port = await _serve(task_group)
+        response = await _exchange(
+            port,
+            b"GET /metrics HTTP/1.1\r\nContent-Length: " + content_length + b"\r\n\r\n",
+        )
+        assert response.startswith(b"HTTP/1.1 400 ")
+        # and the server is still up
+        assert b'auction_count{region="us"} 3' in await _scrape(port)
+        task_group.cancel_scope.cancel()
+
+
+@pytest.mark.anyio
+async def test_short_body_ends_just_its_connection() -> None:
+    async with anyio.create_task_group() as task_group:
+        port = await _serve(task_group)
+        response = await _exchange(
+            port, b"GET /metrics HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc"
+        )
+        assert response == b""
+        assert b'auction_count{region="us"} 3' in await _scrape(port)
+        task_group.cancel_scope.cancel()
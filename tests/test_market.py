@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import numpy as np
+from attrs import evolve
+from benchmark_summary import random_snapshot
+
+from wowauction.market import ItemMarket, MarketTracker
+from wowauction.summary import ItemSummaries, summarize
+
+
+def snapshots(count: int) -> list[ItemSummaries]:
+    # ten minutes apart, so that they share their candles
+    rng = np.random.default_rng(0)
+    return [
+        summarize(
+            evolve(
+                random_snapshot(rng, 2_000, 100), timestamp=1_700_000_000.0 + 600 * i
+            )
+        )
+        for i in range(count)
+    ]
+
+
+def assert_same(market: ItemMarket, expected: ItemMarket) -> None:
+    for candles, expected_candles in zip(market.candles, expected.candles):
+        assert candles.resolution == expected_candles.resolution
+        for column in ["open_gold", "high_gold", "low_gold", "close_gold"]:
+            assert np.array_equal(
+                getattr(candles, column), getattr(expected_candles, column)
+            )
+    assert np.array_equal(market.supply_item_id, expected.supply_item_id)
+    assert np.array_equal(market.supply_delta, expected.supply_delta)
+
+
+def test_snapshot_given_again_replaces_itself() -> None:
+    first, second, third = snapshots(3)
+    expected = MarketTracker()
+    expected.update(first)
+    expected_second = expected.update(second)
+    expected_third = expected.update(third)
+
+    # the second snapshot's export failed, and its pull was tried again
+    tracker = MarketTracker()
+    tracker.update(first)
+    tracker.update(second)
+    second_again = tracker.update(second)
+
+    assert np.any(second_again.supply_delta != 0)
+    assert_same(second_again, expected_second)
+    assert_same(tracker.update(third), expected_third)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from collections.abc import AsyncGenerator
+from typing import cast
+
+import anyio
+import httpx
+import pytest
+from fixtures import FixtureBlizzardAPI
+from vmsink import VMSink
+
+from wowauction.__main__ import pull_region
+from wowauction.blizzard import DownloadStats
+from wowauction.cache import Cache
+from wowauction.exported import ExportedSeries
+from wowauction.itemfilter import ItemFilter
+from wowauction.pipeline import PullOptions, PullReport, StageFailed, run_pull
+from wowauction.vmagent import VMAgentAPI
+
+# every item of the fixture, in a few segments, with nothing looked up or refreshed
+OPTIONS = PullOptions(
+    segment_bytes=16 * 1024,
+    item_refresh_limit=0,
+    item_filter=ItemFilter(min_major=0, min_quality=0),
+    worker_processes=False,
+)
+
+
+@pytest.mark.anyio
+async def test_failed_export_fails_just_that_pull(
+    cache: Cache, payload: bytes, closed_port: int
+) -> None:
+    sink = VMSink()
+    reports: dict[str, PullReport | None] = {}
+
+    async def pull(region: str, port: int) -> None:
+        reports[region] = await pull_region(
+            FixtureBlizzardAPI(payload, region=region),
+            VMAgentAPI(host="127.0.0.1", port=port),
+            cache,
+            OPTIONS,
+        )
+
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(sink.serve))
+        async with anyio.create_task_group() as pulls:
+            pulls.start_soon(pull, "us", port)
+            pulls.start_soon(pull, "eu", closed_port)
+        task_group.cancel_scope.cancel()
+
+    assert reports["eu"] is None
+    report = reports["us"]
+    assert report is not None
+    assert report.row_count > 0
+    # the pull's rows, then its own metrics
+    assert sink.counts.row_count > report.row_count
+
+
+@pytest.mark.anyio
+async def test_failed_stage_raises_stage_failed(
+    cache: Cache, payload: bytes, closed_port: int
+) -> None:
+    with pytest.raises(StageFailed, match="export") as exc_info:
+        await run_pull(
+            FixtureBlizzardAPI(payload),
+            VMAgentAPI(host="127.0.0.1", port=closed_port),
+            cache,
+            OPTIONS,
+        )
+    assert isinstance(exc_info.value.__cause__, httpx.ConnectError)
+
+
+@pytest.mark.anyio
+async def test_rejected_rows_are_sent_again(cache: Cache, payload: bytes) -> None:
+    exported = ExportedSeries()
+    failing_sink = VMSink(failure_rate=1.0)
+    sink = VMSink()
+    async with anyio.create_task_group() as task_group:
+        failing_port = cast(int, await task_group.start(failing_sink.serve))
+        port = cast(int, await task_group.start(sink.serve))
+
+        report = await pull_region(
+            FixtureBlizzardAPI(payload, timestamp=1_700_000_000.0),
+            VMAgentAPI(host="127.0.0.1", port=failing_port, exported=exported),
+            cache,
+            OPTIONS,
+        )
+        assert report is None
+        assert failing_sink.counts.failed_request_count > 0
+
+        # the next pull isn't told the rejected series are unchanged
+        report = await pull_region(
+            FixtureBlizzardAPI(payload, timestamp=1_700_000_060.0),
+            VMAgentAPI(host="127.0.0.1", port=port, exported=exported),
+            cache,
+            OPTIONS,
+        )
+        task_group.cancel_scope.cancel()
+
+    assert report is not None
+    assert report.unchanged_row_count == 0
+    assert report.row_count > 0
+    # the pull's rows, then its own metrics
+    assert sink.counts.row_count > report.row_count
+
+
+@pytest.mark.anyio
+async def test_truncated_payload_fails_the_download_only(
+    cache: Cache, payload: bytes
+) -> None:
+    class FailingBlizzardAPI(FixtureBlizzardAPI):
+        async def iter_commodity_payload(
+            self, segment_bytes: int = 1024 * 1024, stats: DownloadStats | None = None
+        ) -> AsyncGenerator[bytes, None]:
+            async for segment in super().iter_commodity_payload(segment_bytes, stats):
+                yield segment
+                raise ConnectionError("connection reset")
+
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(VMSink().serve))
+        with pytest.raises(StageFailed, match="download") as exc_info:
+            await run_pull(
+                FailingBlizzardAPI(payload),
+                VMAgentAPI(host="127.0.0.1", port=port),
+                cache,
+                OPTIONS,
+            )
+        task_group.cancel_scope.cancel()
+    # not the parse's complaint about the payload ending early
+    assert isinstance(exc_info.value.__cause__, ConnectionError)
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import cast
+
+import anyio
+import pytest
+from vmsink import VMSink
+
+from wowauction.spool import ExportSpool, drain
+from wowauction.vmagent import ExportBatch, ImportRequest, VMAgentAPI
+
+
+def some_requests(vmagent_api: VMAgentAPI, row_count: int) -> list[ImportRequest]:
+    batch = ExportBatch()
+    for id_ in range(row_count):
+        batch.add_metrics({"region": "us", "id": id_}, {"auction_quantity": id_})
+    return list(vmagent_api.requests(batch))
+
+
+async def drain_all(spool: ExportSpool, vmagent_api: VMAgentAPI) -> None:
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(drain, spool, vmagent_api, 100_000, 8 * 1024 * 1024, 1.0)
+        with anyio.fail_after(10):
+            while spool.pending_bytes:
+                await anyio.sleep(0.01)
+        task_group.cancel_scope.cancel()
+
+
+@pytest.mark.anyio
+async def test_drain_retries_until_delivered(tmp_path: Path) -> None:
+    # a sink that fails every request, until it's failed one
+    sink = VMSink(failure_rate=1.0)
+
+    async def recover() -> None:
+        while not sink.counts.failed_request_count:
+            await anyio.sleep(0.01)
+        sink.failure_rate = 0.0
+
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(sink.serve))
+        task_group.start_soon(recover)
+        vmagent_api = VMAgentAPI(host="127.0.0.1", port=port, max_batch_rows=100)
+        with ExportSpool.open(tmp_path / "spool") as spool:
+            await spool.append(some_requests(vmagent_api, 1_000))
+            await drain_all(spool, vmagent_api)
+        task_group.cancel_scope.cancel()
+
+    assert sink.counts.failed_request_count == 1
+    assert sink.counts.row_count == 1_000
+    assert spool.stats.drained_row_count == 1_000
+    assert spool.stats.rejected_row_count == 0
+
+
+@pytest.mark.anyio
+async def test_torn_record_is_dropped_when_reopened(tmp_path: Path) -> None:
+    sink = VMSink()
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(sink.serve))
+        vmagent_api = VMAgentAPI(host="127.0.0.1", port=port, max_batch_rows=100)
+        with ExportSpool.open(tmp_path / "spool") as spool:
+            spool.write(some_requests(vmagent_api, 1_000))
+            (segment,) = (tmp_path / "spool").glob("*.seg")
+            size = segment.stat().st_size
+
+        # half a record, like a crash mid-append leaves
+        with segment.open("ab") as f:
+            f.write(segment.read_bytes()[:100])
+
+        with ExportSpool.open(tmp_path / "spool") as spool:
+            assert segment.stat().st_size == size
+            await drain_all(spool, vmagent_api)
+        task_group.cancel_scope.cancel()
+
+    assert sink.counts.row_count == 1_000
+
+
+@pytest.mark.anyio
+async def test_corrupt_record_is_dropped(tmp_path: Path) -> None:
+    sink = VMSink()
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(sink.serve))
+        vmagent_api = VMAgentAPI(host="127.0.0.1", port=port)
+        with ExportSpool.open(tmp_path / "spool") as spool:
+            spool.write(some_requests(vmagent_api, 100))
+            (segment,) = (tmp_path / "spool").glob("*.seg")
+            size = segment.stat().st_size
+            spool.write(some_requests(vmagent_api, 200))
+
+            # flip a bit of the last record's content, so its checksum doesn't match
+            data = bytearray(segment.read_bytes())
+            data[-1] ^= 1
+            segment.write_bytes(data)
+
+            await drain_all(spool, vmagent_api)
+        task_group.cancel_scope.cancel()
+
+    assert sink.counts.row_count == 100
+    assert spool.stats.drained_row_count == 100
+    assert spool.stats.dropped_byte_count == len(data) - size
+
+
+@pytest.mark.anyio
+async def test_drain_moves_the_cursor_and_deletes_drained_segments(
+    tmp_path: Path,
+) -> None:
+    sink = VMSink()
+    directory = tmp_path / "spool"
+    async with anyio.create_task_group() as task_group:
+        port = cast(int, await task_group.start(sink.serve))
+        vmagent_api = VMAgentAPI(
+            host="127.0.0.1", port=port, max_batch_rows=100, gzip_level=None
+        )
+        # segments of 8KiB, so that the requests take a few of them
+        with ExportSpool.open(directory, max_bytes=64 * 1024) as spool:
+            for request in some_requests(vmagent_api, 1_000):
+                spool.write([request])
+            assert len(list(directory.glob("*.seg"))) > 1
+            assert spool.stats.dropped_byte_count == 0
+
+            await drain_all(spool, vmagent_api)
+        task_group.cancel_scope.cancel()
+
+    assert sink.counts.row_count == 1_000
+    # all but the segment that's appended to are gone, and that one is drained
+    (segment,) = directory.glob("*.seg")
+    cursor = json.loads((directory / "cursor.json").read_text())
+    assert segment.name == f"{cursor['segment']:012d}.seg"
+    assert cursor["offset"] == segment.stat().st_size
+
+    with ExportSpool.open(directory, max_bytes=64 * 1024) as spool:
+        assert spool.pending_bytes == 0
+        assert spool.read() is None
+
+
+def test_full_spool_drops_its_oldest_segments(tmp_path: Path) -> None:
+    directory = tmp_path / "spool"
+    vmagent_api = VMAgentAPI(
+        host="127.0.0.1", port=8429, max_batch_rows=100, gzip_level=None
+    )
+    requests = some_requests(vmagent_api, 10_000)
+    with ExportSpool.open(directory, max_bytes=64 * 1024) as spool:
+        for request in requests:
+            spool.write([request])
+
+        assert spool.stats.dropped_byte_count > 0
+        assert spool.pending_bytes <= 64 * 1024
+        assert "000000000000.seg" not in {path.name for path in directory.glob("*.seg")}
+        # what's left still starts at a record
+        batch = spool.read(max_rows=1_000_000, max_bytes=1024 * 1024 * 1024)
+        assert batch is not None
+        assert batch.requests[0] in requests
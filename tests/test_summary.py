@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import math
+import random
+
+import numpy as np
+import pytest
+from benchmark_summary import random_snapshot, reference_summary
+
+from wowauction.snapshot import AuctionSnapshot
+from wowauction.summary import summarize
+
+
+def check(snapshot: AuctionSnapshot) -> None:
+    summaries = summarize(snapshot)
+    index = -1
+    for index, (item_id, auctions) in enumerate(snapshot.group_by_item()):
+        assert summaries.item_id[index] == item_id
+        percentiles, min_gold, sum_gold, count = reference_summary(
+            auctions.price_gold.tolist(), auctions.quantity.tolist()
+        )
+        assert list(percentiles) == list(summaries.phis)
+        assert list(percentiles.values()) == summaries.quantiles_gold[index].tolist()
+        assert min_gold == summaries.min_gold[index]
+        assert count == summaries.count[index]
+        # the loop adds floating point gold, and summarize exact copper
+        assert math.isclose(sum_gold, summaries.sum_gold[index], rel_tol=1e-9)
+    assert len(summaries) == index + 1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_summarize_matches_the_reference_loop(seed: int) -> None:
+    # few and many items, ties and single-auction items
+    rng = np.random.default_rng(seed)
+    sizes = random.Random(seed)
+    for _ in range(10):
+        check(
+            random_snapshot(
+                rng, sizes.randint(1, 2_000), sizes.choice([1, 2, 10, 100, 1_000])
+            )
+        )
+
+
+def test_summarize_of_no_auctions() -> None:
+    check(random_snapshot(np.random.default_rng(0), 0, 1))